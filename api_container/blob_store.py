@@ -0,0 +1,148 @@
+from typing import Dict, Iterable, Iterator, Optional
+import json
+import logging as logger
+import os
+import sys
+import uuid
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+CHUNK_SIZE = 256 * 1024 # bytes
+DEFAULT_ATTACHMENTS_DIR = "attachments"
+
+class BlobTooLarge(Exception):
+    pass
+
+class LocalBlobStore:
+    """
+    Stores every blob as a file in `root`, with its metadata in a "<id>.json" file next to it.
+    Blobs are written to a temporary file and renamed once complete, so a failed
+    upload never leaves a readable partial blob.
+    """
+
+    def __init__(self, root: str = DEFAULT_ATTACHMENTS_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, blob_id: str) -> Optional[str]:
+        try:
+            return os.path.join(self.root, str(uuid.UUID(blob_id)))
+        except ValueError:
+            return None
+
+    def save(self, chunks: Iterable[bytes], filename: str, content_type: str, max_size: Optional[int] = None) -> Dict:
+        """
+        Writes the chunks as they come and returns the metadata of the blob.
+        Raises BlobTooLarge (and keeps nothing) once more than `max_size` bytes were received.
+        """
+        blob_id = str(uuid.uuid4())
+        path = self._path(blob_id)
+        size = 0
+        try:
+            with open(f"{path}.part", "wb") as blob:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise BlobTooLarge(f"The blob is larger than {max_size} bytes")
+                    blob.write(chunk)
+        except BaseException:
+            os.remove(f"{path}.part")
+            raise
+        metadata = {"id": blob_id, "filename": filename, "content_type": content_type, "size": size}
+        with open(f"{path}.json", "w") as file:
+            json.dump(metadata, file)
+        os.replace(f"{path}.part", path)
+        return metadata
+
+    def stat(self, blob_id: str) -> Optional[Dict]:
+        path = self._path(blob_id)
+        if not path or not os.path.exists(path):
+            return None
+        with open(f"{path}.json") as file:
+            return json.load(file)
+
+    def open_range(self, blob_id: str, start: int, end: int) -> Iterator[bytes]:
+        """
+        Yields the bytes from `start` to `end` (both included) in chunks.
+        """
+        with open(self._path(blob_id), "rb") as blob:
+            blob.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = blob.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, blob_id: str) -> bool:
+        path = self._path(blob_id)
+        if not path or not os.path.exists(path):
+            return False
+        os.remove(path)
+        os.remove(f"{path}.json")
+        return True
+
+class GridFSBlobStore:
+    """
+    Stores the blobs in a GridFS bucket of the given MongoDB database,
+    split in chunks of CHUNK_SIZE bytes.
+    """
+
+    def __init__(self, db, bucket_name: str = "support-attachments"):
+        import gridfs # Only needed when the GridFS store is configured
+        self.gridfs = gridfs
+        self.bucket = gridfs.GridFSBucket(db, bucket_name, chunk_size_bytes=CHUNK_SIZE)
+        self.files = db[f"{bucket_name}.files"]
+        self.chunks = db[f"{bucket_name}.chunks"]
+
+    def save(self, chunks: Iterable[bytes], filename: str, content_type: str, max_size: Optional[int] = None) -> Dict:
+        blob_id = str(uuid.uuid4())
+        size = 0
+        upload = self.bucket.open_upload_stream_with_id(blob_id, filename, metadata={"content_type": content_type})
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise BlobTooLarge(f"The blob is larger than {max_size} bytes")
+                upload.write(chunk)
+        except BaseException:
+            upload.abort()
+            raise
+        upload.close()
+        return {"id": blob_id, "filename": filename, "content_type": content_type, "size": size}
+
+    def stat(self, blob_id: str) -> Optional[Dict]:
+        try:
+            blob = self.bucket.open_download_stream(blob_id)
+        except self.gridfs.errors.NoFile:
+            return None
+        return {"id": blob_id, "filename": blob.filename, "content_type": blob.metadata["content_type"], "size": blob.length}
+
+    def open_range(self, blob_id: str, start: int, end: int) -> Iterator[bytes]:
+        blob = self.bucket.open_download_stream(blob_id)
+        blob.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = blob.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def delete(self, blob_id: str) -> bool:
+        # Same as GridFSBucket.delete: the file document first, so a half deleted blob is not readable
+        result = self.files.delete_one({"_id": blob_id})
+        self.chunks.delete_many({"files_id": blob_id})
+        return result.deleted_count > 0
+
+def get_blob_store(db=None):
+    """
+    GridFS store in `db` if ATTACHMENTS_BACKEND is "gridfs", files in ATTACHMENTS_DIR otherwise.
+    """
+    if os.getenv('ATTACHMENTS_BACKEND') == 'gridfs':
+        if db is None:
+            logger.error("ATTACHMENTS_BACKEND is gridfs but no database was given, using the local store")
+        else:
+            return GridFSBlobStore(db)
+    return LocalBlobStore(os.getenv('ATTACHMENTS_DIR', DEFAULT_ATTACHMENTS_DIR))
@@ -0,0 +1,117 @@
+from typing import Dict, Optional
+import asyncio
+import json
+import logging as logger
+import os
+import sys
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+
+DEFAULT_QUEUE_SIZE = 100
+CHANNEL_PREFIX = "support-chats:"
+
+class ChatHub:
+    """
+    In-process pub/sub of chat messages, every subscriber gets an asyncio.Queue
+    that is fed from the event loop it subscribed on, so thousands of idle
+    streams cost a queue each and no thread.
+    publish can be called from any thread (the sync endpoints run in a threadpool).
+    With a broker the messages go through it, so subscribers of every worker get them.
+    """
+
+    def __init__(self, broker=None, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.broker = broker
+        if broker:
+            broker.start(self._deliver)
+
+    def subscribe(self, chat_id: str) -> asyncio.Queue:
+        """
+        Must be called from the event loop that reads the queue.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers.setdefault(chat_id, {})[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, chat_id: str, queue: asyncio.Queue):
+        with self.lock:
+            queues = self.subscribers.get(chat_id, {})
+            queues.pop(queue, None)
+            if not queues:
+                self.subscribers.pop(chat_id, None)
+
+    def subscribers_count(self, chat_id: Optional[str] = None) -> int:
+        with self.lock:
+            if chat_id:
+                return len(self.subscribers.get(chat_id, {}))
+            return sum(len(queues) for queues in self.subscribers.values())
+
+    def publish(self, chat_id: str, message: Dict):
+        if self.broker:
+            self.broker.publish(chat_id, message)
+        else:
+            self._deliver(chat_id, message)
+
+    def _deliver(self, chat_id: str, message: Dict):
+        with self.lock:
+            queues = list(self.subscribers.get(chat_id, {}).items())
+        for queue, loop in queues:
+            try:
+                loop.call_soon_threadsafe(_put_dropping_oldest, queue, message)
+            except RuntimeError:
+                # The loop was closed without unsubscribing
+                self.unsubscribe(chat_id, queue)
+
+def _put_dropping_oldest(queue: asyncio.Queue, message: Dict):
+    """
+    A subscriber that does not keep up loses its oldest messages instead of
+    growing without bound, it can fetch them again with /chats/all/{uuid}?after=<seq>
+    """
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+class RedisBroker:
+    """
+    Fans the messages out to every worker through redis pub/sub.
+    Any client with redis' publish/pubsub interface can be given (a fake one in tests).
+    """
+
+    def __init__(self, url: Optional[str] = None, client=None):
+        if client is None:
+            import redis # Only needed when the broker is configured
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.thread = None
+
+    def start(self, deliver):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+        self.thread = threading.Thread(target=self._listen, args=(pubsub, deliver), daemon=True)
+        self.thread.start()
+
+    def _listen(self, pubsub, deliver):
+        for event in pubsub.listen():
+            try:
+                channel = event['channel']
+                channel = channel.decode() if isinstance(channel, bytes) else channel
+                deliver(channel.removeprefix(CHANNEL_PREFIX), json.loads(event['data']))
+            except Exception as e:
+                logger.error(f"Error delivering a chat message from redis: {e}")
+
+    def publish(self, chat_id: str, message: Dict):
+        try:
+            self.client.publish(f"{CHANNEL_PREFIX}{chat_id}", json.dumps(message))
+        except Exception as e:
+            logger.error(f"Error publishing a message of chat '{chat_id}' to redis: {e}")
+
+def get_chat_broker():
+    """
+    Redis broker if CHAT_BROKER_URL is set, None (in-process only) otherwise.
+    """
+    url = os.getenv('CHAT_BROKER_URL')
+    return RedisBroker(url) if url else None
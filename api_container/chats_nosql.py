@@ -1,36 +1,68 @@
 from typing import Optional, List, Dict
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
-from pymongo import ASCENDING
-from pymongo.errors import DuplicateKeyError, OperationFailure
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import logging as logger
+import bson
+import json
 import os
 import sys
 import uuid
+import zlib
+from datetime import datetime, timedelta
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
-from lib.utils import get_actual_time, get_mongo_client
+from lib.utils import get_actual_time, get_mongo_client, encode_cursor, decode_cursor
 
 HOUR = 60 * 60
 MINUTE = 60
 MILLISECOND = 1_000
 
+DUPLICATE_KEY_ERROR = 11000
+PREVIEW_LENGTH = 100
+DEFAULT_ARCHIVE_AFTER_DAYS = 90
+SUPPORT_SENDER = "SUPPORT_AGENT"
+READERS = {"user", "support"}
+INBOX_FIELDS = {'_id': 0, 'uuid': 1, 'created_at': 1, 'last_message_at': 1, 'resolved': 1, 'message_count': 1, 'last_message': 1, 'unread': 1}
+COUNTER_FIELDS = {'_id': 0, 'uuid': 1, 'message_count': 1, 'sender_counts': 1}
+MESSAGE_FIELDS = {'_id': 0, 'seq': 1, 'sender': 1, 'message': 1, 'sent_at': 1, 'attachment': 1}
+
 # TODO: (General) -> Create tests for each method && add the required checks in each method
 
 class Chats:
     """
-    Chats class that stores data in a MongoDB collection.
-    Fields:
+    Chats class that stores data in two MongoDB collections.
+    Chats fields (support-chats):
     - id: int (unique) [pk] The format is "HELP-<id>" or "REPORT-<id>"
-    - messages (List[Dict]): The list of messages
+    - last_seq (int): The sequence number of the last message of the chat
     - created_at (int): The timestamp of the creation of the chat
     - last_message_at (int): The timestamp of the last message sent in the chat
     - resolved (bool): If the chat is resolved
+    - message_count (int): The number of messages of the chat
+    - sender_counts (Dict[str, int]): The number of messages of each sender
+    - last_message (Dict): Preview of the last message (sender, message cut to PREVIEW_LENGTH, sent_at)
+    - unread (Dict[str, int]): The number of messages the "user" and the "support" side did not read
 
-    Messages structure:
+    Messages fields (support-chat-messages), one document per message:
+    - chat_uuid (str): The id of the chat [pk with seq]
+    - seq (int): The position of the message in the chat, starting at 1
     - sender (str): Name of the sender, it can be "User" or "Support Agent"
     - message (str): The message content
     - sent_at (int): The timestamp of the message sent
+    - attachment (Dict): Only in messages with a file, its blob store reference (id, filename, content_type, size)
+
+    Chats created before the messages collection keep their messages in a
+    `messages` array until migrate_messages moves them.
+
+    Archive fields (support-chats-archive), one document per archived chat:
+    - uuid (str): The id of the chat [pk]
+    - chat (Dict): The chat document as it was when archived
+    - messages (bytes): The messages (as get_messages returns them) in zlib compressed JSON
+    - message_count (int), sender_counts (Dict[str, int]): Copied from the chat
+    - archived_at (str): The timestamp of the archival
+    - restoring (bool): Only while a new message moves the chat back to the hot collections
     """
 
     def __init__(self, test_client=None, test_db=None):
@@ -42,6 +74,8 @@ class Chats:
         else:
             self.db = self.client[test_db or os.getenv('MONGO_DB')]
         self.collection = self.db['support-chats']
+        self.messages = self.db['support-chat-messages']
+        self.archive = self.db['support-chats-archive']
         self._create_collection()
     
     def _check_connection(self):
@@ -54,95 +88,422 @@ class Chats:
 
     def _create_collection(self):
         self.collection.create_index([('uuid', ASCENDING)], unique=True)
+        self.collection.create_index([('resolved', ASCENDING), ('last_message_at', DESCENDING), ('uuid', DESCENDING)])
+        self.messages.create_index([('chat_uuid', ASCENDING), ('seq', ASCENDING)], unique=True)
+        self.archive.create_index([('uuid', ASCENDING)], unique=True)
     
     def insert_message(self, message_content: str, message_sender: str, chat_id: str) -> Optional[str]:
-        actual_time = get_actual_time()
-        if not self._chat_exists(chat_id):
-            try:
-                return self._create_chat(message_content, message_sender, chat_id, actual_time)
-            except DuplicateKeyError as e:
-                logger.error(f"DuplicateKeyError: {e}")
-                return None
-            except OperationFailure as e:
-                logger.error(f"OperationFailure: {e}")
-                return None
-        
+        return chat_id if self.send_message(message_content, message_sender, chat_id) else None
+
+    def send_message(self, message_content: str, message_sender: str, chat_id: str, attachment: Optional[Dict] = None, resolved: bool = False) -> Optional[Dict]:
+        """
+        Stores the message and returns it as get_messages does (with its seq),
+        or None if it could not be stored.
+        A chat created by the message starts as `resolved` (the state of its ticket).
+        """
+        message = self._message(message_content, message_sender, get_actual_time())
+        if attachment:
+            message['attachment'] = attachment
         try:
-            self._update_chat(message_content, message_sender, actual_time, chat_id)
-            return chat_id
+            seq = self._next_seq(message, chat_id, resolved)
+            if seq is None:
+                return message
+            self.messages.insert_one({'chat_uuid': chat_id, 'seq': seq, **message})
+            return {'seq': seq, **message}
+        except OperationFailure as e:
+            logger.error(f"OperationFailure: {e}")
+            return None
         except Exception as e:
             logger.error(f"Error updating chat with id '{chat_id}': {e}")
             return None
 
-    def _update_chat(self, message_content, message_sender, actual_time, chat_id):
-        self.collection.update_one({'uuid': chat_id}, {
+    def _next_seq(self, message: Dict, chat_id: str, resolved: bool = False) -> Optional[int]:
+        """
+        Updates the chat with a single update, or creates it on its first message (an
+        archived chat is restored first, so its seqs continue), and returns the seq of the
+        new message. Returns None if the chat was not migrated yet, in that case the message
+        was pushed to its array.
+        """
+        update = {
+            '$setOnInsert': {
+                'created_at': message['sent_at'],
+                'resolved': resolved
+            },
+            '$inc': {
+                'last_seq': 1,
+                **self._counters(message['sender'])
+            },
+            '$set': {
+                'last_message_at': message['sent_at'],
+                'last_message': self._preview(message)
+            }
+        }
+        chat = self.collection.find_one_and_update(
+            {'uuid': chat_id, 'messages': {'$exists': False}}, update,
+            projection={'last_seq': 1}, return_document=ReturnDocument.AFTER
+        )
+        if chat:
+            return chat['last_seq']
+        self._restore_archived(chat_id)
+        for retry in (True, False):
+            try:
+                chat = self.collection.find_one_and_update(
+                    {'uuid': chat_id, 'messages': {'$exists': False}}, update,
+                    projection={'last_seq': 1}, upsert=True, return_document=ReturnDocument.AFTER
+                )
+                return chat['last_seq']
+            except DuplicateKeyError:
+                # The chat exists but the filter did not match it: it was not migrated
+                # yet, or it was created by a concurrent first message (then it matches now)
+                result = self.collection.update_one({'uuid': chat_id, 'messages': {'$exists': True}}, {
                     '$push': {
-                        'messages': {
-                            'sender': message_sender,
-                            'message': message_content,
-                            'sent_at': actual_time
-                        }
+                        'messages': message
                     },
+                    '$inc': self._unread(message['sender']),
                     '$set': {
-                        'last_message_at': actual_time
+                        'last_message_at': message['sent_at']
                     }
                 })
+                if result.matched_count:
+                    return None
+                if not retry:
+                    raise
 
-    def _create_chat(self, message_content, message_sender, chat_id, actual_time):
-        self.collection.insert_one({
-                    'uuid': chat_id,
-                    'messages': [{
-                        'sender': message_sender,
-                        'message': message_content,
-                        'sent_at': actual_time
-                    }],
-                    'created_at': actual_time,
-                    'last_message_at': actual_time,
-                    "resolved": False
-                })
-        
-        return chat_id
+    def _restore_archived(self, chat_id: str) -> bool:
+        """
+        Moves an archived chat back to the hot collections, its messages before the chat
+        so a restored chat is never read without them. The archive is marked as restoring
+        first, so archive_resolved does not drop the restored messages.
+        It can run again after a failure. Returns if the chat was archived.
+        """
+        archived = self.archive.find_one_and_update({'uuid': chat_id}, {'$set': {'restoring': True}})
+        if not archived:
+            return False
+        self._insert_messages(chat_id, json.loads(zlib.decompress(archived['messages'])))
+        try:
+            self.collection.insert_one(dict(archived['chat']))
+        except DuplicateKeyError:
+            pass # Restored by a concurrent message
+        self.archive.delete_one({'uuid': chat_id})
+        return True
+
+    def _insert_messages(self, chat_id: str, messages: List[Dict]):
+        """
+        Inserts the messages (with their seq), skipping the ones already stored.
+        """
+        if not messages:
+            return
+        try:
+            self.messages.insert_many([{'chat_uuid': chat_id, **message} for message in messages], ordered=False)
+        except BulkWriteError as e:
+            if any(error['code'] != DUPLICATE_KEY_ERROR for error in e.details['writeErrors']):
+                raise
+
+    def _counters(self, message_sender) -> Dict:
+        return {'message_count': 1, f'sender_counts.{message_sender}': 1, **self._unread(message_sender)}
+
+    def _unread(self, message_sender) -> Dict:
+        # Every message is unread for the other side of the chat
+        return {'unread.user': 1} if message_sender == SUPPORT_SENDER else {'unread.support': 1}
+
+    def _preview(self, message: Dict) -> Dict:
+        return {**message, 'message': message['message'][:PREVIEW_LENGTH]}
+
+    def _message(self, message_content, message_sender, actual_time) -> Dict:
+        return {
+            'sender': message_sender,
+            'message': message_content,
+            'sent_at': actual_time
+        }
         
-    def _chat_exists(self, id: str) -> Optional[str]:
-        doc = self.collection.find_one({'uuid': id})
-        return doc['uuid'] if doc else None
-    
     def delete(self, uuid: str) -> bool:
         result = self.collection.delete_one({'uuid': uuid})
+        self.messages.delete_many({'chat_uuid': uuid})
         return result.deleted_count > 0
 
-    def get_messages(self, chat_id: str) -> Optional[List[Dict]]:
-        chat_id = self._chat_exists(chat_id)
-        if not chat_id:
-            return None
-        messages = self.collection.aggregate([
-            {'$match': {'uuid': chat_id}},
-            {'$unwind': '$messages'},
-            {'$sort': {'messages.sent_at': ASCENDING}},
-            {'$group': {
-                '_id': '$_id',
-                'messages': {'$push': '$messages'}
-            }}
-        ])
-        results = list(messages)
-        if not results:
+    def list_chats(self, limit: int, cursor: Optional[str] = None, resolved: Optional[bool] = None) -> tuple[List[Dict], Optional[str]]:
+        """
+        Returns a page of chats, the most recently active first, and the cursor of the next page.
+        Without `resolved` both values are read as two ranges of the
+        (resolved, last_message_at, uuid) index and merged by the server.
+        """
+        query = {'resolved': resolved if resolved is not None else {'$in': [False, True]}}
+        if cursor:
+            after = decode_cursor(cursor)
+            if len(after) != 2 or not all(isinstance(value, str) for value in after):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            last_message_at, uuid = after
+            query['$or'] = [
+                {'last_message_at': {'$lt': last_message_at}},
+                {'last_message_at': last_message_at, 'uuid': {'$lt': uuid}}
+            ]
+        chats = list(
+            self.collection.find(query, INBOX_FIELDS)
+            .sort([('last_message_at', DESCENDING), ('uuid', DESCENDING)])
+            .limit(limit + 1)
+        )
+        next_cursor = None
+        if len(chats) > limit:
+            chats = chats[:limit]
+            next_cursor = encode_cursor(chats[-1]['last_message_at'], chats[-1]['uuid'])
+        return chats, next_cursor
+
+    def set_resolved(self, chat_id: str, resolved: bool) -> bool:
+        result = self.collection.update_one({'uuid': chat_id}, {'$set': {'resolved': resolved}})
+        return result.matched_count > 0
+
+    def mark_read(self, chat_id: str, reader: str) -> bool:
+        """
+        Resets the unread counter of `reader` ("user" or "support").
+        """
+        if reader not in READERS:
+            raise ValueError(f"Invalid reader '{reader}'")
+        result = self.collection.update_one({'uuid': chat_id}, {'$set': {f'unread.{reader}': 0}})
+        return result.matched_count > 0
+
+    def unread_many(self, chat_ids: List[str]) -> Dict[str, Dict]:
+        """
+        format:
+        { <chat_id>: { "user": <int>, "support": <int> } }
+        Chats that do not exist are left out.
+        """
+        return {
+            chat['uuid']: {reader: chat.get('unread', {}).get(reader, 0) for reader in READERS}
+            for chat in self.collection.find({'uuid': {'$in': chat_ids}}, {'_id': 0, 'uuid': 1, 'unread': 1})
+        }
+
+    def get_last_update(self, chat_id: str) -> Optional[Dict]:
+        """
+        Returns the seq (as last_seq) and sent_at (as last_message_at) of the newest stored
+        message, a point read of the (chat_uuid, seq) index that tells whether a client
+        already has the newest messages. The chat counters are not used, they are
+        updated before the message is stored.
+        None if the chat has no stored messages (it does not exist, was not migrated yet or was archived).
+        """
+        message = self.messages.find_one({'chat_uuid': chat_id}, {'_id': 0, 'seq': 1, 'sent_at': 1}, sort=[('seq', DESCENDING)])
+        if not message:
             return None
-        return results[0]['messages']
-    
+        return {'last_seq': message['seq'], 'last_message_at': message['sent_at']}
+
+    def get_messages(self, chat_id: str, limit: Optional[int] = None, before: Optional[int] = None, after: Optional[int] = None, offset: int = 0) -> Optional[List[Dict]]:
+        """
+        Returns the messages of the chat ordered by seq, or None if the chat does not exist.
+        - limit: the max number of messages, the newest ones unless `after` is given
+        - before / after: only the messages with a lower / greater seq
+        - offset: the number of messages skipped, counted from the same end as `limit`
+        It reads a range of the (chat_uuid, seq) index, the chat is only read when no message matches.
+        """
+        query = {'chat_uuid': chat_id}
+        seq = {}
+        if before is not None:
+            seq['$lt'] = before
+        if after is not None:
+            seq['$gt'] = after
+        if seq:
+            query['seq'] = seq
+        oldest_first = after is not None
+        cursor = self.messages.find(query, MESSAGE_FIELDS).sort('seq', ASCENDING if oldest_first else DESCENDING).skip(offset)
+        if limit:
+            cursor = cursor.limit(limit)
+        messages = list(cursor)
+        if messages:
+            return messages if oldest_first else messages[::-1]
+
+        chat = self.collection.find_one({'uuid': chat_id}, {'messages': 1})
+        if not chat:
+            messages = self._archived_messages(chat_id)
+            return _page(messages, limit, before, after, offset) if messages is not None else None
+        if 'messages' not in chat:
+            return []
+        messages = [
+            {'seq': seq, **message}
+            for seq, message in enumerate(sorted(chat['messages'], key=lambda message: message['sent_at']), start=1)
+        ]
+        return _page(messages, limit, before, after, offset)
+
     def count_messages(self, chat_id: str) -> int:
-        chat_id = self._chat_exists(chat_id)
-        if not chat_id:
-            return 0
-        messages = self.collection.aggregate([
-            {'$match': {'uuid': chat_id}},
-            {'$unwind': '$messages'},
-            {'$count': 'count'}
-        ])
-        result = list(messages)
-        if not result:
+        chat = self.collection.find_one({'uuid': chat_id}, {'message_count': 1}) or self.archive.find_one({'uuid': chat_id}, {'message_count': 1})
+        if not chat:
             return 0
-        return result[0]['count']
+        if 'message_count' in chat:
+            return chat['message_count']
+        return self._count_messages(chat_id)['message_count']
+
+    def count_messages_many(self, chat_ids: List[str]) -> Dict[str, Dict]:
+        """
+        format:
+        { <chat_id>: { "message_count": <int>, "sender_counts": { <sender>: <int> } } }
+        Chats that do not exist are left out.
+        """
+        counts = {}
+        for chat in self.collection.find({'uuid': {'$in': chat_ids}}, COUNTER_FIELDS):
+            if 'message_count' in chat:
+                counts[chat['uuid']] = {'message_count': chat['message_count'], 'sender_counts': chat.get('sender_counts', {})}
+            else:
+                counts[chat['uuid']] = self._count_messages(chat['uuid'])
+        missing = [chat_id for chat_id in chat_ids if chat_id not in counts]
+        if missing:
+            for chat in self.archive.find({'uuid': {'$in': missing}}, COUNTER_FIELDS):
+                counts[chat['uuid']] = {'message_count': chat['message_count'], 'sender_counts': chat.get('sender_counts', {})}
+        return counts
+
+    def _count_messages(self, chat_id: str, seq: Optional[int] = None) -> Dict:
+        """
+        Counts the stored messages of the chat (up to `seq` if given), the slow path
+        for the chats whose counters were not backfilled yet.
+        """
+        chat = self.collection.find_one({'uuid': chat_id, 'messages': {'$exists': True}}, {'messages.sender': 1})
+        if chat:
+            senders = [message['sender'] for message in chat['messages']]
+        else:
+            query = {'chat_uuid': chat_id}
+            if seq is not None:
+                query['seq'] = {'$lte': seq}
+            senders = [message['sender'] for message in self.messages.find(query, {'_id': 0, 'sender': 1})]
+        return self._count_senders(senders)
+
+    def _count_senders(self, senders: List[str]) -> Dict:
+        sender_counts = {}
+        for sender in senders:
+            sender_counts[sender] = sender_counts.get(sender, 0) + 1
+        return {'message_count': len(senders), 'sender_counts': sender_counts}
+
+    def backfill_message_counts(self, retries: int = 3) -> int:
+        """
+        Recomputes message_count and sender_counts of every migrated chat (migrate_messages
+        counts the others). A chat is only written if no message was sent since it was
+        counted (otherwise it is counted again), so it can run while the API is serving.
+        Returns the number of chats updated.
+        """
+        updated = 0
+        for chat in self.collection.find({'messages': {'$exists': False}}, {'uuid': 1}):
+            for _ in range(retries):
+                current = self.collection.find_one({'uuid': chat['uuid']}, {'last_seq': 1, 'message_count': 1})
+                if not current:
+                    break
+                counts = self._count_messages(chat['uuid'], current.get('last_seq'))
+                if counts['message_count'] < current.get('last_seq', 0):
+                    continue # A message is still being written
+                result = self.collection.update_one(
+                    {'uuid': chat['uuid'], 'message_count': current.get('message_count')},
+                    {'$set': counts}
+                )
+                if result.matched_count:
+                    updated += 1
+                    break
+            else:
+                logger.error(f"Could not count the messages of chat '{chat['uuid']}'")
+        return updated
+
+    def migrate_messages(self) -> int:
+        """
+        Moves the messages arrays of the old chats to the messages collection and fills their counters.
+        It can run while the API is serving (messages sent meanwhile are picked up)
+        and be run again after a failure. Returns the number of chats migrated.
+        """
+        migrated = 0
+        for chat in self.collection.find({'messages': {'$exists': True}}, {'uuid': 1, 'messages': 1}):
+            while chat:
+                messages = sorted(chat['messages'], key=lambda message: message['sent_at'])
+                # Nothing else writes to the messages collection while the array exists
+                self.messages.delete_many({'chat_uuid': chat['uuid']})
+                if messages:
+                    self.messages.insert_many([
+                        {'chat_uuid': chat['uuid'], 'seq': seq, **self._message(message['message'], message['sender'], message['sent_at'])}
+                        for seq, message in enumerate(messages, start=1)
+                    ])
+                # Only drop the array if no message was pushed since it was read
+                result = self.collection.update_one(
+                    {'uuid': chat['uuid'], 'messages': {'$size': len(messages)}},
+                    {'$unset': {'messages': ''}, '$set': {
+                        'last_seq': len(messages),
+                        **self._count_senders([message['sender'] for message in messages]),
+                        **({'last_message': self._preview(messages[-1])} if messages else {})
+                    }}
+                )
+                if result.modified_count:
+                    migrated += 1
+                    break
+                chat = self.collection.find_one({'uuid': chat['uuid'], 'messages': {'$exists': True}}, {'uuid': 1, 'messages': 1})
+        return migrated
     
+    def _archived_messages(self, chat_id: str) -> Optional[List[Dict]]:
+        archived = self.archive.find_one({'uuid': chat_id}, {'messages': 1})
+        if not archived:
+            return None
+        return json.loads(zlib.decompress(archived['messages']))
+
+    def archive_resolved(self, older_than_days: Optional[int] = None) -> Dict:
+        """
+        Moves the resolved chats without messages for `older_than_days` (CHAT_ARCHIVE_AFTER_DAYS
+        by default) to the archive collection, with their messages compressed in a single field.
+        A chat that gets a message while it is being archived is left as it was,
+        one that gets a message once archived is restored by send_message.
+        Returns how many chats and messages were archived and how many bytes they took
+        before (as BSON) and after.
+        """
+        if older_than_days is None:
+            older_than_days = int(os.getenv('CHAT_ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS))
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime('%Y-%m-%d %H:%M:%S')
+        report = {'chats': 0, 'messages': 0, 'bytes_before': 0, 'bytes_after': 0}
+        query = {'resolved': True, 'last_message_at': {'$lt': cutoff}, 'messages': {'$exists': False}}
+        for chat in self.collection.find(query):
+            messages = list(self.messages.find({'chat_uuid': chat['uuid']}, MESSAGE_FIELDS).sort('seq', ASCENDING))
+            archived = {
+                'uuid': chat['uuid'],
+                'chat': {key: value for key, value in chat.items() if key != '_id'},
+                'messages': zlib.compress(json.dumps(messages).encode()),
+                'message_count': chat.get('message_count', len(messages)),
+                'sender_counts': chat.get('sender_counts', self._count_senders([message['sender'] for message in messages])['sender_counts']),
+                'archived_at': get_actual_time()
+            }
+            self.archive.replace_one({'uuid': chat['uuid']}, archived, upsert=True)
+            if not self.collection.delete_one({'uuid': chat['uuid'], 'last_seq': chat.get('last_seq')}).deleted_count:
+                self.archive.delete_one({'uuid': chat['uuid']})
+                continue
+            # Messages sent after the chat was deleted restore it with a greater seq
+            self.messages.delete_many({'chat_uuid': chat['uuid'], 'seq': {'$lte': chat.get('last_seq', 0)}})
+            if not self.archive.find_one({'uuid': chat['uuid'], 'restoring': {'$exists': False}}, {'_id': 1}):
+                # It was restored meanwhile, its messages may have been deleted after being restored
+                self._insert_messages(chat['uuid'], messages)
+                continue
+            report['chats'] += 1
+            report['messages'] += len(messages)
+            report['bytes_before'] += len(bson.encode(chat)) + sum(len(bson.encode(message)) for message in messages)
+            report['bytes_after'] += len(bson.encode(archived))
+        report['bytes_reclaimed'] = report['bytes_before'] - report['bytes_after']
+        logger.info(f"Archived {report['chats']} chats, {report['bytes_reclaimed']} bytes reclaimed")
+        return report
+
     def print_all(self):
         for chat in self.collection.find():
             print(chat)
+
+def _page(messages: List[Dict], limit: Optional[int], before: Optional[int], after: Optional[int], offset: int) -> List[Dict]:
+    """
+    get_messages over a list of messages already ordered by seq
+    """
+    messages = [
+        message for message in messages
+        if (before is None or message['seq'] < before) and (after is None or message['seq'] > after)
+    ]
+    oldest_first = after is not None
+    if not oldest_first:
+        messages = messages[::-1]
+    messages = messages[offset:offset + limit] if limit else messages[offset:]
+    return messages if oldest_first else messages[::-1]
+
+if __name__ == "__main__":
+    # Moves the old chats messages to the messages collection and fills their counters, run with:
+    # python chats_nosql.py
+    # Archives the old resolved chats, run with:
+    # python chats_nosql.py archive
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    chats = Chats()
+    if sys.argv[1:] == ['archive']:
+        print(chats.archive_resolved())
+    else:
+        print(f"Migrated {chats.migrate_messages()} chats")
+        print(f"Counted the messages of {chats.backfill_message_counts()} chats")
@@ -0,0 +1,144 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import MetaData, Table, Column, String, Integer, Date, select, func, literal
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+import logging as logger
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text, Select
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+from lib.utils import get_engine
+from migrations_sql import Migrations
+
+class DailyStats:
+    """
+    DailyStats class that stores a daily rollup of the tickets in a db through sqlalchemy
+    Fields:
+    - day: date [pk]
+    - kind: str (report_tk or help_tk) [pk]
+    - new: int The number of tickets created that day
+    - resolved: int The number of tickets resolved that day
+
+    The counters are updated by Reports and HelpTKs inside the same session
+    as the ticket write, so they commit (or roll back) together with it.
+    """
+
+    def __init__(self, engine=None):
+        self.engine = engine or get_engine()
+        self.create_table()
+
+    def create_table(self):
+        metadata = MetaData()
+        self.ticket_daily_stats = Table(
+            'ticket_daily_stats',
+            metadata,
+            Column('day', Date, primary_key=True),
+            Column('kind', String, primary_key=True),
+            Column('new', Integer, nullable=False, default=0),
+            Column('resolved', Integer, nullable=False, default=0)
+        )
+        Migrations(self.engine).upgrade()
+
+    def _insert(self):
+        if self.engine.dialect.name == 'postgresql':
+            return postgresql_insert(self.ticket_daily_stats)
+        return sqlite_insert(self.ticket_daily_stats)
+
+    def increment(self, session: Session, time: str, kind: str, new: int = 0, resolved: int = 0):
+        """
+        Adds the given amounts to the counters of the day of `time` ('YYYY-MM-DD HH:MM:SS').
+        It does not commit, the caller owns the transaction.
+        """
+        query = self._insert().values(day=_to_day(time), kind=kind, new=new, resolved=resolved)
+        query = query.on_conflict_do_update(
+            index_elements=['day', 'kind'],
+            set_={
+                'new': self.ticket_daily_stats.c.new + new,
+                'resolved': self.ticket_daily_stats.c.resolved + resolved
+            }
+        )
+        session.execute(query)
+
+    def replace(self, kind: str, tickets_by_day: Select) -> bool:
+        """
+        Replaces every counter of `kind` with the rows of `tickets_by_day`, a select of (day, new, resolved).
+        The counters are locked before the tickets are counted, so the increments of the tickets
+        written meanwhile wait for the replace and are added on top of it instead of being lost.
+        """
+        with Session(self.engine) as session:
+            try:
+                if self.engine.dialect.name == 'postgresql':
+                    session.execute(text("LOCK TABLE ticket_daily_stats IN EXCLUSIVE MODE"))
+                # On SQLite the delete takes the database write lock
+                session.execute(self.ticket_daily_stats.delete().where(self.ticket_daily_stats.c.kind == kind))
+                counts = tickets_by_day.subquery()
+                session.execute(self.ticket_daily_stats.insert().from_select(
+                    ['day', 'kind', 'new', 'resolved'],
+                    select(counts.c.day, literal(kind), counts.c.new, counts.c.resolved)
+                ))
+                session.commit()
+            except SQLAlchemyError as e:
+                logger.error(f"SQLAlchemyError: {e}")
+                session.rollback()
+                return False
+        return True
+
+    def by_day(self, kind: str, from_date: str, to_date: str) -> dict:
+        """
+        format:
+        { <date>: { "new": <int>, "resolved": <int> } }
+        """
+        with self.engine.connect() as connection:
+            query = select(
+                self.ticket_daily_stats.c.day,
+                self.ticket_daily_stats.c.new,
+                self.ticket_daily_stats.c.resolved
+            ).where(
+                (self.ticket_daily_stats.c.kind == kind) &
+                (self.ticket_daily_stats.c.day >= _to_day(from_date)) &
+                (self.ticket_daily_stats.c.day <= _to_day(to_date))
+            )
+            result = connection.execute(query)
+            return {day.isoformat(): {"new": new, "resolved": resolved} for day, new, resolved in result}
+
+    def last_month(self, kind: str) -> dict:
+        """
+        Returns the new and resolved counters of the last 30 days and the 30 days before them.
+        """
+        today = date.today()
+        this_month = today - timedelta(days=30)
+        previous_month = today - timedelta(days=60)
+        day = self.ticket_daily_stats.c.day
+        in_this_month = (day > this_month) & (day <= today)
+        in_last_month = (day > previous_month) & (day <= this_month)
+        total = lambda column, condition: func.coalesce(func.sum(column).filter(condition), 0)
+        query = select(
+            total(self.ticket_daily_stats.c.new, in_this_month).label('new_this_month'),
+            total(self.ticket_daily_stats.c.new, in_last_month).label('new_last_month'),
+            total(self.ticket_daily_stats.c.resolved, in_this_month).label('resolved_this_month'),
+            total(self.ticket_daily_stats.c.resolved, in_last_month).label('resolved_last_month')
+        ).where(
+            (self.ticket_daily_stats.c.kind == kind) &
+            (day > previous_month) & (day <= today)
+        )
+        with self.engine.connect() as connection:
+            return connection.execute(query).one()._asdict()
+
+def _to_day(time) -> date:
+    return datetime.strptime(str(time)[:10], '%Y-%m-%d').date()
+
+if __name__ == "__main__":
+    # Rebuilds the rollup from the tickets tables, the tickets can keep being written meanwhile. Run with:
+    # python daily_stats_sql.py
+    from dotenv import load_dotenv
+    from reports_sql import Reports
+    from helptks_sql import HelpTKs
+
+    load_dotenv()
+    engine = get_engine()
+    for manager in (Reports(engine=engine), HelpTKs(engine=engine)):
+        if not manager.backfill_daily_stats():
+            sys.exit(1)
@@ -1,76 +1,89 @@
 from datetime import datetime, timedelta
 import random
 from typing import Optional, Union
-from sqlalchemy import MetaData, Table, Column, String, Boolean
+from sqlalchemy import MetaData, Table, Column, String, Boolean, DateTime, Enum, Uuid, select, func, literal, union_all, tuple_, case
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 import logging as logger
 from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.sql import text
+from sqlalchemy.sql import text, Select
 import os
 import sys
 import uuid
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
-from lib.utils import get_actual_time, get_engine
+from lib.utils import get_actual_time, get_engine, parse_local_time, format_time, parse_uuid, serialize_row, encode_keyset_cursor, decode_keyset_cursor
+from daily_stats_sql import DailyStats
+from migrations_sql import Migrations
+from tks_cache import TksCache
 
 HOUR = 60 * 60
 MINUTE = 60
 MILLISECOND = 1_000
 
+SUMMARY_COLUMNS = ("uuid", "title", "resolved", "updated_at")
+
 # TODO: (General) -> Create tests for each method && add the required checks in each method
 
 class HelpTKs:
     """
     HelpTKs class that stores data in a db through sqlalchemy
     Fields:
-    - uuid: str (unique) [pk]
+    - uuid: uuid (unique) [pk]
     - title: str
     - description: str
     - requester: str
     - created_at: datetime
     - resolved: bool
     - updated_at: datetime
+    - resolved_at: datetime (None while it is not resolved)
+
+    The resolved counter of the daily stats counts the resolved tickets on the day of
+    their resolved_at: it is added when a ticket is resolved and taken off when the
+    ticket is reopened or deleted.
     """
 
-    def __init__(self, engine=None):
+    def __init__(self, engine=None, cache=None):
         self.engine = engine or get_engine()
         self.create_table()
+        self.daily_stats = DailyStats(engine=self.engine)
+        self.cache = TksCache("help_tks", cache)
         logger.getLogger('sqlalchemy.engine').setLevel(logger.DEBUG)
         self.metadata = MetaData()
         self.metadata.bind = self.engine
         self.Session = sessionmaker(bind=self.engine)
 
     def create_table(self):
-        with Session(self.engine) as session:
-            metadata = MetaData()
-            self.help_tks = Table(
-                'help_tks',
-                metadata,
-                Column('uuid', String, primary_key=True, default=lambda: str(uuid.uuid4())),
-                Column('title', String),
-                Column('description', String),
-                Column('requester', String),
-                Column('created_at', String),
-                Column('resolved', Boolean),
-                Column('updated_at', String)
-            )
-            metadata.create_all(self.engine)
-            session.commit()
+        metadata = MetaData()
+        self.help_tks = Table(
+            'help_tks',
+            metadata,
+            Column('uuid', Uuid, primary_key=True, default=uuid.uuid4),
+            Column('title', String),
+            Column('description', String),
+            Column('requester', String),
+            Column('created_at', DateTime(timezone=True)),
+            Column('resolved', Boolean),
+            Column('updated_at', DateTime(timezone=True)),
+            Column('resolved_at', DateTime(timezone=True))
+        )
+        Migrations(self.engine).upgrade()
     
     def insert(self, title: str, description: str, requester: str) -> Optional[str]:
+        now = get_actual_time()
         with Session(self.engine) as session:
             try:
                 query = self.help_tks.insert().values(
                     title=title,
                     description=description,
                     requester=requester,
-                    created_at=get_actual_time(),
+                    created_at=parse_local_time(now),
                     resolved=False,
-                    updated_at=get_actual_time()
+                    updated_at=parse_local_time(now)
                 ).returning(self.help_tks.c.uuid)
                 result = session.execute(query)
-                inserted_uuid = result.scalar() # TODO: Check if this works
+                inserted_uuid = str(result.scalar())
+                self.daily_stats.increment(session, now, "help_tk", new=1)
                 session.commit()
                 return inserted_uuid
             except IntegrityError as e:
@@ -83,21 +96,49 @@ class HelpTKs:
                 return None
     
     def get(self, uuid: str) -> Optional[dict]:
+        return self.cache.get(uuid, self._get)
+
+    def _get(self, uuid: str) -> Optional[dict]:
         with self.engine.connect() as connection:
-            query = self.help_tks.select().where(self.help_tks.c.uuid == uuid)
+            query = self.help_tks.select().where(self.help_tks.c.uuid == parse_uuid(uuid))
             result = connection.execute(query)
             tk = result.fetchone()
             if tk is None:
                 return None
-            dict_tk = tk._asdict()
+            dict_tk = serialize_row(tk)
             return dict_tk
         
+    def get_many(self, uuids: list[str]) -> dict[str, dict]:
+        """
+        Returns { <uuid>: <ticket> } for the given uuids that exist, with a single
+        WHERE uuid IN (...) query for the ones that are not cached.
+        """
+        return self.cache.get_many(uuids, self._get_many)
+
+    def _get_many(self, uuids: list[str]) -> dict[str, dict]:
+        requested = {parse_uuid(uuid): uuid for uuid in uuids if parse_uuid(uuid)}
+        if not requested:
+            return {}
+        with self.engine.connect() as connection:
+            query = self.help_tks.select().where(self.help_tks.c.uuid.in_(list(requested)))
+            result = connection.execute(query)
+            return {requested[tk.uuid]: serialize_row(tk) for tk in result}
+    
     def delete(self, uuid: str) -> bool:
         with Session(self.engine) as session:
             try:
-                query = self.help_tks.delete().where(self.help_tks.c.uuid == uuid)
-                session.execute(query)
+                query = self.help_tks.delete().where(self.help_tks.c.uuid == parse_uuid(uuid)).returning(
+                    self.help_tks.c.created_at,
+                    self.help_tks.c.resolved,
+                    self.help_tks.c.resolved_at
+                )
+                deleted = session.execute(query).fetchone()
+                if deleted:
+                    self.daily_stats.increment(session, format_time(deleted.created_at), "help_tk", new=-1)
+                    if deleted.resolved and deleted.resolved_at:
+                        self.daily_stats.increment(session, format_time(deleted.resolved_at), "help_tk", resolved=-1)
                 session.commit()
+                self.cache.invalidate(uuid)
             except SQLAlchemyError as e:
                 logger.error(f"SQLAlchemyError: {e}")
                 session.rollback()
@@ -113,56 +154,92 @@ class HelpTKs:
                 return None
             tks_list = []
             for tk in tks:
-                dict_tk = tk._asdict()
+                dict_tk = serialize_row(tk)
                 tks_list.append(dict_tk)
             return tks_list
     
-    def update(self, uuid: str, resolved: bool) -> bool:
+    def get_page_by_user(self, requester: str, limit: int, cursor: Optional[str] = None, summary: bool = False) -> tuple[list[dict], Optional[str]]:
+        """
+        Returns a page of the requester tickets, oldest first, and the cursor of the next page.
+        With summary only SUMMARY_COLUMNS are read, so descriptions are never loaded.
+        """
+        columns = [self.help_tks.c[column] for column in SUMMARY_COLUMNS] if summary else list(self.help_tks.c)
+        query = select(*columns, self.help_tks.c.created_at.label('page_created_at')).where(self.help_tks.c.requester == requester)
+        if cursor:
+            created_at, uuid = decode_keyset_cursor(cursor)
+            query = query.where(tuple_(self.help_tks.c.created_at, self.help_tks.c.uuid) > tuple_(
+                literal(created_at, self.help_tks.c.created_at.type), literal(uuid, self.help_tks.c.uuid.type)
+            ))
+        query = query.order_by(self.help_tks.c.created_at, self.help_tks.c.uuid).limit(limit + 1)
+        with self.engine.connect() as connection:
+            tks = connection.execute(query).fetchall()
+        next_cursor = None
+        if len(tks) > limit:
+            tks = tks[:limit]
+            next_cursor = encode_keyset_cursor(tks[-1].page_created_at, tks[-1].uuid)
+        tks_list = []
+        for tk in tks:
+            dict_tk = serialize_row(tk)
+            dict_tk.pop('page_created_at')
+            tks_list.append(dict_tk)
+        return tks_list, next_cursor
+    
+    def update(self, uuid: str, resolved: bool) -> Optional[dict]:
+        """
+        Returns the updated ticket, or None if it does not exist.
+        """
         now = get_actual_time()
-        if not self.get(uuid):
-            return False
         with Session(self.engine) as session:
             try:
-                query = self.help_tks.update().where(self.help_tks.c.uuid == uuid).values(
-                    resolved=resolved,
-                    updated_at=now
-                )
-                session.execute(query)
+                tk = self._update_resolved(session, uuid, resolved, parse_local_time(now))
+                if tk and tk.resolved and not tk.was_resolved:
+                    self.daily_stats.increment(session, now, "help_tk", resolved=1)
+                elif tk and tk.was_resolved and not tk.resolved and tk.was_resolved_at:
+                    self.daily_stats.increment(session, format_time(tk.was_resolved_at), "help_tk", resolved=-1)
                 session.commit()
+                self.cache.invalidate(uuid)
             except SQLAlchemyError as e:
                 logger.error(f"SQLAlchemyError: {e}")
                 session.rollback()
-                return False
-        return True
-    
-    def _get_new_tks(self, from_date: str, to_date: str) -> dict:
-        with self.engine.connect() as connection:
-            query = self.help_tks.select().where(
-                (self.help_tks.c.created_at >= from_date) & 
-                (self.help_tks.c.created_at <= to_date)
-            )
-            result = connection.execute(query)
-            tks = result.fetchall()
-            tks_list = []
-            for tk in tks:
-                dict_tk = tk._asdict()
-                tks_list.append(dict_tk)
-            return tks_list
-        
-    def _get_resolved_tks(self, from_date: str, to_date: str):
-        with self.engine.connect() as connection:
-            query = self.help_tks.select().where(
-                (self.help_tks.c.updated_at >= from_date) & 
-                (self.help_tks.c.updated_at <= to_date) &
-                (self.help_tks.c.resolved == True)
+                return None
+        if not tk:
+            return None
+        tk = serialize_row(tk)
+        del tk['was_resolved'], tk['was_resolved_at']
+        return tk
+
+    def _update_resolved(self, session: Session, uuid: str, resolved: bool, now: datetime):
+        """
+        Sets resolved (resolved_at only changes with it) and updated_at in one UPDATE, and returns
+        the ticket with its previous resolved and resolved_at as was_resolved and was_resolved_at.
+        Postgres returns them from the row locked by the FROM subquery, in the same statement.
+        SQLite can not return the columns of a FROM subquery, it reads them first: it has
+        one writer at a time, a write in between fails the transaction instead of being missed.
+        """
+        values = {
+            'resolved': resolved,
+            'resolved_at': case((self.help_tks.c.resolved == False, now), else_=self.help_tks.c.resolved_at) if resolved else None,
+            'updated_at': now
+        }
+        if self.engine.dialect.name == 'postgresql':
+            tks = self.help_tks.alias('tks')
+            old = select(tks.c.uuid, tks.c.resolved, tks.c.resolved_at).where(
+                tks.c.uuid == parse_uuid(uuid)
+            ).with_for_update().subquery('old')
+            query = self.help_tks.update().where(self.help_tks.c.uuid == old.c.uuid).values(**values).returning(
+                *self.help_tks.c, old.c.resolved.label('was_resolved'), old.c.resolved_at.label('was_resolved_at')
             )
-            result = connection.execute(query)
-            tks = result.fetchall()
-            tks_list = []
-            for tk in tks:
-                dict_tk = tk._asdict()
-                tks_list.append(dict_tk)
-            return tks_list
+            return session.execute(query).fetchone()
+        is_tk = self.help_tks.c.uuid == parse_uuid(uuid)
+        old = session.execute(select(self.help_tks.c.resolved, self.help_tks.c.resolved_at).where(is_tk)).fetchone()
+        if not old:
+            return None
+        query = self.help_tks.update().where(is_tk).values(**values).returning(
+            *self.help_tks.c,
+            literal(old.resolved, Boolean).label('was_resolved'),
+            literal(old.resolved_at, DateTime(timezone=True)).label('was_resolved_at')
+        )
+        return session.execute(query).fetchone()
     
     def last_month_stats(self) -> Optional[dict]:
         """
@@ -170,19 +247,15 @@ class HelpTKs:
         - new tks this month and % difference with last month
         - resolved tks this month and % difference with last month
         """
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        this_month = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
-        previous_month = (datetime.now() - timedelta(days=60)).strftime('%Y-%m-%d %H:%M:%S')
-        
         perc_diff = lambda new, last: round(((new - last) / last) if last != 0 else 1, 2)
         
-        new_this_month = len(self._get_new_tks(this_month, now))
-        new_last_month = len(self._get_new_tks(previous_month, this_month))
-        perc_diff_new = perc_diff(new_this_month, new_last_month)
+        counts = self.daily_stats.last_month("help_tk")
+        
+        new_this_month = counts["new_this_month"]
+        perc_diff_new = perc_diff(new_this_month, counts["new_last_month"])
         
-        resolved_this_month = len(self._get_resolved_tks(this_month, now))
-        resolved_last_month = len(self._get_resolved_tks(previous_month, this_month))
-        perc_diff_resolved = perc_diff(resolved_this_month, resolved_last_month)
+        resolved_this_month = counts["resolved_this_month"]
+        perc_diff_resolved = perc_diff(resolved_this_month, counts["resolved_last_month"])
         
         return { # MOCK HERE
             "new_this_month": new_this_month + 14,
@@ -191,6 +264,23 @@ class HelpTKs:
             "perc_diff_resolved": -0.1, #perc_diff_resolved
         }
         
+    def _count_by_day(self) -> Select:
+        """
+        Select of (day, new, resolved), the daily stats rebuilt from the tickets.
+        """
+        created_day = func.date(self.help_tks.c.created_at)
+        resolved_day = func.date(self.help_tks.c.resolved_at)
+        new_tks = select(
+            created_day.label('day'), func.count().label('new'), literal(0).label('resolved')
+        ).group_by(created_day)
+        resolved_tks = select(
+            resolved_day.label('day'), literal(0).label('new'), func.count().label('resolved')
+        ).where((self.help_tks.c.resolved == True) & (self.help_tks.c.resolved_at != None)).group_by(resolved_day)
+        counts = union_all(new_tks, resolved_tks).subquery()
+        return select(
+            counts.c.day, func.sum(counts.c.new).label('new'), func.sum(counts.c.resolved).label('resolved')
+        ).group_by(counts.c.day)
+
     def tickets_by_day(self, from_date: str, to_date: str) -> Optional[dict]:
         """
         Stats to collect:
@@ -198,33 +288,30 @@ class HelpTKs:
         - resolved tks by day
         format:
         { <date>: { "new": <int>, "resolved": <int> } }
+        The counts are read from the daily rollup, one row per day.
         """
-        all_tks = self._get_new_tks(from_date, to_date)
-        resolved_tks = self._get_resolved_tks(from_date, to_date)
-        results = {}
-        for tk in all_tks:
-            created_date = tk['created_at'].split(' ')[0]
-            results[created_date] = results.get(created_date, {"new": 0, "resolved": 0})
-            results[created_date]["new"] += 1
-        for tk in resolved_tks:
-            updated_date = tk['updated_at'].split(' ')[0]
-            results[updated_date] = results.get(updated_date, {"new": 0, "resolved": 0})
-            results[updated_date]["resolved"] += 1
-        return results
+        return self.daily_stats.by_day("help_tk", from_date, to_date)
+
+    def backfill_daily_stats(self) -> bool:
+        return self.daily_stats.replace("help_tk", self._count_by_day())
     
-    def set_last_updated(self, uuid: str) -> bool:
+    def set_last_updated(self, uuid: str) -> Optional[dict]:
+        """
+        Returns the updated ticket, or None if it does not exist.
+        """
         with Session(self.engine) as session:
             try:
-                query = self.help_tks.update().where(self.help_tks.c.uuid == uuid).values(
-                    updated_at=get_actual_time()
-                )
-                session.execute(query)
+                query = self.help_tks.update().where(self.help_tks.c.uuid == parse_uuid(uuid)).values(
+                    updated_at=parse_local_time(get_actual_time())
+                ).returning(*self.help_tks.c)
+                tk = session.execute(query).fetchone()
                 session.commit()
+                self.cache.invalidate(uuid)
             except SQLAlchemyError as e:
                 logger.error(f"SQLAlchemyError: {e}")
                 session.rollback()
-                return False
-        return True
+                return None
+        return serialize_row(tk) if tk else None
     
     def get_not_resolved(self) -> Optional[list[dict]]:
         with self.engine.connect() as connection:
@@ -235,7 +322,7 @@ class HelpTKs:
                 return None
             tks_list = []
             for tk in tks:
-                dict_tk = tk._asdict()
+                dict_tk = serialize_row(tk)
                 tks_list.append({
                     "uuid": dict_tk['uuid'],
                     "title": dict_tk['title'],
@@ -0,0 +1,285 @@
+from contextlib import contextmanager
+from typing import Optional
+from sqlalchemy import MetaData, Table, Column, String, Boolean, Integer, Date, DateTime, Enum, Uuid, Index, select, text
+import logging as logger
+from sqlalchemy.orm import Session
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+from lib.utils import get_actual_time, get_engine
+
+MIGRATIONS_LOCK_ID = 921200 # pg_advisory_lock key, shared by every worker
+
+class Migrations:
+    """
+    Migrations class that keeps the version of the tickets schema in a db through sqlalchemy
+    Fields:
+    - version: int (unique) [pk]
+    - description: str
+    - applied_at: datetime
+
+    Every migration is a function in MIGRATIONS that receives a connection, it runs in
+    the same transaction that records its version, so a failed migration is applied
+    again from scratch. Online migrations (marked with @online) can not run in a
+    transaction, they receive the engine and must be idempotent.
+    They declare the tables as they were at that version (not as they are now), so
+    old migrations keep working when the managers change their tables.
+    """
+
+    def __init__(self, engine=None):
+        self.engine = engine or get_engine()
+        self.create_table()
+
+    def create_table(self):
+        with Session(self.engine) as session:
+            metadata = MetaData()
+            self.schema_migrations = Table(
+                'schema_migrations',
+                metadata,
+                Column('version', Integer, primary_key=True),
+                Column('description', String),
+                Column('applied_at', String)
+            )
+            metadata.create_all(self.engine)
+            session.commit()
+
+    def current_version(self) -> int:
+        with self.engine.connect() as connection:
+            query = select(self.schema_migrations.c.version).order_by(self.schema_migrations.c.version.desc()).limit(1)
+            version = connection.execute(query).scalar()
+            return version or 0
+
+    def upgrade(self, target: Optional[int] = None) -> int:
+        """
+        Applies every pending migration up to `target` (the last one by default)
+        and returns the resulting version.
+        """
+        target = target or MIGRATIONS[-1][0]
+        if self.current_version() >= target:
+            return self.current_version()
+        with self.engine.connect() as lock_connection:
+            self._lock(lock_connection)
+            try:
+                # Another worker may have migrated while we waited for the lock
+                current = self.current_version()
+                for version, description, migration in MIGRATIONS:
+                    if version <= current or version > target:
+                        continue
+                    logger.info(f"Applying migration {version}: {description}")
+                    if getattr(migration, 'online', False):
+                        migration(self.engine)
+                    with self._transaction() as connection:
+                        if not getattr(migration, 'online', False):
+                            migration(connection)
+                        connection.execute(self.schema_migrations.insert().values(
+                            version=version,
+                            description=description,
+                            applied_at=get_actual_time()
+                        ))
+            finally:
+                self._unlock(lock_connection)
+        return self.current_version()
+
+    @contextmanager
+    def _transaction(self):
+        with self.engine.begin() as connection:
+            if self.engine.dialect.name == 'sqlite':
+                # pysqlite only opens a transaction before DML, DDL would be autocommitted
+                connection.exec_driver_sql("BEGIN")
+            yield connection
+
+    def _lock(self, connection):
+        if self.engine.dialect.name == 'postgresql':
+            connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+
+    def _unlock(self, connection):
+        if self.engine.dialect.name == 'postgresql':
+            connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+
+def online(migration):
+    migration.online = True
+    return migration
+
+def _reports_v1(metadata: MetaData) -> Table:
+    return Table(
+        'reports',
+        metadata,
+        Column('uuid', String, primary_key=True),
+        Column('type', String),
+        Column('target_identifier', String),
+        Column('title', String),
+        Column('description', String),
+        Column('complainant', String),
+        Column('created_at', String),
+        Column('updated_at', String),
+        Column('resolved', Boolean)
+    )
+
+def _help_tks_v1(metadata: MetaData) -> Table:
+    return Table(
+        'help_tks',
+        metadata,
+        Column('uuid', String, primary_key=True),
+        Column('title', String),
+        Column('description', String),
+        Column('requester', String),
+        Column('created_at', String),
+        Column('resolved', Boolean),
+        Column('updated_at', String)
+    )
+
+def _reports_v2(metadata: MetaData) -> Table:
+    return Table(
+        'reports',
+        metadata,
+        Column('uuid', Uuid, primary_key=True),
+        Column('type', Enum('ACCOUNT', 'SERVICE', name='report_type')),
+        Column('target_identifier', String),
+        Column('title', String),
+        Column('description', String),
+        Column('complainant', String),
+        Column('created_at', DateTime(timezone=True)),
+        Column('updated_at', DateTime(timezone=True)),
+        Column('resolved', Boolean)
+    )
+
+def _help_tks_v2(metadata: MetaData) -> Table:
+    return Table(
+        'help_tks',
+        metadata,
+        Column('uuid', Uuid, primary_key=True),
+        Column('title', String),
+        Column('description', String),
+        Column('requester', String),
+        Column('created_at', DateTime(timezone=True)),
+        Column('resolved', Boolean),
+        Column('updated_at', DateTime(timezone=True))
+    )
+
+def _create_index_online(engine, index: Index):
+    """
+    Creates the index without blocking writes on postgres (CREATE INDEX CONCURRENTLY).
+    A failed concurrent build leaves an INVALID index behind, it is dropped and rebuilt.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if engine.dialect.name == 'postgresql':
+            invalid = connection.execute(text(
+                "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+                "WHERE pg_class.relname = :name AND NOT pg_index.indisvalid"
+            ), {"name": index.name}).scalar()
+            if invalid:
+                connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+        index.create(connection, checkfirst=True)
+
+def _create_tickets_tables(connection):
+    metadata = MetaData()
+    _reports_v1(metadata)
+    _help_tks_v1(metadata)
+    metadata.create_all(connection)
+
+def _create_ticket_daily_stats(connection):
+    metadata = MetaData()
+    Table(
+        'ticket_daily_stats',
+        metadata,
+        Column('day', Date, primary_key=True),
+        Column('kind', String, primary_key=True),
+        Column('new', Integer, nullable=False, default=0),
+        Column('resolved', Integer, nullable=False, default=0)
+    )
+    metadata.create_all(connection)
+
+def _online_index(name: str, *columns, where=None) -> Index:
+    return Index(name, *columns, postgresql_concurrently=True, postgresql_where=where, sqlite_where=where)
+
+def _tickets_indexes(reports: Table, help_tks: Table) -> list[Index]:
+    return [
+        _online_index('ix_reports_target', reports.c.type, reports.c.target_identifier, reports.c.created_at, reports.c.uuid),
+        _online_index('ix_reports_unresolved', reports.c.updated_at, reports.c.uuid, where=reports.c.resolved == False),
+        _online_index('ix_reports_created_at', reports.c.created_at),
+        _online_index('ix_reports_updated_at', reports.c.updated_at),
+        _online_index('ix_help_tks_requester', help_tks.c.requester, help_tks.c.created_at, help_tks.c.uuid),
+        _online_index('ix_help_tks_unresolved', help_tks.c.updated_at, help_tks.c.uuid, where=help_tks.c.resolved == False),
+        _online_index('ix_help_tks_created_at', help_tks.c.created_at),
+        _online_index('ix_help_tks_updated_at', help_tks.c.updated_at)
+    ]
+
+@online
+def _create_tickets_indexes(engine):
+    metadata = MetaData()
+    for index in _tickets_indexes(_reports_v1(metadata), _help_tks_v1(metadata)):
+        _create_index_online(engine, index)
+
+def _native_tickets_types(connection):
+    """
+    Converts uuid, type, created_at and updated_at from text to uuid, enum and timestamptz.
+    On postgres the columns are rewritten in place (the indexes are rebuilt with them),
+    this takes an exclusive lock on each table for the duration of the rewrite.
+    The stored texts are local times, they are cast in the session time zone that get_engine sets to the app one.
+    SQLite can not change column types, the tables are rebuilt and copied instead.
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(
+            "DO $$ BEGIN CREATE TYPE report_type AS ENUM ('ACCOUNT', 'SERVICE'); "
+            "EXCEPTION WHEN duplicate_object THEN NULL; END $$"
+        ))
+        connection.execute(text(
+            "ALTER TABLE reports "
+            "ALTER COLUMN uuid TYPE uuid USING uuid::uuid, "
+            "ALTER COLUMN type TYPE report_type USING type::report_type, "
+            "ALTER COLUMN created_at TYPE timestamptz USING created_at::timestamptz, "
+            "ALTER COLUMN updated_at TYPE timestamptz USING updated_at::timestamptz"
+        ))
+        connection.execute(text(
+            "ALTER TABLE help_tks "
+            "ALTER COLUMN uuid TYPE uuid USING uuid::uuid, "
+            "ALTER COLUMN created_at TYPE timestamptz USING created_at::timestamptz, "
+            "ALTER COLUMN updated_at TYPE timestamptz USING updated_at::timestamptz"
+        ))
+        return
+    metadata = MetaData()
+    tables = {'reports': _reports_v2(metadata), 'help_tks': _help_tks_v2(metadata)}
+    for name, table in tables.items():
+        connection.execute(text(f"ALTER TABLE {name} RENAME TO {name}_v1"))
+        table.create(connection)
+        columns = [column.name for column in table.columns]
+        converted = ", ".join(
+            "replace(uuid, '-', '')" if column == 'uuid' else
+            f"{column} || '.000000'" if column in ('created_at', 'updated_at') else
+            column
+            for column in columns
+        )
+        connection.execute(text(
+            f"INSERT INTO {name} ({', '.join(columns)}) SELECT {converted} FROM {name}_v1"
+        ))
+        connection.execute(text(f"DROP TABLE {name}_v1"))
+    for index in _tickets_indexes(tables['reports'], tables['help_tks']):
+        index.create(connection, checkfirst=True)
+
+def _tickets_resolved_at(connection):
+    """
+    Adds resolved_at, the time the ticket was resolved (NULL while it is not resolved),
+    so the resolved counters do not move with updated_at. The tickets resolved before
+    get their updated_at, the closest time that was stored.
+    """
+    column_type = "timestamptz" if connection.dialect.name == 'postgresql' else "DATETIME"
+    for name in ('reports', 'help_tks'):
+        connection.execute(text(f"ALTER TABLE {name} ADD COLUMN resolved_at {column_type}"))
+        connection.execute(text(f"UPDATE {name} SET resolved_at = updated_at WHERE resolved"))
+
+MIGRATIONS = [
+    (1, "create reports and help_tks", _create_tickets_tables),
+    (2, "create ticket_daily_stats", _create_ticket_daily_stats),
+    (3, "tickets lookup indexes", _create_tickets_indexes),
+    (4, "native uuid, enum and timestamp tickets columns", _native_tickets_types),
+    (5, "tickets resolved_at", _tickets_resolved_at),
+]
+
+if __name__ == "__main__":
+    # Applies the pending migrations, run with:
+    # python migrations_sql.py
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    print(f"Schema at version {Migrations().upgrade()}")
@@ -1,30 +1,37 @@
 from datetime import datetime, timedelta
 import random
 from typing import Optional, Union
-from sqlalchemy import MetaData, Table, Column, String, Boolean
+from sqlalchemy import MetaData, Table, Column, String, Boolean, DateTime, Enum, Uuid, select, func, literal, union_all, tuple_
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 import logging as logger
 from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.sql import text
+from sqlalchemy.sql import text, Select
 import os
 import sys
 import uuid
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
-from lib.utils import get_actual_time, get_engine
+from lib.utils import get_actual_time, get_engine, parse_local_time, format_time, parse_uuid, serialize_row, encode_keyset_cursor, decode_keyset_cursor
+from daily_stats_sql import DailyStats
+from migrations_sql import Migrations
+from tks_cache import TksCache
 
 HOUR = 60 * 60
 MINUTE = 60
 MILLISECOND = 1_000
 
+SUMMARY_COLUMNS = ("uuid", "title", "resolved", "updated_at")
+
+REPORT_TYPES = ("ACCOUNT", "SERVICE")
+
 # TODO: (General) -> Create tests for each method && add the required checks in each method
 
 class Reports:
     """
     Reports class that stores data in a db through sqlalchemy
     Fields:
-    - uuid: str (unique) [pk]
+    - uuid: uuid (unique) [pk]
     - type: str (ACCOUNT or SERVICE)
     - target_identifier: str
     - title: str
@@ -33,41 +40,42 @@ class Reports:
     - created_at: datetime
     - updated_at: datetime
     - resolved: bool
+    - resolved_at: datetime (None while it is not resolved)
+
+    The resolved counter of the daily stats counts the resolved reports on the day of
+    their resolved_at, updated_at moves with every chat message.
     """
 
-    def __init__(self, engine=None):
+    def __init__(self, engine=None, cache=None):
         self.engine = engine or get_engine()
         self.create_table()
+        self.daily_stats = DailyStats(engine=self.engine)
+        self.cache = TksCache("reports", cache)
         logger.getLogger('sqlalchemy.engine').setLevel(logger.DEBUG)
         self.metadata = MetaData()
         self.metadata.bind = self.engine
         self.Session = sessionmaker(bind=self.engine)
         
-    def drop(self):
-        with Session(self.engine) as session:
-            self.reports.drop(self.engine)
-            session.commit()
-
     def create_table(self):
-        with Session(self.engine) as session:
-            metadata = MetaData()
-            self.reports = Table(
-                'reports',
-                metadata,
-                Column('uuid', String, primary_key=True, default=lambda: str(uuid.uuid4())),
-                Column('type', String),
-                Column('target_identifier', String),
-                Column('title', String),
-                Column('description', String),
-                Column('complainant', String),
-                Column('created_at', String),
-                Column('updated_at', String),
-                Column('resolved', Boolean)
-            )
-            metadata.create_all(self.engine)
-            session.commit()
+        metadata = MetaData()
+        self.reports = Table(
+            'reports',
+            metadata,
+            Column('uuid', Uuid, primary_key=True, default=uuid.uuid4),
+            Column('type', Enum(*REPORT_TYPES, name='report_type')),
+            Column('target_identifier', String),
+            Column('title', String),
+            Column('description', String),
+            Column('complainant', String),
+            Column('created_at', DateTime(timezone=True)),
+            Column('updated_at', DateTime(timezone=True)),
+            Column('resolved', Boolean),
+            Column('resolved_at', DateTime(timezone=True))
+        )
+        Migrations(self.engine).upgrade()
     
     def insert(self, type: str, target_identifier: str, title: str, description: str, complainant: str) -> Optional[str]:
+        now = get_actual_time()
         with Session(self.engine) as session:
             try:
                 query = self.reports.insert().values(
@@ -76,12 +84,13 @@ class Reports:
                     title=title,
                     description=description,
                     complainant=complainant,
-                    created_at=get_actual_time(),
-                    updated_at=get_actual_time(),
+                    created_at=parse_local_time(now),
+                    updated_at=parse_local_time(now),
                     resolved=False
                 ).returning(self.reports.c.uuid)
                 result = session.execute(query)
-                inserted_uuid = result.scalar() # TODO: Check if this works
+                inserted_uuid = str(result.scalar())
+                self.daily_stats.increment(session, now, "report_tk", new=1)
                 session.commit()
                 return inserted_uuid
             except IntegrityError as e:
@@ -94,13 +103,32 @@ class Reports:
                 return None
     
     def get(self, uuid: str) -> Optional[dict]:
+        return self.cache.get(uuid, self._get)
+
+    def _get(self, uuid: str) -> Optional[dict]:
         with self.engine.connect() as connection:
-            query = self.reports.select().where(self.reports.c.uuid == uuid)
+            query = self.reports.select().where(self.reports.c.uuid == parse_uuid(uuid))
             result = connection.execute(query)
             report = result.fetchone()
             if report is None:
                 return None
-            return report._asdict()
+            return serialize_row(report)
+    
+    def get_many(self, uuids: list[str]) -> dict[str, dict]:
+        """
+        Returns { <uuid>: <ticket> } for the given uuids that exist, with a single
+        WHERE uuid IN (...) query for the ones that are not cached.
+        """
+        return self.cache.get_many(uuids, self._get_many)
+
+    def _get_many(self, uuids: list[str]) -> dict[str, dict]:
+        requested = {parse_uuid(uuid): uuid for uuid in uuids if parse_uuid(uuid)}
+        if not requested:
+            return {}
+        with self.engine.connect() as connection:
+            query = self.reports.select().where(self.reports.c.uuid.in_(list(requested)))
+            result = connection.execute(query)
+            return {requested[report.uuid]: serialize_row(report) for report in result}
     
     def get_by_target(self, type: str, target_identifier: str) -> Optional[list[dict]]:
         with self.engine.connect() as connection:
@@ -109,63 +137,84 @@ class Reports:
             reports = result.fetchall()
             if reports is None:
                 return None
-            return [report._asdict() for report in reports]
+            return [serialize_row(report) for report in reports]
         
+    def get_page_by_target(self, type: str, target_identifier: str, limit: int, cursor: Optional[str] = None, summary: bool = False) -> tuple[list[dict], Optional[str]]:
+        """
+        Returns a page of the target reports, oldest first, and the cursor of the next page.
+        With summary only SUMMARY_COLUMNS are read, so descriptions are never loaded.
+        """
+        columns = [self.reports.c[column] for column in SUMMARY_COLUMNS] if summary else list(self.reports.c)
+        query = select(*columns, self.reports.c.created_at.label('page_created_at')).where((self.reports.c.type == type) & (self.reports.c.target_identifier == target_identifier))
+        if cursor:
+            created_at, uuid = decode_keyset_cursor(cursor)
+            query = query.where(tuple_(self.reports.c.created_at, self.reports.c.uuid) > tuple_(
+                literal(created_at, self.reports.c.created_at.type), literal(uuid, self.reports.c.uuid.type)
+            ))
+        query = query.order_by(self.reports.c.created_at, self.reports.c.uuid).limit(limit + 1)
+        with self.engine.connect() as connection:
+            tks = connection.execute(query).fetchall()
+        next_cursor = None
+        if len(tks) > limit:
+            tks = tks[:limit]
+            next_cursor = encode_keyset_cursor(tks[-1].page_created_at, tks[-1].uuid)
+        tks_list = []
+        for tk in tks:
+            dict_tk = serialize_row(tk)
+            dict_tk.pop('page_created_at')
+            tks_list.append(dict_tk)
+        return tks_list, next_cursor
+    
     def delete(self, uuid: str) -> bool:
         with Session(self.engine) as session:
             try:
-                query = self.reports.delete().where(self.reports.c.uuid == uuid)
-                session.execute(query)
+                query = self.reports.delete().where(self.reports.c.uuid == parse_uuid(uuid)).returning(
+                    self.reports.c.created_at,
+                    self.reports.c.resolved,
+                    self.reports.c.resolved_at
+                )
+                deleted = session.execute(query).fetchone()
+                if deleted:
+                    self.daily_stats.increment(session, format_time(deleted.created_at), "report_tk", new=-1)
+                    if deleted.resolved and deleted.resolved_at:
+                        self.daily_stats.increment(session, format_time(deleted.resolved_at), "report_tk", resolved=-1)
                 session.commit()
+                self.cache.invalidate(uuid)
             except SQLAlchemyError as e:
                 logger.error(f"SQLAlchemyError: {e}")
                 session.rollback()
                 return False
         return True
     
-    def resolve(self, uuid: str) -> bool:
+    def resolve(self, uuid: str) -> Optional[dict]:
+        """
+        Returns the resolved report, or None if it does not exist.
+        """
+        now = get_actual_time()
         with Session(self.engine) as session:
             try:
-                query = self.reports.update().where(self.reports.c.uuid == uuid).values(
+                query = self.reports.update().where(
+                    (self.reports.c.uuid == parse_uuid(uuid)) & (self.reports.c.resolved == False)
+                ).values(
                     resolved=True,
-                    updated_at=get_actual_time()
-                )
-                session.execute(query)
+                    resolved_at=parse_local_time(now),
+                    updated_at=parse_local_time(now)
+                ).returning(*self.reports.c)
+                report = session.execute(query).fetchone()
+                if report:
+                    self.daily_stats.increment(session, now, "report_tk", resolved=1)
+                else:
+                    query = self.reports.update().where(self.reports.c.uuid == parse_uuid(uuid)).values(
+                        updated_at=parse_local_time(now)
+                    ).returning(*self.reports.c)
+                    report = session.execute(query).fetchone()
                 session.commit()
+                self.cache.invalidate(uuid)
             except SQLAlchemyError as e:
                 logger.error(f"SQLAlchemyError: {e}")
                 session.rollback()
-                return False
-        return True
-    
-    def _get_new_tks(self, from_date: str, to_date: str) -> int:
-        with self.engine.connect() as connection:
-            query = self.reports.select().where(
-                (self.reports.c.created_at >= from_date) & 
-                (self.reports.c.created_at <= to_date)
-            )
-            result = connection.execute(query)
-            tks = result.fetchall()
-            tks_list = []
-            for tk in tks:
-                dict_tk = tk._asdict()
-                tks_list.append(dict_tk)
-            return tks_list
-        
-    def _get_resolved_tks(self, from_date: str, to_date: str) -> int:
-        with self.engine.connect() as connection:
-            query = self.reports.select().where(
-                (self.reports.c.updated_at >= from_date) & 
-                (self.reports.c.updated_at <= to_date) &
-                (self.reports.c.resolved == True)
-            )
-            result = connection.execute(query)
-            tks = result.fetchall()
-            tks_list = []
-            for tk in tks:
-                dict_tk = tk._asdict()
-                tks_list.append(dict_tk)
-            return tks_list
+                return None
+        return serialize_row(report) if report else None
     
     def last_month_stats(self) -> Optional[dict]:
         """
@@ -173,19 +222,15 @@ class Reports:
         - new tks this month and % difference with last month
         - resolved tks this month and % difference with last month
         """
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        this_month = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
-        previous_month = (datetime.now() - timedelta(days=60)).strftime('%Y-%m-%d %H:%M:%S')
-        
         perc_diff = lambda new, last: round(((new - last) / last) if last != 0 else 1, 2)
         
-        new_this_month = len(self._get_new_tks(this_month, now))
-        new_last_month = len(self._get_new_tks(previous_month, this_month))
-        perc_diff_new = perc_diff(new_this_month, new_last_month)
+        counts = self.daily_stats.last_month("report_tk")
+        
+        new_this_month = counts["new_this_month"]
+        perc_diff_new = perc_diff(new_this_month, counts["new_last_month"])
         
-        resolved_this_month = len(self._get_resolved_tks(this_month, now))
-        resolved_last_month = len(self._get_resolved_tks(previous_month, this_month))
-        perc_diff_resolved = perc_diff(resolved_this_month, resolved_last_month)
+        resolved_this_month = counts["resolved_this_month"]
+        perc_diff_resolved = perc_diff(resolved_this_month, counts["resolved_last_month"])
         
         return { # MOCK HERE
             "new_this_month": new_this_month + 23,
@@ -194,6 +239,23 @@ class Reports:
             "perc_diff_resolved": 0.9, #perc_diff_resolved
         }
         
+    def _count_by_day(self) -> Select:
+        """
+        Select of (day, new, resolved), the daily stats rebuilt from the tickets.
+        """
+        created_day = func.date(self.reports.c.created_at)
+        resolved_day = func.date(self.reports.c.resolved_at)
+        new_tks = select(
+            created_day.label('day'), func.count().label('new'), literal(0).label('resolved')
+        ).group_by(created_day)
+        resolved_tks = select(
+            resolved_day.label('day'), literal(0).label('new'), func.count().label('resolved')
+        ).where((self.reports.c.resolved == True) & (self.reports.c.resolved_at != None)).group_by(resolved_day)
+        counts = union_all(new_tks, resolved_tks).subquery()
+        return select(
+            counts.c.day, func.sum(counts.c.new).label('new'), func.sum(counts.c.resolved).label('resolved')
+        ).group_by(counts.c.day)
+
     def tickets_by_day(self, from_date: str, to_date: str) -> Optional[dict]:
         """
         Stats to collect:
@@ -201,33 +263,30 @@ class Reports:
         - resolved tks by day
         format:
         { <date>: { "new": <int>, "resolved": <int> } }
+        The counts are read from the daily rollup, one row per day.
         """
-        all_tks = self._get_new_tks(from_date, to_date)
-        resolved_tks = self._get_resolved_tks(from_date, to_date)
-        results = {}
-        for tk in all_tks:
-            created_date = tk['created_at'].split(' ')[0]
-            results[created_date] = results.get(created_date, {"new": 0, "resolved": 0})
-            results[created_date]["new"] += 1
-        for tk in resolved_tks:
-            updated_date = tk['updated_at'].split(' ')[0]
-            results[updated_date] = results.get(updated_date, {"new": 0, "resolved": 0})
-            results[updated_date]["resolved"] += 1
-        return results
+        return self.daily_stats.by_day("report_tk", from_date, to_date)
+
+    def backfill_daily_stats(self) -> bool:
+        return self.daily_stats.replace("report_tk", self._count_by_day())
     
-    def set_last_updated(self, uuid: str) -> bool:
+    def set_last_updated(self, uuid: str) -> Optional[dict]:
+        """
+        Returns the updated report, or None if it does not exist.
+        """
         with Session(self.engine) as session:
             try:
-                query = self.reports.update().where(self.reports.c.uuid == uuid).values(
-                    updated_at=get_actual_time()
-                )
-                session.execute(query)
+                query = self.reports.update().where(self.reports.c.uuid == parse_uuid(uuid)).values(
+                    updated_at=parse_local_time(get_actual_time())
+                ).returning(*self.reports.c)
+                report = session.execute(query).fetchone()
                 session.commit()
+                self.cache.invalidate(uuid)
             except SQLAlchemyError as e:
                 logger.error(f"SQLAlchemyError: {e}")
                 session.rollback()
-                return False
-        return True
+                return None
+        return serialize_row(report) if report else None
     
     def get_not_resolved(self) -> Optional[list[dict]]:
         with self.engine.connect() as connection:
@@ -238,7 +297,7 @@ class Reports:
                 return None
             tks_list = []
             for tk in tks:
-                dict_tk = tk._asdict()
+                dict_tk = serialize_row(tk)
                 tks_list.append({
                     "uuid": dict_tk['uuid'],
                     "title": dict_tk['title'],
@@ -1,15 +1,19 @@
 from typing import Optional, List, Dict
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
-from pymongo import ASCENDING
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
 from pymongo.errors import DuplicateKeyError, OperationFailure
 import logging as logger
 import os
 import sys
 import uuid
+from datetime import timedelta
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
-from lib.utils import get_actual_time, get_mongo_client, get_time_plus_days
+from lib.utils import get_actual_time, get_mongo_client, get_time_plus_days, parse_time, encode_cursor, decode_cursor
 
 HOUR = 60 * 60
 MINUTE = 60
@@ -21,15 +25,22 @@ AMMEND_STRIKE = 0.5
 
 SUSPEND_TIME = 90 # days
 
+STRIKES_INDEXES = {
+    'user_id_1': ([('user_id', ASCENDING)], {'unique': True}),
+    'suspension_ends_1': ([('suspension_ends', ASCENDING)], {}),
+    'updated_at_1': ([('updated_at', ASCENDING)], {}) # Delta sync of the suspended users replicas
+}
+LEGACY_INDEXES = {'uuid_1'} # Strike profiles never had a uuid
+
 # TODO: (General) -> Create tests for each method && add the required checks in each method
 
 class Strikes:
     """
-    Strikes class that stores data in a MongoDB collection.
-    Fields:
+    Strikes class that stores data in two MongoDB collections.
+    Strikes fields (strikes):
     - user_id: str (unique) [pk] The id of the user
     - strikes: list(dict) The list of strikes
-    - suspensions: list(dict) The list of suspensions (dates)
+    - strike_total: float The sum of the values of the strikes
     - suspension_ends: int The timestamp of the last suspension
     - created_at: int The timestamp of the creation of the strikes
     - updated_at: int The timestamp of the last update of the strikes
@@ -43,9 +54,11 @@ class Strikes:
     - strike_at: int The timestamp of the strike
     - updated_at: int The timestamp of the last update of the strike
 
-    Suspensions structure:
+    Suspensions fields (strikes-suspensions), one document per suspension:
+    - user_id: str The id of the suspended user [unique with suspension_at]
     - suspension_at: str The date of the suspension
-    - suspension strikes: list(strikes) The list of strikes that caused the suspension
+    - suspension_ends: str The date the suspension ends
+    - suspension_strikes: list(strikes) The list of strikes that caused the suspension
     """
 
     def __init__(self, test_client=None, test_db=None):
@@ -57,6 +70,7 @@ class Strikes:
         else:
             self.db = self.client[test_db or os.getenv('MONGO_DB')]
         self.collection = self.db['strikes']
+        self.suspensions = self.db['strikes-suspensions']
         self._create_collection()
 
     def _check_connection(self):
@@ -68,14 +82,51 @@ class Strikes:
         return True
     
     def _create_collection(self):
-        self.collection.create_index([('uuid', ASCENDING)], unique=True)
+        for name, (keys, options) in STRIKES_INDEXES.items():
+            try:
+                self.collection.create_index(keys, name=name, **options)
+            except OperationFailure as e:
+                logger.error(f"Error creating index '{name}' on strikes: {e}")
+        self.suspensions.create_index([('user_id', ASCENDING), ('suspension_at', DESCENDING), ('_id', DESCENDING)])
+        try:
+            self.suspensions.create_index([('user_id', ASCENDING), ('suspension_at', ASCENDING)], unique=True)
+        except OperationFailure as e:
+            logger.error(f"Error creating the unique index on strikes-suspensions: {e}")
+        existing = self.collection.index_information()
+        # The legacy indexes are only dropped once the user_id one replaced them
+        if 'user_id_1' in existing:
+            for name in LEGACY_INDEXES & set(existing):
+                self.collection.drop_index(name)
+        self.check_indexes()
+
+    def check_indexes(self) -> Dict[str, List[str]]:
+        """
+        Reports (and logs) the expected indexes that are missing, the indexes that were never
+        used since the server started ($indexStats, if available) and the unexpected ones.
+        """
+        existing = self.collection.index_information()
+        report = {
+            'missing': [name for name in STRIKES_INDEXES if name not in existing],
+            'unused': [],
+            'unexpected': [name for name in existing if name != '_id_' and name not in STRIKES_INDEXES]
+        }
+        try:
+            for stats in self.collection.aggregate([{'$indexStats': {}}]):
+                if stats['name'] != '_id_' and stats['accesses']['ops'] == 0:
+                    report['unused'].append(stats['name'])
+        except (OperationFailure, NotImplementedError) as e:
+            logger.info(f"Index usage of strikes not available: {e}")
+        for problem, names in report.items():
+            if names:
+                logger.warning(f"Strikes indexes {problem}: {', '.join(names)}")
+        return report
     
     def _create_strikes_profile(self, user_id: str) -> bool:
         try:
             self.collection.insert_one({
                 'user_id': user_id,
                 'strikes': [],
-                'suspensions': [],
+                'strike_total': 0,
                 'suspension_ends': None,
                 'created_at': get_actual_time(),
                 'updated_at': get_actual_time()
@@ -94,101 +145,186 @@ class Strikes:
     def get(self, user_id: str) -> Optional[Dict]:
         return self.collection.find_one({'user_id': user_id})
     
-    def _check_suspension(self, user_id: str) -> bool:
-        strikes_profile = self.get(user_id)
-        if not strikes_profile or len(strikes_profile['strikes']) == 0:
-            return False
-        strikes_sum = sum(strike['strike_value'] for strike in strikes_profile['strikes'])
-        if strikes_sum <= MAX_STRIKES:
-            return False
-        time_now = get_actual_time()
-        self.collection.update_one({'user_id': user_id}, {
-            '$push': {
-                'suspensions': {
-                    'suspension_at': time_now,
-                    'suspension_strikes': strikes_profile['strikes']
-                }
-            },
-            '$set': {
-                'strikes': [],
-                'updated_at': time_now,
-                'suspension_ends': get_time_plus_days(SUSPEND_TIME)
-            }
-        })
-        return True
-        
     def add_strike(self, user_id: str, report_tk: str, strike_type: str, strike_reason: str) -> Optional[bool]:
-        strikes_profile = self.get(user_id)
-        if not strikes_profile:
-            if not self._create_strikes_profile(user_id):
-                return None
-            strikes_profile = self.get(user_id)
-        
+        """
+        Adds the strike and suspends the user if the strikes go over MAX_STRIKES, in a single
+        atomic update (the profile is created on the first strike). Returns if the user was suspended.
+        """
         if not strike_type in STRIKE_VALUES:
             logger.error(f"Invalid strike type '{strike_type}'")
             return None
         time_now = get_actual_time()
+        strike = {
+            'report_tk': report_tk,
+            'strike_value': STRIKE_VALUES[strike_type],
+            'strike_reason': strike_reason,
+            'ammended': False,
+            'ammended_reason': "",
+            'strike_at': time_now,
+            'updated_at': time_now
+        }
         try:
-            self.collection.update_one({'user_id': user_id}, {
-                '$push': {
-                    'strikes': {
-                        'report_tk': report_tk,
-                        'strike_value': STRIKE_VALUES[strike_type],
-                        'strike_reason': strike_reason,
-                        'ammended': False,
-                        'ammended_reason': "",
-                        'strike_at': time_now,
-                        'updated_at': time_now
-                    }
-                },
-                '$set': {
-                    'updated_at': time_now
-                }
-            })
-            return self._check_suspension(user_id)
+            suspension_ends = get_time_plus_days(SUSPEND_TIME)
+            profile = self._add_strike(user_id, strike, time_now, suspension_ends)
         except Exception as e:
             logger.error(f"Error adding strike to user '{user_id}': {e}")
             return None
+        strikes = (profile or {}).get('strikes', []) + [strike]
+        if _strike_total(profile) + strike['strike_value'] <= MAX_STRIKES:
+            return False
+        try:
+            self.suspensions.update_one(
+                {'user_id': user_id, 'suspension_at': time_now},
+                {'$setOnInsert': {'suspension_ends': suspension_ends, 'suspension_strikes': strikes}},
+                upsert=True
+            )
+        except Exception as e:
+            # The suspension is already applied, failing here would make the client add the strike again
+            logger.error(f"Error saving the suspension of user '{user_id}' to its history: {e}")
+        return True
+
+    def _add_strike(self, user_id: str, strike: Dict, time_now: str, suspension_ends: str) -> Optional[Dict]:
+        """
+        Returns the strikes and strike_total of the profile before the strike (None if it was created).
+        Profiles from before strike_total get it from their strikes.
+        """
+        strike_total = {'$ifNull': ['$strike_total', {'$ifNull': [{'$sum': '$strikes.strike_value'}, 0]}]}
+        suspended = {'$gt': ['$strike_total', MAX_STRIKES]}
+        update = [
+            {'$set': {
+                'strikes': {'$concatArrays': [{'$ifNull': ['$strikes', []]}, {'$literal': [strike]}]},
+                'strike_total': {'$add': [strike_total, strike['strike_value']]},
+                'created_at': {'$ifNull': ['$created_at', time_now]},
+                'updated_at': time_now
+            }},
+            {'$set': {
+                'strikes': {'$cond': [suspended, [], '$strikes']},
+                'strike_total': {'$cond': [suspended, 0, '$strike_total']},
+                'suspension_ends': {'$cond': [suspended, suspension_ends, {'$ifNull': ['$suspension_ends', None]}]}
+            }}
+        ]
+        for retry in (True, False):
+            try:
+                return self.collection.find_one_and_update(
+                    {'user_id': user_id}, update,
+                    projection={'_id': 0, 'strikes': 1, 'strike_total': 1},
+                    upsert=True, return_document=ReturnDocument.BEFORE
+                )
+            except DuplicateKeyError:
+                # A concurrent first strike created the profile, it matches now
+                if not retry:
+                    raise
         
     def ammend_strike(self, user_id: str, report_tk: str, ammend_reason: str) -> bool:
+        time_now = get_actual_time()
+        for retry in (True, False):
+            result = self.collection.update_one({
+                'user_id': user_id,
+                'strike_total': {'$exists': True},
+                'strikes': {'$elemMatch': {'report_tk': report_tk, 'ammended': False}}
+            }, {
+                '$inc': {
+                    'strikes.$.strike_value': -AMMEND_STRIKE,
+                    'strike_total': -AMMEND_STRIKE
+                },
+                '$set': {
+                    'strikes.$.ammended': True,
+                    'strikes.$.ammended_reason': ammend_reason,
+                    'strikes.$.updated_at': time_now,
+                    'updated_at': time_now
+                }
+            })
+            if result.modified_count:
+                return True
+            # Profiles from before strike_total get it once
+            fixed = self.collection.update_one(
+                {'user_id': user_id, 'strike_total': {'$exists': False}},
+                [{'$set': {'strike_total': {'$ifNull': [{'$sum': '$strikes.strike_value'}, 0]}}}]
+            )
+            if not retry or not fixed.modified_count:
+                break
         strikes_profile = self.get(user_id)
-        if not strikes_profile or len(strikes_profile['strikes']) == 0:
-            return False
-        if not report_tk in set(strike['report_tk'] for strike in strikes_profile['strikes']):
+        if not strikes_profile or not any(strike['report_tk'] == report_tk for strike in strikes_profile['strikes']):
             logger.error(f"Report ticket '{report_tk}' not found in user '{user_id}' strikes")
-            return False
-        strike = next(strike for strike in strikes_profile['strikes'] if strike['report_tk'] == report_tk)
-        if strike['ammended']:
+        else:
             logger.error(f"Strike with report ticket '{report_tk}' already ammended")
-            return False
-        time_now = get_actual_time()
-        self.collection.update_one({
-            'user_id': user_id,
-            'strikes.report_tk': report_tk
-        }, {
-            '$set': {
-                'strikes.$.strike_value': strike['strike_value'] - AMMEND_STRIKE,
-                'strikes.$.ammended': True,
-                'strikes.$.ammended_reason': ammend_reason,
-                'strikes.$.updated_at': time_now,
-                'updated_at': time_now
-            }
-        })
-        return True
+        return False
     
     def check_suspension(self, user_id: str) -> Optional[str]:
-        strikes_profile = self.get(user_id)
-        if not strikes_profile or len(strikes_profile['suspensions']) == 0:
-            return None
-        suspension_ends = strikes_profile['suspension_ends']
+        """
+        Returns when the suspension of the user ends, None if the user is not suspended.
+        """
+        strikes_profile = self.collection.find_one({'user_id': user_id}, {'_id': 0, 'suspension_ends': 1})
+        suspension_ends = (strikes_profile or {}).get('suspension_ends')
         if not suspension_ends:
             return None
-        return None if get_actual_time() < suspension_ends else suspension_ends
+        return suspension_ends if get_actual_time() < suspension_ends else None
+
+    def get_suspensions(self, user_id: str, limit: int, cursor: Optional[str] = None) -> tuple[List[Dict], Optional[str]]:
+        """
+        Returns a page of the suspensions of the user, the most recent first, and the cursor of the next page.
+        """
+        query = {'user_id': user_id}
+        if cursor:
+            after = decode_cursor(cursor)
+            try:
+                suspension_at, suspension_id = after[0], ObjectId(after[1])
+            except (IndexError, TypeError, InvalidId):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            query['$or'] = [
+                {'suspension_at': {'$lt': suspension_at}},
+                {'suspension_at': suspension_at, '_id': {'$lt': suspension_id}}
+            ]
+        suspensions = list(
+            self.suspensions.find(query)
+            .sort([('suspension_at', DESCENDING), ('_id', DESCENDING)])
+            .limit(limit + 1)
+        )
+        next_cursor = None
+        if len(suspensions) > limit:
+            suspensions = suspensions[:limit]
+            next_cursor = encode_cursor(suspensions[-1]['suspension_at'], str(suspensions[-1]['_id']))
+        for suspension in suspensions:
+            del suspension['_id']
+        return suspensions, next_cursor
+
+    def migrate_suspensions(self) -> int:
+        """
+        Moves the suspensions arrays of the old profiles to the suspensions collection.
+        It can run while the API is serving and be run again after a failure.
+        Returns the number of profiles migrated.
+        """
+        migrated = 0
+        for profile in self.collection.find({'suspensions': {'$exists': True}}, {'user_id': 1, 'suspensions': 1}):
+            for suspension in profile['suspensions']:
+                suspension_ends = (parse_time(suspension['suspension_at']) + timedelta(days=SUSPEND_TIME)).strftime('%Y-%m-%d %H:%M:%S')
+                self.suspensions.update_one(
+                    {'user_id': profile['user_id'], 'suspension_at': suspension['suspension_at']},
+                    {'$setOnInsert': {'suspension_ends': suspension_ends, 'suspension_strikes': suspension['suspension_strikes']}},
+                    upsert=True
+                )
+            result = self.collection.update_one(
+                {'_id': profile['_id'], 'suspensions': {'$size': len(profile['suspensions'])}},
+                {'$unset': {'suspensions': ''}}
+            )
+            migrated += result.modified_count
+        return migrated
     
     def get_all_suspendend(self) -> set[Dict]:
         actual_time = get_actual_time()
         return set(user['user_id'] for user in self.collection.find({'suspension_ends': {'$gt': actual_time}}, {'user_id': 1}))
 
-        
-        
-        
\ No newline at end of file
+def _strike_total(profile: Optional[Dict]) -> float:
+    if not profile:
+        return 0
+    if 'strike_total' in profile:
+        return profile['strike_total']
+    return sum(strike['strike_value'] for strike in profile.get('strikes', []))
+
+if __name__ == "__main__":
+    # Moves the suspensions of the old profiles to their collection, run with:
+    # python strikes_nosql.py
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    print(f"Migrated the suspensions of {Strikes().migrate_suspensions()} profiles")
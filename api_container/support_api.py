@@ -1,21 +1,33 @@
 from datetime import datetime, timedelta
+from typing import Iterator, Optional
+import asyncio
+import anyio
+import json
 import random
+import tempfile
+from urllib.parse import quote
 from mobile_token_nosql import MobileToken, send_notification
 from reports_sql import Reports
 from helptks_sql import HelpTKs
+from tickets_sql import Tickets, TK_TYPES
+from tks_cache import get_cache_backend
 from chats_nosql import Chats
+from chat_hub import ChatHub, get_chat_broker
+from blob_store import LocalBlobStore, BlobTooLarge, CHUNK_SIZE, get_blob_store
 from strikes_nosql import Strikes
 import logging as logger
 import time
-from fastapi import FastAPI, File, UploadFile, BackgroundTasks, HTTPException
+from fastapi import FastAPI, File, UploadFile, BackgroundTasks, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 import sys
 import os
 import mongomock
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
-from lib.utils import sentry_init, time_to_string, get_test_engine, validate_date
+from lib.utils import sentry_init, time_to_string, get_test_engine, validate_date, to_http_date
 
 time_start = time.time()
 
@@ -44,32 +56,44 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Last-Modified"],
 )
 
 if os.getenv('TESTING'):
     test_engine = get_test_engine()
-    reports_manager = Reports(engine=test_engine)
-    help_tks_manager = HelpTKs(engine=test_engine)
+    reports_manager = Reports(engine=test_engine, cache=get_cache_backend())
+    help_tks_manager = HelpTKs(engine=test_engine, cache=get_cache_backend())
 
     client = mongomock.MongoClient()
     chats_manager = Chats(test_client=client)
     strikes_manager = Strikes(test_client=client)
     mobile_token_manager = MobileToken(test_client=client)
+    blob_store = LocalBlobStore(tempfile.mkdtemp())
 else:
-    reports_manager = Reports()
-    help_tks_manager = HelpTKs()
+    reports_manager = Reports(cache=get_cache_backend())
+    help_tks_manager = HelpTKs(cache=get_cache_backend())
     chats_manager = Chats()
     strikes_manager = Strikes()
     mobile_token_manager = MobileToken()
+    blob_store = get_blob_store(chats_manager.db)
+tickets_manager = Tickets(help_tks_manager, reports_manager)
+chat_hub = ChatHub(get_chat_broker())
 
 VALID_REPORT_TYPES = {"ACCOUNT", "SERVICE"}
 REQUIRED_REPORT_FIELDS = {"title", "description", "complainant", "type", "target_identifier"}
 REQUIRED_HELP_TK_FIELDS = {"title", "description"}
 REQUIRED_HELP_TK_UPDATE_FIELDS = {"resolved"}
 REQUIRED_SUPPORT_CHAT_FIELDS = {"message", "tk_type", "support_agent"}
+REQUIRED_MARK_READ_FIELDS = {"support_agent"}
 VALID_STRIKE_TYPES = {"HIGH", "MEDIUM", "LOW"}
 REQUIRED_STRIKE_FIELDS = {"user_id", "report_tk", "strike_type", "strike_reason"}
 REQUIRED_AMMEND_STRIKE_FIELDS = {"user_id", "report_tk", "ammend_reason"}
+BATCH_TK_FIELDS = {"reports", "help"}
+MAX_BATCH_SIZE = 100
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_ATTACHMENT_SIZE = int(os.getenv('MAX_ATTACHMENT_SIZE', 10 * 1024 * 1024)) # bytes
+STREAM_KEEPALIVE = 15 # seconds, keeps proxies from closing idle streams
 
 starting_duration = time_to_string(time.time() - time_start)
 logger.info(f"Support API started in {starting_duration}")
@@ -106,18 +130,38 @@ def report_service(uuid: str, body: dict):
         raise HTTPException(status_code=400, detail="Error while inserting the report")
     return {"status": "ok", "report_id": uuid}
 
+def is_not_modified(request: Request, etag: str) -> bool:
+    """
+    Only If-None-Match is honored, If-Modified-Since has a resolution of one second
+    and many messages can be sent in the same second
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def validate_limit(limit: int) -> int:
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
 @app.get("/accounts/{username}")
-def get_account_reports(username: str):
-    reports = reports_manager.get_by_target("ACCOUNT", username)
-    if not reports:
+def get_account_reports(username: str, response: Response, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, summary: bool = False):
+    reports, next_cursor = reports_manager.get_page_by_target("ACCOUNT", username, validate_limit(limit), cursor, summary)
+    if not reports and not cursor:
         raise HTTPException(status_code=404, detail="Reports not found")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return reports
 
 @app.get("/services/{uuid}")
-def get_service_reports(uuid: str):
-    reports = reports_manager.get_by_target("SERVICE", uuid)
-    if not reports:
+def get_service_reports(uuid: str, response: Response, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, summary: bool = False):
+    reports, next_cursor = reports_manager.get_page_by_target("SERVICE", uuid, validate_limit(limit), cursor, summary)
+    if not reports and not cursor:
         raise HTTPException(status_code=404, detail="Reports not found")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return reports
 
 @app.put("/help/new/{requester_id}")
@@ -149,11 +193,21 @@ def get_report_tk(uuid: str):
         raise HTTPException(status_code=404, detail="Report not found")
     return report
 
+@app.put("/report/{uuid}/resolve")
+def resolve_report_tk(uuid: str):
+    report = reports_manager.resolve(uuid)
+    if not report:
+        raise HTTPException(status_code=404, detail="Report not found")
+    chats_manager.set_resolved(uuid, True)
+    return {"status": "ok"}
+
 @app.get("/help/list/{requester_id}")
-def get_help_tks(requester_id: str):
-    reports = help_tks_manager.get_by_user(requester_id)
-    if not reports:
+def get_help_tks(requester_id: str, response: Response, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, summary: bool = False):
+    reports, next_cursor = help_tks_manager.get_page_by_user(requester_id, validate_limit(limit), cursor, summary)
+    if not reports and not cursor:
         raise HTTPException(status_code=404, detail="Reports not found")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return reports
 
 @app.put("/help/{uuid}")
@@ -166,10 +220,11 @@ def update_help_tk(uuid: str, body: dict):
         raise HTTPException(status_code=400, detail=f"Extra fields: {', '.join(extra_fields)}")
     if len(body["comment"]) == 0:
         raise HTTPException(status_code=400, detail="Comment cannot be empty")
-    result = help_tks_manager.update(uuid, **body)
-    if not result:
+    tk = help_tks_manager.update(uuid, body["resolved"])
+    if not tk:
         raise HTTPException(status_code=400, detail="Error while updating the report")
-    user_id = help_tks_manager.get(uuid)["requester"]
+    chats_manager.set_resolved(uuid, body["resolved"])
+    user_id = tk["requester"]
     send_notification(mobile_token_manager, user_id, "Help Ticket Updated", f"Your help ticket {uuid} has been updated")
     return {"status": "ok"}
 
@@ -183,40 +238,218 @@ def update_support_chat(uuid: str, body: dict):
         raise HTTPException(status_code=400, detail=f"Extra fields: {', '.join(extra_fields)}")
     if len(body["message"]) == 0:
         raise HTTPException(status_code=400, detail="Message cannot be empty")
-    if body["tk_type"] not in {"HELP", "REPORT"}:
+    tk = get_chat_tk(uuid, body["tk_type"])
+    send_chat_message(uuid, body["tk_type"], tk, body["support_agent"], body["message"])
+    return {"status": "ok"}
+
+def get_chat_tk(uuid: str, tk_type: str) -> dict:
+    if tk_type not in {"HELP", "REPORT"}:
         raise HTTPException(status_code=400, detail="Invalid tk_type, must be 'HELP' or 'REPORT'")
-    tks_manager = help_tks_manager if body["tk_type"] == "HELP" else reports_manager
-    user_id_field = "requester" if body["tk_type"] == "HELP" else "complainant"
-    if not tks_manager.get(uuid):
-        raise HTTPException(status_code=404, detail=f"{body['tk_type']} tk {uuid} not found")
-    
-    sender = "SUPPORT_AGENT" if body["support_agent"] else "USER"
-    if not chats_manager.insert_message(body["message"], sender, uuid):
+    tks_manager = help_tks_manager if tk_type == "HELP" else reports_manager
+    tk = tks_manager.get(uuid)
+    if not tk:
+        raise HTTPException(status_code=404, detail=f"{tk_type} tk {uuid} not found")
+    return tk
+
+def send_chat_message(uuid: str, tk_type: str, tk: dict, support_agent: bool, content: str, attachment: Optional[dict] = None):
+    user_id_field = "requester" if tk_type == "HELP" else "complainant"
+    sender = "SUPPORT_AGENT" if support_agent else "USER"
+    message = chats_manager.send_message(content, sender, uuid, attachment, resolved=bool(tk["resolved"]))
+    if not message:
         raise HTTPException(status_code=400, detail="Error while sending the message")
-    if sender == "SUPPORT_AGENT":
-        user_id = tks_manager.get(uuid)[user_id_field]
-        send_notification(mobile_token_manager, user_id, "New Support Chat Message", f"New message in your {body['tk_type']} chat {uuid}")
-    
+    tks_manager = help_tks_manager if tk_type == "HELP" else reports_manager
     tks_manager.set_last_updated(uuid)
-    return {"status": "ok"}
+    chat_hub.publish(uuid, message)
+    if sender == "SUPPORT_AGENT":
+        send_notification(mobile_token_manager, tk[user_id_field], "New Support Chat Message", f"New message in your {tk_type} chat {uuid}")
+
+def iter_request_body(request: Request) -> Iterator[bytes]:
+    """
+    Yields the chunks of the body as they arrive, from a threadpool thread
+    (the blob stores write synchronously), so the body is never buffered
+    """
+    stream = request.stream()
+    async def next_chunk():
+        return await stream.__anext__()
+    while True:
+        try:
+            chunk = anyio.from_thread.run(next_chunk)
+        except StopAsyncIteration:
+            return
+        if chunk:
+            yield chunk
+
+@app.put("/chats/attachments/{uuid}")
+async def upload_chat_attachment(uuid: str, request: Request, tk_type: str, support_agent: bool, filename: str = "attachment", message: str = ""):
+    """
+    Sends a message with the body attached as a file (its type is the Content-Type of the
+    request), the message only stores a reference to the blob.
+    The body is written to the blob store while it is received and cut off at MAX_ATTACHMENT_SIZE.
+    """
+    too_large = HTTPException(status_code=413, detail=f"Attachments can not be larger than {MAX_ATTACHMENT_SIZE} bytes")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_ATTACHMENT_SIZE:
+        raise too_large
+    tk = await run_in_threadpool(get_chat_tk, uuid, tk_type)
+    content_type = request.headers.get("content-type") or "application/octet-stream"
+    try:
+        attachment = await run_in_threadpool(blob_store.save, iter_request_body(request), filename, content_type, MAX_ATTACHMENT_SIZE)
+    except BlobTooLarge:
+        raise too_large
+    try:
+        await run_in_threadpool(send_chat_message, uuid, tk_type, tk, support_agent, message, attachment)
+    except HTTPException:
+        await run_in_threadpool(blob_store.delete, attachment["id"])
+        raise
+    return {"status": "ok", "attachment": attachment}
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """
+    Returns the (start, end) of a single "bytes=" range, None to send the whole blob
+    (no header, or several ranges, which are allowed to be ignored)
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header.removeprefix("bytes=").strip().partition("-")
+    try:
+        if not start:
+            start, end = max(size - int(end), 0), size - 1
+        else:
+            start, end = int(start), min(int(end), size - 1) if end else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+@app.get("/chats/attachments/{blob_id}")
+def download_chat_attachment(blob_id: str, request: Request):
+    blob = blob_store.stat(blob_id)
+    if not blob:
+        raise HTTPException(status_code=404, detail=f"Attachment {blob_id} not found")
+    size = blob["size"]
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(blob['filename'])}"
+    }
+    byte_range = parse_range(request.headers.get("range"), size)
+    if not byte_range:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(blob_store.open_range(blob_id, 0, size - 1), media_type=blob["content_type"], headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(blob_store.open_range(blob_id, start, end), status_code=206, media_type=blob["content_type"], headers=headers)
 
 @app.get("/chats/all/{uuid}")
-def get_chat_messages(uuid: str):
-    messages = chats_manager.get_messages(uuid)
+def get_chat_messages(uuid: str, request: Request, response: Response, limit: Optional[int] = None, before: Optional[int] = None, after: Optional[int] = None):
+    if limit is not None:
+        validate_limit(limit)
+    last_update = chats_manager.get_last_update(uuid)
+    if last_update:
+        # Stored messages never change, a page only changes when a message is stored
+        headers = {
+            "ETag": f'W/"{last_update["last_seq"]}-{limit}-{before}-{after}"',
+            "Last-Modified": to_http_date(last_update["last_message_at"]),
+            "Cache-Control": "no-cache"
+        }
+        if is_not_modified(request, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+    messages = chats_manager.get_messages(uuid, limit=limit, before=before, after=after)
     if not messages:
         messages = []
     return {"status": "ok", "messages": messages}
 
+def sse_event(message: dict) -> str:
+    event_id = f"id: {message['seq']}\n" if message.get("seq") is not None else ""
+    return f"{event_id}event: message\ndata: {json.dumps(message)}\n\n"
+
+@app.get("/chats/stream/{uuid}")
+async def stream_chat_messages(uuid: str, request: Request, after: Optional[int] = None):
+    """
+    Server-Sent Events stream of the new messages of the chat. The messages after `after`
+    (or the Last-Event-ID header on reconnection) are sent first.
+    """
+    last_event_id = request.headers.get("last-event-id", "")
+    if after is None and last_event_id.isdigit():
+        after = int(last_event_id)
+    if not await run_in_threadpool(lambda: help_tks_manager.get(uuid) or reports_manager.get(uuid)):
+        raise HTTPException(status_code=404, detail=f"Chat {uuid} not found")
+
+    async def events():
+        # Subscribed only once the body is sent (a client that leaves before never subscribes),
+        # and before reading the missed messages, so none is lost in between
+        queue = chat_hub.subscribe(uuid)
+        try:
+            last_seq = after
+            if after is not None:
+                missed = await run_in_threadpool(chats_manager.get_messages, uuid, after=after)
+                for message in missed or []:
+                    yield sse_event(message)
+                    last_seq = message["seq"]
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                seq = message.get("seq")
+                if seq is not None and last_seq is not None and seq <= last_seq:
+                    continue
+                yield sse_event(message)
+                last_seq = seq if seq is not None else last_seq
+        finally:
+            chat_hub.unsubscribe(uuid, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/chats/inbox")
+def get_chats_inbox(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, resolved: Optional[bool] = None):
+    chats, next_cursor = chats_manager.list_chats(validate_limit(limit), cursor, resolved)
+    return {"status": "ok", "chats": chats, "next_cursor": next_cursor}
+
+def validate_chat_ids(body: dict) -> list:
+    extra_fields = set(body.keys()) - {"uuids"}
+    if extra_fields:
+        raise HTTPException(status_code=400, detail=f"Extra fields: {', '.join(extra_fields)}")
+    uuids = body.get("uuids", [])
+    if not isinstance(uuids, list):
+        raise HTTPException(status_code=400, detail="uuids must be a list of chat ids")
+    if len(uuids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} chats can be requested at once")
+    return uuids
+
+@app.post("/chats/counts")
+def get_chats_message_counts(body: dict):
+    uuids = validate_chat_ids(body)
+    return {"status": "ok", "counts": chats_manager.count_messages_many(uuids) if uuids else {}}
+
+@app.post("/chats/unread")
+def get_chats_unread(body: dict):
+    uuids = validate_chat_ids(body)
+    return {"status": "ok", "unread": chats_manager.unread_many(uuids) if uuids else {}}
+
+@app.put("/chats/read/{uuid}")
+def mark_chat_read(uuid: str, body: dict):
+    if not all([field in body for field in REQUIRED_MARK_READ_FIELDS]):
+        missing_fields = REQUIRED_MARK_READ_FIELDS - set(body.keys())
+        raise HTTPException(status_code=400, detail=f"Missing fields: {', '.join(missing_fields)}")
+    extra_fields = set(body.keys()) - REQUIRED_MARK_READ_FIELDS
+    if extra_fields:
+        raise HTTPException(status_code=400, detail=f"Extra fields: {', '.join(extra_fields)}")
+    reader = "support" if body["support_agent"] else "user"
+    if not chats_manager.mark_read(uuid, reader):
+        raise HTTPException(status_code=404, detail=f"Chat {uuid} not found")
+    return {"status": "ok"}
+
 @app.get("/tks/unresolved")
-def get_unresolved_tks():
-    help_tks = help_tks_manager.get_not_resolved()
-    report_tks = reports_manager.get_not_resolved()
-    result = []
-    if help_tks:
-        result.extend(help_tks)
-    if report_tks:
-        result.extend(report_tks)
-    if len(result) == 0:
+def get_unresolved_tks(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, type: Optional[str] = None):
+    validate_limit(limit)
+    if type and type not in TK_TYPES:
+        raise HTTPException(status_code=400, detail=f"Invalid type, must be one of {', '.join(TK_TYPES)}")
+    result, next_cursor = tickets_manager.get_unresolved(limit, cursor, type)
+    if len(result) == 0 and not cursor:
         for i in range(10):
             result.append({
                 "uuid": str(i),
@@ -224,8 +457,27 @@ def get_unresolved_tks():
                 "updated_at": random.choice(["2021-01-01", "2021-01-02", "2021-01-03", "2021-01-04", "2021-01-05"]),
                 "type": random.choice(["help_tk", "report_tk"])
             })
-    sorted_result = sorted(result, key=lambda x: x["updated_at"], reverse=True)
-    return {"status": "ok", "tks": sorted_result}
+        result = sorted(result, key=lambda x: x["updated_at"], reverse=True)
+    return {"status": "ok", "tks": result, "next_cursor": next_cursor}
+
+@app.post("/tks/batch")
+def get_tks_batch(body: dict):
+    extra_fields = set(body.keys()) - BATCH_TK_FIELDS
+    if extra_fields:
+        raise HTTPException(status_code=400, detail=f"Extra fields: {', '.join(extra_fields)}")
+    report_ids = body.get("reports", [])
+    help_ids = body.get("help", [])
+    if not all(isinstance(ids, list) for ids in (report_ids, help_ids)):
+        raise HTTPException(status_code=400, detail="reports and help must be lists of ids")
+    if len(report_ids) + len(help_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} tickets can be requested at once")
+    reports = reports_manager.get_many(report_ids) if report_ids else {}
+    help_tks = help_tks_manager.get_many(help_ids) if help_ids else {}
+    return {"status": "ok", "reports": reports, "help": help_tks}
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    return {"status": "ok", "stats": {"help": help_tks_manager.cache.stats(), "reports": reports_manager.cache.stats()}}
 
 @app.put("/strikes/{user_id}")
 def add_strike(user_id: str, body: dict):
@@ -254,6 +506,11 @@ def add_strike(user_id: str, body: dict):
         send_notification(mobile_token_manager, user_id, "Account Suspended", "Your account has been suspended for some time")
     return {"status": "ok", "suspension": result_suspension}
 
+@app.get("/strikes/{user_id}/suspensions")
+def get_suspensions(user_id: str, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
+    suspensions, next_cursor = strikes_manager.get_suspensions(user_id, validate_limit(limit), cursor)
+    return {"status": "ok", "suspensions": suspensions, "next_cursor": next_cursor}
+
 @app.get("/stats/last_month")
 def get_last_month_stats():
     help_stats = help_tks_manager.last_month_stats()
@@ -273,14 +530,11 @@ def get_stats_by_day(from_date: str, to_date: str):
     help_by_day = help_tks_manager.tickets_by_day(from_date, to_date)
     report_by_day = reports_manager.tickets_by_day(from_date, to_date)
     results = {}
-    for date in help_by_day:
-        results[date] = {"new": help_by_day[date]["new"], "resolved": help_by_day[date]["resolved"]}
-    for date in report_by_day:
-        if date in results:
-            results[date]["new"] += report_by_day[date]["new"]
-            results[date]["resolved"] += report_by_day[date]["resolved"]
-        else:
-            results[date] = {"new": report_by_day[date]["new"], "resolved": report_by_day[date]["resolved"]}
+    for by_day in (help_by_day, report_by_day):
+        for date, counts in by_day.items():
+            results.setdefault(date, {"new": 0, "resolved": 0})
+            results[date]["new"] += counts["new"]
+            results[date]["resolved"] += counts["resolved"]
     actual_date = from_date
     while actual_date <= to_date:
         if actual_date not in results:
@@ -0,0 +1,71 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mongomock
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from chats_nosql import Chats
+from lib.utils import get_actual_time
+
+# Compares Chats.insert_message against the previous find + insert_one/update_one path
+# with concurrent writers to the same chat. Not collected by pytest, run with:
+# python SupportService/api_container/tests/bench_chats_nosql.py [--uri mongodb://localhost:27017]
+# Without --uri it runs against mongomock, which only shows the number of round trips.
+
+os.environ.setdefault('MONGO_TEST_DB', 'bench_db')
+
+def previous_insert_message(chats: Chats, message_content: str, message_sender: str, chat_id: str):
+    actual_time = get_actual_time()
+    if not chats.collection.find_one({'uuid': chat_id}):
+        try:
+            chats.collection.insert_one({
+                'uuid': chat_id,
+                'last_seq': 1,
+                'created_at': actual_time,
+                'last_message_at': actual_time,
+                'resolved': False
+            })
+        except DuplicateKeyError:
+            return None
+        chats.messages.insert_one({'chat_uuid': chat_id, 'seq': 1, **chats._message(message_content, message_sender, actual_time)})
+        return chat_id
+    chat = chats.collection.find_one_and_update(
+        {'uuid': chat_id}, {'$inc': {'last_seq': 1}, '$set': {'last_message_at': actual_time}},
+        projection={'last_seq': 1}, return_document=ReturnDocument.AFTER
+    )
+    chats.messages.insert_one({'chat_uuid': chat_id, 'seq': chat['last_seq'], **chats._message(message_content, message_sender, actual_time)})
+    return chat_id
+
+def run(name, insert, chats: Chats, writers: int, chats_count: int, messages: int):
+    chats.collection.delete_many({})
+    chats.messages.delete_many({})
+    jobs = [(f'bench-{i % chats_count}', j) for j in range(messages) for i in range(chats_count)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=writers) as executor:
+        results = list(executor.map(lambda job: insert(f'Message {job[1]}', 'USER', job[0]), jobs))
+    elapsed = time.perf_counter() - start
+    failed = results.count(None)
+    print(f"{name:>10}: {len(jobs)} messages in {elapsed:.2f}s ({len(jobs) / elapsed:.0f} msg/s), {failed} failed")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uri', help="MongoDB to run against, mongomock if not given")
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--chats', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=100, help="messages per chat")
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri) if args.uri else mongomock.MongoClient()
+    chats = Chats(test_client=client)
+    run("previous", lambda *message: previous_insert_message(chats, *message), chats, args.writers, args.chats, args.messages)
+    run("upsert", chats.insert_message, chats, args.writers, args.chats, args.messages)
+    client.drop_database(os.getenv('MONGO_TEST_DB'))
+
+if __name__ == "__main__":
+    main()
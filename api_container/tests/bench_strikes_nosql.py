@@ -0,0 +1,87 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mongomock
+from pymongo import MongoClient
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from strikes_nosql import Strikes, STRIKE_VALUES, MAX_STRIKES, SUSPEND_TIME
+from lib.utils import get_actual_time, get_time_plus_days
+
+# Compares the latency of Strikes.add_strike against the previous get + update_one + get + update_one
+# path with concurrent strikes. Not collected by pytest, run with:
+# python SupportService/api_container/tests/bench_strikes_nosql.py [--uri mongodb://localhost:27017]
+# Without --uri it runs against mongomock, which only shows the number of round trips.
+
+os.environ.setdefault('MONGO_TEST_DB', 'bench_db')
+
+def previous_add_strike(strikes: Strikes, user_id: str, report_tk: str, strike_type: str, strike_reason: str):
+    if not strikes.get(user_id):
+        strikes._create_strikes_profile(user_id)
+        strikes.get(user_id)
+    time_now = get_actual_time()
+    strikes.collection.update_one({'user_id': user_id}, {
+        '$push': {'strikes': {
+            'report_tk': report_tk,
+            'strike_value': STRIKE_VALUES[strike_type],
+            'strike_reason': strike_reason,
+            'ammended': False,
+            'ammended_reason': "",
+            'strike_at': time_now,
+            'updated_at': time_now
+        }},
+        '$set': {'updated_at': time_now}
+    })
+    profile = strikes.get(user_id)
+    if sum(strike['strike_value'] for strike in profile['strikes']) <= MAX_STRIKES:
+        return False
+    strikes.collection.update_one({'user_id': user_id}, {
+        '$push': {'suspensions': {'suspension_at': time_now, 'suspension_strikes': profile['strikes']}},
+        '$set': {'strikes': [], 'updated_at': time_now, 'suspension_ends': get_time_plus_days(SUSPEND_TIME)}
+    })
+    return True
+
+def run(name, add_strike, strikes: Strikes, writers: int, users: int, strikes_per_user: int):
+    strikes.collection.delete_many({})
+    latencies = []
+
+    def timed(job):
+        user, i = job
+        start = time.perf_counter()
+        result = add_strike(f'user-{user}', f'report-{i}', 'LOW', 'Benchmark')
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    jobs = [(user, i) for i in range(strikes_per_user) for user in range(users)]
+    with ThreadPoolExecutor(max_workers=writers) as executor:
+        results = list(executor.map(timed, jobs))
+    # Every user gets floor(strikes / 7) suspensions with LOW (0.5) strikes
+    expected = users * (strikes_per_user // (int(MAX_STRIKES / STRIKE_VALUES['LOW']) + 1))
+    latencies.sort()
+    print(
+        f"{name:>10}: p50 {statistics.median(latencies) * 1000:.2f}ms "
+        f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}ms, "
+        f"{results.count(True)} suspensions (expected {expected})"
+    )
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uri', help="MongoDB to run against, mongomock if not given")
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--strikes', type=int, default=70, help="strikes per user")
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri) if args.uri else mongomock.MongoClient()
+    strikes = Strikes(test_client=client)
+    run("previous", lambda *strike: previous_add_strike(strikes, *strike), strikes, args.writers, args.users, args.strikes)
+    run("atomic", strikes.add_strike, strikes, args.writers, args.users, args.strikes)
+    client.drop_database(os.getenv('MONGO_TEST_DB'))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+import threading
+import pytest
+
+@pytest.fixture
+def atomic_operations(mocker):
+    """
+    MongoDB applies every single document operation atomically, mongomock does not
+    (concurrent threads can interleave inside one update). Serializes them like the server
+    for the collections it is called with.
+    """
+    lock = threading.RLock()
+    def locked(method):
+        def call(*args, **kwargs):
+            with lock:
+                return method(*args, **kwargs)
+        return call
+    def serialize(*collections):
+        for collection in collections:
+            for name in ('find_one', 'find_one_and_update', 'insert_one', 'update_one'):
+                mocker.patch.object(collection, name, side_effect=locked(getattr(collection, name)))
+    return serialize
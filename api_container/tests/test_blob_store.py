@@ -0,0 +1,42 @@
+import pytest
+import mongomock
+import mongomock.gridfs
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+from blob_store import LocalBlobStore, GridFSBlobStore, BlobTooLarge
+
+# Run with the following command:
+# pytest SupportService/api_container/tests/test_blob_store.py
+
+mongomock.gridfs.enable_gridfs_integration()
+
+@pytest.fixture(params=['local', 'gridfs'])
+def store(request, tmp_path):
+    if request.param == 'local':
+        return LocalBlobStore(str(tmp_path))
+    return GridFSBlobStore(mongomock.MongoClient()['test_db'])
+
+def test_save_and_read(store):
+    blob = store.save(iter([b'hello ', b'world']), 'greeting.txt', 'text/plain')
+    assert blob['size'] == 11
+    assert store.stat(blob['id']) == blob
+    assert b''.join(store.open_range(blob['id'], 0, 10)) == b'hello world'
+    assert b''.join(store.open_range(blob['id'], 3, 6)) == b'lo w'
+
+def test_save_too_large_keeps_nothing(store):
+    with pytest.raises(BlobTooLarge):
+        store.save(iter([b'hello ', b'world']), 'greeting.txt', 'text/plain', max_size=8)
+    if isinstance(store, LocalBlobStore):
+        assert os.listdir(store.root) == []
+
+def test_delete(store):
+    blob = store.save(iter([b'hello']), 'greeting.txt', 'text/plain')
+    assert store.delete(blob['id']) is True
+    assert store.stat(blob['id']) is None
+    assert store.delete(blob['id']) is False
+
+def test_stat_unknown_blob(store):
+    assert store.stat('not-a-blob') is None
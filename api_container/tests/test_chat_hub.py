@@ -0,0 +1,91 @@
+import asyncio
+import queue
+import sys
+import os
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+from chat_hub import ChatHub, RedisBroker
+
+# Run with the following command:
+# pytest SupportService/api_container/tests/test_chat_hub.py
+
+class FakePubSub:
+    def __init__(self, events):
+        self.events = events
+
+    def psubscribe(self, pattern):
+        self.pattern = pattern
+
+    def listen(self):
+        while True:
+            yield self.events.get()
+
+class FakeRedis:
+    def __init__(self):
+        self.subscribers = []
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        self.subscribers.append(queue.Queue())
+        return FakePubSub(self.subscribers[-1])
+
+    def publish(self, channel, data):
+        for events in self.subscribers:
+            events.put({'channel': channel.encode(), 'data': data.encode()})
+
+def test_publish_reaches_subscribers_of_the_chat():
+    hub = ChatHub()
+
+    async def run():
+        first = hub.subscribe('chat_1')
+        second = hub.subscribe('chat_1')
+        other = hub.subscribe('chat_2')
+        hub.publish('chat_1', {'seq': 1, 'message': 'Hello'})
+        assert await asyncio.wait_for(first.get(), 1) == {'seq': 1, 'message': 'Hello'}
+        assert await asyncio.wait_for(second.get(), 1) == {'seq': 1, 'message': 'Hello'}
+        assert other.empty()
+        assert hub.subscribers_count() == 3
+        hub.unsubscribe('chat_1', first)
+        hub.unsubscribe('chat_1', second)
+        assert hub.subscribers_count('chat_1') == 0
+
+    asyncio.run(run())
+
+def test_publish_from_another_thread():
+    hub = ChatHub()
+
+    async def run():
+        subscriber = hub.subscribe('chat_1')
+        thread = threading.Thread(target=hub.publish, args=('chat_1', {'seq': 1}))
+        thread.start()
+        assert await asyncio.wait_for(subscriber.get(), 1) == {'seq': 1}
+        thread.join()
+
+    asyncio.run(run())
+
+def test_slow_subscriber_drops_oldest_messages():
+    hub = ChatHub(queue_size=2)
+
+    async def run():
+        subscriber = hub.subscribe('chat_1')
+        for seq in range(1, 4):
+            hub.publish('chat_1', {'seq': seq})
+        await asyncio.sleep(0)
+        assert [subscriber.get_nowait()['seq'] for _ in range(2)] == [2, 3]
+
+    asyncio.run(run())
+
+def test_publish_through_redis_broker():
+    redis = FakeRedis()
+    hub = ChatHub(RedisBroker(client=redis))
+    # Another worker sharing the same redis
+    other_worker = ChatHub(RedisBroker(client=redis))
+
+    async def run():
+        subscriber = hub.subscribe('chat_1')
+        other_worker.publish('chat_1', {'seq': 1, 'message': 'Hello'})
+        assert await asyncio.wait_for(subscriber.get(), 1) == {'seq': 1, 'message': 'Hello'}
+        assert other_worker.subscribers_count() == 0
+
+    asyncio.run(run())
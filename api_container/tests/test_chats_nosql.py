@@ -1,5 +1,7 @@
 import pytest
 import mongomock
+from concurrent.futures import ThreadPoolExecutor
+from pymongo.errors import DuplicateKeyError
 from unittest.mock import patch
 import sys
 import os
@@ -8,6 +10,7 @@ from dotenv import load_dotenv
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
 from chats_nosql import Chats
+from lib.utils import get_actual_time
 
 # Run with the following command:
 # pytest SupportService/api_container/tests/test_chats_nosql.py
@@ -109,3 +112,252 @@ def test_count_messages(chats, mocker):
     )
     count = chats.count_messages(chat_id='chat_1')
     assert count == 1
+
+def test_messages_are_stored_outside_the_chat(chats, mocker):
+    mocker.patch('chats_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    chats.insert_message('First', 'provider_1', 'chat_1')
+    chats.insert_message('Second', 'Support Agent', 'chat_1')
+    chat = chats.collection.find_one({'uuid': 'chat_1'})
+    assert 'messages' not in chat
+    assert chat['last_seq'] == 2
+    stored = list(chats.messages.find({'chat_uuid': 'chat_1'}).sort('seq', 1))
+    assert [message['seq'] for message in stored] == [1, 2]
+    assert [message['message'] for message in stored] == ['First', 'Second']
+
+def test_migrate_messages(chats, mocker):
+    mocker.patch('chats_nosql.get_actual_time', return_value="2023-01-03 00:00:00")
+    chats.collection.insert_one({
+        'uuid': 'chat_1',
+        'messages': [
+            {'sender': 'Support Agent', 'message': 'Second', 'sent_at': "2023-01-02 00:00:00"},
+            {'sender': 'provider_1', 'message': 'First', 'sent_at': "2023-01-01 00:00:00"}
+        ],
+        'created_at': "2023-01-01 00:00:00",
+        'last_message_at': "2023-01-02 00:00:00",
+        'resolved': False
+    })
+    # Old chats keep working before being migrated
+    chats.insert_message('Third', 'provider_1', 'chat_1')
+    assert chats.count_messages('chat_1') == 3
+
+    assert chats.migrate_messages() == 1
+    assert chats.migrate_messages() == 0
+    chat = chats.collection.find_one({'uuid': 'chat_1'})
+    assert 'messages' not in chat
+    assert chat['last_seq'] == 3
+    assert [message['message'] for message in chats.get_messages('chat_1')] == ['First', 'Second', 'Third']
+
+    chats.insert_message('Fourth', 'Support Agent', 'chat_1')
+    assert chats.count_messages('chat_1') == 4
+    assert chats.get_messages('chat_1')[-1]['message'] == 'Fourth'
+
+def test_get_messages_pages(chats, mocker):
+    mocker.patch('chats_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    for i in range(1, 6):
+        chats.insert_message(f'Message {i}', 'provider_1', 'chat_1')
+    newest = chats.get_messages('chat_1', limit=2)
+    assert [message['seq'] for message in newest] == [4, 5]
+    older = chats.get_messages('chat_1', limit=2, before=newest[0]['seq'])
+    assert [message['seq'] for message in older] == [2, 3]
+    newer = chats.get_messages('chat_1', after=3)
+    assert [message['message'] for message in newer] == ['Message 4', 'Message 5']
+    assert chats.get_messages('chat_1', after=5) == []
+    assert chats.get_messages('chat_2', after=5) is None
+
+def test_get_messages_pages_not_migrated_chat(chats):
+    chats.collection.insert_one({
+        'uuid': 'chat_1',
+        'messages': [
+            {'sender': 'provider_1', 'message': f'Message {i}', 'sent_at': f"2023-01-0{i} 00:00:00"}
+            for i in range(1, 6)
+        ]
+    })
+    assert [message['seq'] for message in chats.get_messages('chat_1', limit=2)] == [4, 5]
+    assert [message['seq'] for message in chats.get_messages('chat_1', limit=2, before=4)] == [2, 3]
+    assert [message['seq'] for message in chats.get_messages('chat_1', limit=1, after=1)] == [2]
+
+def test_message_counters(chats, mocker):
+    mocker.patch('chats_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    chats.insert_message('Hello', 'USER', 'chat_1')
+    chats.insert_message('Hi', 'SUPPORT_AGENT', 'chat_1')
+    chats.insert_message('Thanks', 'USER', 'chat_1')
+    chats.insert_message('Hello', 'USER', 'chat_2')
+    chat = chats.collection.find_one({'uuid': 'chat_1'})
+    assert chat['message_count'] == 3
+    assert chat['sender_counts'] == {'USER': 2, 'SUPPORT_AGENT': 1}
+    assert chats.count_messages('chat_1') == 3
+    assert chats.count_messages('chat_3') == 0
+    counts = chats.count_messages_many(['chat_1', 'chat_2', 'chat_3'])
+    assert counts == {
+        'chat_1': {'message_count': 3, 'sender_counts': {'USER': 2, 'SUPPORT_AGENT': 1}},
+        'chat_2': {'message_count': 1, 'sender_counts': {'USER': 1}}
+    }
+
+def test_backfill_message_counts(chats, mocker):
+    mocker.patch('chats_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    chats.insert_message('Hello', 'USER', 'chat_1')
+    chats.insert_message('Hi', 'SUPPORT_AGENT', 'chat_1')
+    chats.collection.update_one({'uuid': 'chat_1'}, {'$unset': {'message_count': '', 'sender_counts': ''}})
+    assert chats.count_messages('chat_1') == 2
+    assert chats.backfill_message_counts() == 1
+    chat = chats.collection.find_one({'uuid': 'chat_1'})
+    assert chat['message_count'] == 2
+    assert chat['sender_counts'] == {'USER': 1, 'SUPPORT_AGENT': 1}
+
+def test_migrate_messages_fills_counters(chats):
+    chats.collection.insert_one({
+        'uuid': 'chat_1',
+        'messages': [
+            {'sender': 'USER', 'message': 'Hello', 'sent_at': "2023-01-01 00:00:00"},
+            {'sender': 'USER', 'message': 'Anyone?', 'sent_at': "2023-01-02 00:00:00"}
+        ]
+    })
+    assert chats.count_messages_many(['chat_1'])['chat_1']['message_count'] == 2
+    chats.migrate_messages()
+    chat = chats.collection.find_one({'uuid': 'chat_1'})
+    assert chat['message_count'] == 2
+    assert chat['sender_counts'] == {'USER': 2}
+
+def test_insert_message_concurrent_first_messages(chats, mocker, atomic_operations):
+    mocker.patch('chats_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    atomic_operations(chats.collection, chats.messages)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(
+            lambda i: chats.insert_message(f'Message {i}', 'USER', 'chat_1'),
+            range(40)
+        ))
+    assert results == ['chat_1'] * 40
+    assert chats.collection.count_documents({'uuid': 'chat_1'}) == 1
+    assert chats.count_messages('chat_1') == 40
+    assert sorted(message['seq'] for message in chats.get_messages('chat_1')) == list(range(1, 41))
+
+def test_insert_message_duplicate_chat_is_retried(chats, mocker):
+    mocker.patch('chats_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    chats.insert_message('First', 'USER', 'chat_1')
+    update = chats.collection.find_one_and_update
+    calls = []
+    def lose_first_race(*args, **kwargs):
+        # The chat did not exist yet, and the upsert loses the race against a concurrent first message
+        calls.append(args)
+        if len(calls) == 1:
+            return None
+        if len(calls) == 2:
+            raise DuplicateKeyError('uuid_1')
+        return update(*args, **kwargs)
+    mocker.patch.object(chats.collection, 'find_one_and_update', side_effect=lose_first_race)
+    assert chats.insert_message('Second', 'USER', 'chat_1') == 'chat_1'
+    assert len(calls) == 3
+    assert [message['seq'] for message in chats.get_messages('chat_1')] == [1, 2]
+
+def test_list_chats(chats, mocker):
+    time = mocker.patch('chats_nosql.get_actual_time')
+    for day, chat_id in enumerate(['chat_1', 'chat_2', 'chat_3', 'chat_4'], start=1):
+        time.return_value = f"2023-01-0{day} 00:00:00"
+        chats.insert_message(f'Hello from {chat_id} ' + 'x' * 200, 'USER', chat_id)
+    time.return_value = "2023-01-05 00:00:00"
+    chats.insert_message('Back again', 'SUPPORT_AGENT', 'chat_1')
+    chats.set_resolved('chat_3', True)
+
+    page, cursor = chats.list_chats(limit=2)
+    assert [chat['uuid'] for chat in page] == ['chat_1', 'chat_4']
+    assert page[0]['last_message'] == {'sender': 'SUPPORT_AGENT', 'message': 'Back again', 'sent_at': "2023-01-05 00:00:00"}
+    assert len(page[1]['last_message']['message']) == 100
+    assert 'messages' not in page[0] and 'sender_counts' not in page[0]
+    page, cursor = chats.list_chats(limit=2, cursor=cursor)
+    assert [chat['uuid'] for chat in page] == ['chat_3', 'chat_2']
+    assert cursor is None
+
+    page, _ = chats.list_chats(limit=10, resolved=False)
+    assert [chat['uuid'] for chat in page] == ['chat_1', 'chat_4', 'chat_2']
+    page, _ = chats.list_chats(limit=10, resolved=True)
+    assert [chat['uuid'] for chat in page] == ['chat_3']
+
+def test_unread_counters(chats, mocker):
+    mocker.patch('chats_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    chats.insert_message('Hello', 'USER', 'chat_1')
+    chats.insert_message('Anyone?', 'USER', 'chat_1')
+    chats.insert_message('Hi', 'SUPPORT_AGENT', 'chat_1')
+    chats.insert_message('Hello', 'USER', 'chat_2')
+    assert chats.unread_many(['chat_1', 'chat_2', 'chat_3']) == {
+        'chat_1': {'user': 1, 'support': 2},
+        'chat_2': {'user': 0, 'support': 1}
+    }
+    assert chats.mark_read('chat_1', 'support') is True
+    assert chats.unread_many(['chat_1'])['chat_1'] == {'user': 1, 'support': 0}
+    assert chats.mark_read('chat_3', 'user') is False
+    with pytest.raises(ValueError):
+        chats.mark_read('chat_1', 'admin')
+
+def test_archive_resolved(chats, mocker):
+    time = mocker.patch('chats_nosql.get_actual_time', return_value="2020-01-01 00:00:00")
+    for i in range(1, 21):
+        chats.insert_message(f'Old message {i} ' + 'lorem ipsum ' * 10, 'USER' if i % 2 else 'SUPPORT_AGENT', 'chat_1')
+    chats.insert_message('Old but not resolved', 'USER', 'chat_2')
+    chats.set_resolved('chat_1', True)
+    time.return_value = get_actual_time()
+    chats.insert_message('Recent', 'USER', 'chat_3')
+    chats.set_resolved('chat_3', True)
+    messages = chats.get_messages('chat_1')
+
+    report = chats.archive_resolved(older_than_days=30)
+    assert report['chats'] == 1
+    assert report['messages'] == 20
+    assert report['bytes_reclaimed'] == report['bytes_before'] - report['bytes_after'] > 0
+    assert chats.collection.find_one({'uuid': 'chat_1'}) is None
+    assert chats.messages.count_documents({'chat_uuid': 'chat_1'}) == 0
+    assert chats.collection.find_one({'uuid': 'chat_2'}) is not None
+    assert chats.collection.find_one({'uuid': 'chat_3'}) is not None
+
+    # Reads fall back to the archive
+    assert chats.get_messages('chat_1') == messages
+    assert chats.get_messages('chat_1', limit=2, before=10) == messages[7:9]
+    assert chats.count_messages('chat_1') == 20
+    assert chats.count_messages_many(['chat_1'])['chat_1']['sender_counts'] == {'USER': 10, 'SUPPORT_AGENT': 10}
+    assert chats.archive_resolved(older_than_days=30)['chats'] == 0
+
+def test_archive_resolved_skips_chats_with_new_messages(chats, mocker):
+    mocker.patch('chats_nosql.get_actual_time', return_value="2020-01-01 00:00:00")
+    chats.insert_message('Old message', 'USER', 'chat_1')
+    chats.set_resolved('chat_1', True)
+    find = chats.messages.find
+    def message_sent_meanwhile(*args, **kwargs):
+        chats.collection.update_one({'uuid': 'chat_1'}, {'$inc': {'last_seq': 1}})
+        return find(*args, **kwargs)
+    mocker.patch.object(chats.messages, 'find', side_effect=message_sent_meanwhile)
+    assert chats.archive_resolved(older_than_days=30)['chats'] == 0
+    assert chats.archive.count_documents({}) == 0
+    assert chats.collection.find_one({'uuid': 'chat_1'}) is not None
+
+def test_message_to_archived_chat_restores_it(chats, mocker):
+    time = mocker.patch('chats_nosql.get_actual_time', return_value="2020-01-01 00:00:00")
+    for message in ['one', 'two', 'three']:
+        chats.insert_message(message, 'USER', 'chat_1')
+    chats.set_resolved('chat_1', True)
+    assert chats.archive_resolved(older_than_days=30)['chats'] == 1
+
+    time.return_value = "2020-06-01 00:00:00"
+    message = chats.send_message('four', 'SUPPORT_AGENT', 'chat_1')
+    assert message['seq'] == 4
+    assert [(message['seq'], message['message']) for message in chats.get_messages('chat_1')] == [(1, 'one'), (2, 'two'), (3, 'three'), (4, 'four')]
+    assert chats.get_messages('chat_1', after=3)[0]['message'] == 'four'
+    assert chats.count_messages('chat_1') == 4
+    assert chats.count_messages_many(['chat_1'])['chat_1']['sender_counts'] == {'USER': 3, 'SUPPORT_AGENT': 1}
+    assert chats.get_last_update('chat_1')['last_seq'] == 4
+    assert chats.archive.count_documents({}) == 0
+
+def test_archive_resolved_keeps_chat_restored_meanwhile(chats, mocker):
+    time = mocker.patch('chats_nosql.get_actual_time', return_value="2020-01-01 00:00:00")
+    chats.insert_message('one', 'USER', 'chat_1')
+    chats.insert_message('two', 'USER', 'chat_1')
+    chats.set_resolved('chat_1', True)
+    delete_one = chats.collection.delete_one
+    def message_sent_after_delete(*args, **kwargs):
+        result = delete_one(*args, **kwargs)
+        time.return_value = "2020-06-01 00:00:00"
+        chats.insert_message('three', 'USER', 'chat_1')
+        return result
+    mocker.patch.object(chats.collection, 'delete_one', side_effect=message_sent_after_delete)
+    assert chats.archive_resolved(older_than_days=30)['chats'] == 0
+    assert [message['message'] for message in chats.get_messages('chat_1')] == ['one', 'two', 'three']
+    assert chats.count_messages('chat_1') == 3
+    assert chats.archive.count_documents({}) == 0
@@ -34,6 +34,7 @@ def clear_database(helptks):
     helptks.create_table()
     session = helptks.Session()
     session.query(helptks.help_tks).delete()
+    session.query(helptks.daily_stats.ticket_daily_stats).delete()
     session.commit()
     session.close()
 
@@ -101,13 +102,92 @@ def test_update_helptk(helptks, mocker):
 
     # Update the helptk
     mocker.patch('helptks_sql.get_actual_time', return_value='2023-01-02 00:00:00')
-    result = helptks.update(helptk_uuid, comment='Test Comment', resolved=True)
-    assert result is True
+    result = helptks.update(helptk_uuid, resolved=True)
+    assert result['resolved'] is True
 
     # Retrieve the updated helptk
     helptk = helptks.get(helptk_uuid)
     assert helptk is not None
-    assert len(helptk['comments']) == 1
-    assert helptk['comments'][0]['comment'] == 'Test Comment'
     assert helptk['resolved'] is True
+    assert helptk['resolved_at'] == '2023-01-02 00:00:00'
+    assert helptk['updated_at'] == '2023-01-02 00:00:00'
+
+
+def test_tickets_by_day(helptks, mocker):
+    mocker.patch('helptks_sql.get_actual_time', return_value='2023-01-01 10:00:00')
+    helptks.insert(
+        title='Test Title 1',
+        description='Test Description 1',
+        requester='test_user'
+    )
+    helptk_uuid = helptks.insert(
+        title='Test Title 2',
+        description='Test Description 2',
+        requester='test_user'
+    )
+    mocker.patch('helptks_sql.get_actual_time', return_value='2023-01-02 10:00:00')
+    helptks.update(helptk_uuid, resolved=True)
+    by_day = helptks.tickets_by_day('2023-01-01', '2023-01-03')
+    assert by_day == {
+        '2023-01-01': {'new': 2, 'resolved': 0},
+        '2023-01-02': {'new': 0, 'resolved': 1}
+    }
+
+def test_resolved_stats_follow_resolved_at(helptks, mocker):
+    time = mocker.patch('helptks_sql.get_actual_time', return_value='2023-01-01 10:00:00')
+    helptk_uuid = helptks.insert(title='Test Title', description='Test Description', requester='test_user')
+    helptks.update(helptk_uuid, resolved=True)
+    time.return_value = '2023-01-02 10:00:00'
+    helptks.update(helptk_uuid, resolved=False)
+    assert helptks.get(helptk_uuid)['resolved_at'] is None
+    time.return_value = '2023-01-03 10:00:00'
+    helptk = helptks.update(helptk_uuid, resolved=True)
+    assert helptk['resolved_at'] == '2023-01-03 10:00:00'
+    time.return_value = '2023-01-05 10:00:00'
+    helptks.set_last_updated(helptk_uuid)
+    # Reopening takes it off the day it was resolved
+    expected = {
+        '2023-01-01': {'new': 1, 'resolved': 0},
+        '2023-01-03': {'new': 0, 'resolved': 1}
+    }
+    assert helptks.tickets_by_day('2023-01-01', '2023-01-05') == expected
+    assert helptks.backfill_daily_stats() is True
+    assert helptks.tickets_by_day('2023-01-01', '2023-01-05') == expected
+
+    assert helptks.delete(helptk_uuid) is True
+    assert helptks.tickets_by_day('2023-01-01', '2023-01-05') == {
+        '2023-01-01': {'new': 0, 'resolved': 0},
+        '2023-01-03': {'new': 0, 'resolved': 0}
+    }
+
+def test_update_returns_ticket(helptks, mocker):
+    mocker.patch('helptks_sql.get_actual_time', return_value='2023-01-01 00:00:00')
+    helptk_uuid = helptks.insert(
+        title='Test Title',
+        description='Test Description',
+        requester='test_user'
+    )
+    mocker.patch('helptks_sql.get_actual_time', return_value='2023-01-02 00:00:00')
+    helptk = helptks.update(helptk_uuid, resolved=True)
+    assert helptk is not None
+    assert helptk['uuid'] == helptk_uuid
+    assert helptk['requester'] == 'test_user'
+    assert helptk['resolved'] is True
+    assert helptk['updated_at'] == '2023-01-02 00:00:00'
+
+def test_update_to_same_state_only_touches_updated_at(helptks, mocker):
+    time = mocker.patch('helptks_sql.get_actual_time', return_value='2023-01-01 00:00:00')
+    helptk_uuid = helptks.insert(title='Test Title', description='Test Description', requester='test_user')
+    helptks.update(helptk_uuid, resolved=True)
+    time.return_value = '2023-01-02 00:00:00'
+    helptk = helptks.update(helptk_uuid, resolved=True)
+    assert set(helptk) == {'uuid', 'title', 'description', 'requester', 'created_at', 'resolved', 'updated_at', 'resolved_at'}
+    assert helptk['resolved_at'] == '2023-01-01 00:00:00'
+    assert helptk['updated_at'] == '2023-01-02 00:00:00'
+    assert helptks.update(helptk_uuid, resolved=False)['resolved_at'] is None
+    assert helptks.update(helptk_uuid, resolved=False)['resolved'] is False
+    assert helptks.tickets_by_day('2023-01-01', '2023-01-02') == {'2023-01-01': {'new': 1, 'resolved': 0}}
 
+def test_update_non_existent_helptk(helptks):
+    assert helptks.update('non_existent_uuid', resolved=True) is None
+    assert helptks.set_last_updated('0b1e7c52-1b9e-4b8e-9a57-3c1c1b0e2f10') is None
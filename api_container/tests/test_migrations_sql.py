@@ -0,0 +1,122 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+import migrations_sql
+from migrations_sql import Migrations, MIGRATIONS
+from reports_sql import Reports
+
+# Run with the following command:
+# pytest SupportService/api_container/tests/test_migrations_sql.py
+
+# Set the TESTING environment variable
+os.environ['TESTING'] = '1'
+
+@pytest.fixture(scope='function')
+def test_engine():
+    engine = create_engine('sqlite:///:memory:', echo=True)
+    yield engine
+    engine.dispose()
+
+def test_upgrade_empty_db(test_engine):
+    migrations = Migrations(engine=test_engine)
+    assert migrations.current_version() == 0
+    assert migrations.upgrade() == MIGRATIONS[-1][0]
+    inspector = inspect(test_engine)
+    assert {'reports', 'help_tks', 'ticket_daily_stats'} <= set(inspector.get_table_names())
+    report_indexes = {index['name'] for index in inspector.get_indexes('reports')}
+    assert {'ix_reports_target', 'ix_reports_unresolved', 'ix_reports_created_at', 'ix_reports_updated_at'} <= report_indexes
+    help_tks_indexes = {index['name'] for index in inspector.get_indexes('help_tks')}
+    assert {'ix_help_tks_requester', 'ix_help_tks_unresolved', 'ix_help_tks_created_at', 'ix_help_tks_updated_at'} <= help_tks_indexes
+
+def test_upgrade_is_idempotent(test_engine):
+    migrations = Migrations(engine=test_engine)
+    version = migrations.upgrade()
+    assert migrations.upgrade() == version
+    with test_engine.connect() as connection:
+        applied = connection.execute(text("SELECT COUNT(*) FROM schema_migrations")).scalar()
+    assert applied == len(MIGRATIONS)
+
+def test_upgrade_to_target(test_engine):
+    migrations = Migrations(engine=test_engine)
+    assert migrations.upgrade(target=1) == 1
+    assert 'ticket_daily_stats' not in inspect(test_engine).get_table_names()
+    assert migrations.upgrade() == MIGRATIONS[-1][0]
+
+def test_upgrade_populated_db(test_engine):
+    # Databases created before the migrations only have the tables
+    with test_engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE help_tks (uuid VARCHAR PRIMARY KEY, title VARCHAR, description VARCHAR, "
+            "requester VARCHAR, created_at VARCHAR, resolved BOOLEAN, updated_at VARCHAR)"
+        ))
+        connection.execute(text(
+            "INSERT INTO help_tks VALUES ('tk_1', 'Title', 'Description', 'test_user', "
+            "'2023-01-01 00:00:00', 0, '2023-01-01 00:00:00')"
+        ))
+    Migrations(engine=test_engine).upgrade()
+    help_tks_indexes = {index['name'] for index in inspect(test_engine).get_indexes('help_tks')}
+    assert 'ix_help_tks_requester' in help_tks_indexes
+    with test_engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM help_tks")).scalar() == 1
+
+def test_native_types_conversion(test_engine):
+    Migrations(engine=test_engine).upgrade(target=3)
+    with test_engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO reports VALUES ('0b1e7c52-1b9e-4b8e-9a57-3c1c1b0e2f10', 'ACCOUNT', 'target_123', "
+            "'Title', 'Description', 'test_user', '2023-01-01 10:00:00', '2023-01-02 11:30:00', 0)"
+        ))
+    Migrations(engine=test_engine).upgrade()
+    reports = Reports(engine=test_engine)
+    assert reports.get('0b1e7c52-1b9e-4b8e-9a57-3c1c1b0e2f10') == {
+        'uuid': '0b1e7c52-1b9e-4b8e-9a57-3c1c1b0e2f10',
+        'type': 'ACCOUNT',
+        'target_identifier': 'target_123',
+        'title': 'Title',
+        'description': 'Description',
+        'complainant': 'test_user',
+        'created_at': '2023-01-01 10:00:00',
+        'updated_at': '2023-01-02 11:30:00',
+        'resolved': False,
+        'resolved_at': None
+    }
+    assert len(reports.get_not_resolved()) == 1
+    report_indexes = {index['name'] for index in inspect(test_engine).get_indexes('reports')}
+    assert 'ix_reports_unresolved' in report_indexes
+
+def test_failed_migration_is_not_applied(test_engine, monkeypatch):
+    Migrations(engine=test_engine).upgrade(target=3)
+    with test_engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO help_tks VALUES ('0b1e7c52-1b9e-4b8e-9a57-3c1c1b0e2f10', 'Title', 'Description', "
+            "'test_user', '2023-01-01 10:00:00', 0, '2023-01-02 11:30:00')"
+        ))
+    def crash_before_recording(connection):
+        migrations_sql._native_tickets_types(connection)
+        raise RuntimeError("crash")
+    crashing = [migration if migration[0] != 4 else (4, migration[1], crash_before_recording) for migration in MIGRATIONS]
+    monkeypatch.setattr(migrations_sql, 'MIGRATIONS', crashing)
+    with pytest.raises(RuntimeError):
+        Migrations(engine=test_engine).upgrade(target=4)
+    assert Migrations(engine=test_engine).current_version() == 3
+    assert 'help_tks_v1' not in inspect(test_engine).get_table_names()
+
+    monkeypatch.setattr(migrations_sql, 'MIGRATIONS', MIGRATIONS)
+    assert Migrations(engine=test_engine).upgrade(target=4) == 4
+    with test_engine.connect() as connection:
+        assert connection.execute(text("SELECT created_at FROM help_tks")).scalar() == '2023-01-01 10:00:00.000000'
+
+def test_resolved_at_from_updated_at(test_engine):
+    Migrations(engine=test_engine).upgrade(target=4)
+    with test_engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO help_tks VALUES ('0b1e7c520b1e7c520b1e7c520b1e7c52', 'Title', 'Description', "
+            "'test_user', '2023-01-01 10:00:00.000000', 1, '2023-01-02 11:30:00.000000')"
+        ))
+    Migrations(engine=test_engine).upgrade()
+    with test_engine.connect() as connection:
+        assert connection.execute(text("SELECT resolved_at FROM help_tks")).scalar() == '2023-01-02 11:30:00.000000'
@@ -34,6 +34,7 @@ def clear_database(reports):
     reports.create_table()
     session = reports.Session()
     session.query(reports.reports).delete()
+    session.query(reports.daily_stats.ticket_daily_stats).delete()
     session.commit()
     session.close()
 
@@ -99,4 +100,99 @@ def test_delete_report(reports, mocker):
     assert result is True
     report = reports.get(report_uuid)
     assert report is None
-    
\ No newline at end of file
+    
+def test_tickets_by_day(reports, mocker):
+    mocker.patch('reports_sql.get_actual_time', return_value='2023-01-01 10:00:00')
+    reports.insert(
+        type='ACCOUNT',
+        target_identifier='target_123',
+        title='Test Title 1',
+        description='Test Description 1',
+        complainant='test_user'
+    )
+    report_uuid = reports.insert(
+        type='ACCOUNT',
+        target_identifier='target_123',
+        title='Test Title 2',
+        description='Test Description 2',
+        complainant='test_user'
+    )
+    mocker.patch('reports_sql.get_actual_time', return_value='2023-01-02 10:00:00')
+    reports.resolve(report_uuid)
+    by_day = reports.tickets_by_day('2023-01-01', '2023-01-03')
+    assert by_day == {
+        '2023-01-01': {'new': 2, 'resolved': 0},
+        '2023-01-02': {'new': 0, 'resolved': 1}
+    }
+
+def test_backfill_daily_stats(reports, mocker):
+    mocker.patch('reports_sql.get_actual_time', return_value='2023-01-01 10:00:00')
+    report_uuid = reports.insert(
+        type='SERVICE',
+        target_identifier='target_123',
+        title='Test Title',
+        description='Test Description',
+        complainant='test_user'
+    )
+    mocker.patch('reports_sql.get_actual_time', return_value='2023-01-02 10:00:00')
+    reports.resolve(report_uuid)
+    reports.resolve(report_uuid)
+    expected = {
+        '2023-01-01': {'new': 1, 'resolved': 0},
+        '2023-01-02': {'new': 0, 'resolved': 1}
+    }
+    assert reports.tickets_by_day('2023-01-01', '2023-01-02') == expected
+    session = reports.Session()
+    session.query(reports.daily_stats.ticket_daily_stats).delete()
+    session.commit()
+    session.close()
+    assert reports.tickets_by_day('2023-01-01', '2023-01-02') == {}
+    assert reports.backfill_daily_stats() is True
+    assert reports.tickets_by_day('2023-01-01', '2023-01-02') == expected
+
+def test_delete_resolved_report_after_chat_message(reports, mocker):
+    time = mocker.patch('reports_sql.get_actual_time', return_value='2023-01-01 10:00:00')
+    report_uuid = reports.insert(
+        type='ACCOUNT',
+        target_identifier='target_123',
+        title='Test Title',
+        description='Test Description',
+        complainant='test_user'
+    )
+    reports.resolve(report_uuid)
+    time.return_value = '2023-01-05 10:00:00'
+    reports.set_last_updated(report_uuid)
+    assert reports.delete(report_uuid) is True
+    assert reports.tickets_by_day('2023-01-01', '2023-01-05') == {'2023-01-01': {'new': 0, 'resolved': 0}}
+
+def test_resolve_returns_report(reports, mocker):
+    mocker.patch('reports_sql.get_actual_time', return_value='2023-01-01 00:00:00')
+    report_uuid = reports.insert(
+        type='ACCOUNT',
+        target_identifier='target_123',
+        title='Test Title',
+        description='Test Description',
+        complainant='test_user'
+    )
+    mocker.patch('reports_sql.get_actual_time', return_value='2023-01-02 00:00:00')
+    report = reports.resolve(report_uuid)
+    assert report['uuid'] == report_uuid
+    assert report['resolved'] is True
+    assert report['updated_at'] == '2023-01-02 00:00:00'
+    assert reports.resolve('non_existent_uuid') is None
+
+def test_get_is_invalidated_by_resolve(reports, mocker):
+    mocker.patch('reports_sql.get_actual_time', return_value='2023-01-01 00:00:00')
+    report_uuid = reports.insert(
+        type='ACCOUNT',
+        target_identifier='target_123',
+        title='Test Title',
+        description='Test Description',
+        complainant='test_user'
+    )
+    assert reports.get(report_uuid)['resolved'] is False
+    hits = reports.cache.stats()['hits']
+    assert reports.get(report_uuid)['resolved'] is False
+    assert reports.cache.stats()['hits'] == hits + 1
+    reports.resolve(report_uuid)
+    assert reports.get(report_uuid)['resolved'] is True
@@ -1,5 +1,6 @@
 import pytest
 import mongomock
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
 import sys
 import os
@@ -42,7 +43,7 @@ def test_get_strikes_profile(strikes, mocker):
     assert profile is not None
     assert profile['user_id'] == 'user_1'
     assert profile['strikes'] == []
-    assert profile['suspensions'] == []
+    assert 'suspensions' not in profile
     assert profile['created_at'] == "2023-01-01 00:00:00"
     assert profile['updated_at'] == "2023-01-01 00:00:00"
 
@@ -59,7 +60,7 @@ def test_add_strike(strikes, mocker):
     strikes_profile = strikes.get('user_1')
     assert strikes_profile is not None
     assert len(strikes_profile['strikes']) == 1
-    assert len(strikes_profile['suspensions']) == 0
+    assert strikes.get_suspensions('user_1', limit=10) == ([], None)
     assert strikes_profile['strikes'][0]['report_tk'] == 'report_1'
     assert strikes_profile['strikes'][0]['strike_value'] == 1.5
     assert strikes_profile['strikes'][0]['strike_reason'] == 'Test strike'
@@ -77,7 +78,7 @@ def test_add_strike_ammend(strikes, mocker):
     strikes_profile = strikes.get('user_1')
     assert strikes_profile is not None
     assert len(strikes_profile['strikes']) == 1
-    assert len(strikes_profile['suspensions']) == 0
+    assert strikes.get_suspensions('user_1', limit=10) == ([], None)
     assert strikes_profile['strikes'][0]['report_tk'] == 'report_1'
     assert strikes_profile['strikes'][0]['strike_value'] == 1.0
     assert strikes_profile['strikes'][0]['strike_reason'] == 'Test strike'
@@ -99,6 +100,149 @@ def test_suspension(strikes, mocker):
     strikes_profile = strikes.get('user_1')
     assert strikes_profile is not None
     assert len(strikes_profile['strikes']) == 0
-    assert len(strikes_profile['suspensions']) == 1
-    strikes = set([strike['report_tk'] for strike in strikes_profile['suspensions'][0]['suspension_strikes']])
-    assert strikes == set(['report_1', 'report_2', 'report_3'])
\ No newline at end of file
+    suspensions, _ = strikes.get_suspensions('user_1', limit=10)
+    assert len(suspensions) == 1
+    strikes = set([strike['report_tk'] for strike in suspensions[0]['suspension_strikes']])
+    assert strikes == set(['report_1', 'report_2', 'report_3'])
+
+
+def test_add_strike_creates_profile(strikes, mocker):
+    mocker.patch('strikes_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    assert strikes.add_strike('user_1', 'report_1', 'MEDIUM', '$100 scam') is False
+    profile = strikes.get('user_1')
+    assert profile['strike_total'] == 1.0
+    assert profile['strikes'][0]['strike_reason'] == '$100 scam'
+    assert profile['created_at'] == "2023-01-01 00:00:00"
+    assert strikes.add_strike('user_1', 'report_2', 'UNKNOWN', 'Test strike') is None
+
+def test_strike_total(strikes, mocker):
+    mocker.patch('strikes_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    strikes.add_strike('user_1', 'report_1', 'HIGH', 'Test strike')
+    strikes.add_strike('user_1', 'report_2', 'LOW', 'Test strike')
+    assert strikes.get('user_1')['strike_total'] == 2.0
+    assert strikes.ammend_strike('user_1', 'report_1', 'Ammended') is True
+    assert strikes.ammend_strike('user_1', 'report_1', 'Ammended twice') is False
+    assert strikes.ammend_strike('user_1', 'report_3', 'Unknown') is False
+    assert strikes.get('user_1')['strike_total'] == 1.5
+
+    suspension = strikes.add_strike('user_1', 'report_3', 'HIGH', 'Test strike')
+    assert suspension is False
+    suspension = strikes.add_strike('user_1', 'report_4', 'LOW', 'Test strike')
+    assert suspension is True
+    profile = strikes.get('user_1')
+    assert profile['strike_total'] == 0
+    assert profile['suspension_ends'] is not None
+
+def test_strike_total_of_old_profiles(strikes, mocker):
+    mocker.patch('strikes_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    strikes.collection.insert_one({
+        'user_id': 'user_1',
+        'strikes': [
+            {'report_tk': 'report_1', 'strike_value': 1.5, 'ammended': False},
+            {'report_tk': 'report_2', 'strike_value': 1.0, 'ammended': False}
+        ],
+        'suspension_ends': None
+    })
+    assert strikes.ammend_strike('user_1', 'report_1', 'Ammended') is True
+    assert strikes.get('user_1')['strike_total'] == 2.0
+    assert strikes.add_strike('user_1', 'report_3', 'MEDIUM', 'Test strike') is False
+    assert strikes.add_strike('user_1', 'report_4', 'LOW', 'Test strike') is True
+
+def test_concurrent_strikes_suspend_once(strikes, mocker, atomic_operations):
+    mocker.patch('strikes_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    atomic_operations(strikes.collection)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(
+            lambda i: strikes.add_strike('user_1', f'report_{i}', 'LOW', 'Test strike'),
+            range(8)
+        ))
+    # The 7th strike (3.5) suspends, the 8th starts counting again
+    assert results.count(True) == 1
+    assert results.count(None) == 0
+    profile = strikes.get('user_1')
+    suspensions, _ = strikes.get_suspensions('user_1', limit=10)
+    assert len(suspensions) == 1
+    assert len(suspensions[0]['suspension_strikes']) == 7
+    assert profile['strike_total'] == 0.5
+    assert len(profile['strikes']) == 1
+
+def test_suspension_history_failure_keeps_suspension(strikes, mocker):
+    mocker.patch('strikes_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    for report in range(2):
+        strikes.add_strike('user_1', f'report_{report}', 'HIGH', 'Test strike')
+    mocker.patch.object(strikes.suspensions, 'update_one', side_effect=Exception("Write failed"))
+    assert strikes.add_strike('user_1', 'report_2', 'LOW', 'Test strike') is True
+    assert strikes.check_suspension('user_1') is not None
+    assert strikes.get_suspensions('user_1', limit=10) == ([], None)
+
+def test_suspension_history_is_written_once(strikes, mocker):
+    mocker.patch('strikes_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    for report in range(6):
+        strikes.add_strike('user_1', f'report_{report}', 'HIGH', 'Test strike')
+    # Both suspensions happened at the same time, the second one is not recorded twice
+    suspensions, _ = strikes.get_suspensions('user_1', limit=10)
+    assert len(suspensions) == 1
+    assert strikes.suspensions.index_information()['user_id_1_suspension_at_1']['unique'] is True
+
+def test_strikes_indexes(strikes, mocker):
+    mocker.patch('strikes_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    indexes = strikes.collection.index_information()
+    assert indexes['user_id_1']['unique'] is True
+    assert 'suspension_ends_1' in indexes
+    assert 'updated_at_1' in indexes
+    assert 'uuid_1' not in indexes
+    # Profiles without uuid no longer collide
+    assert strikes._create_strikes_profile('user_1') is True
+    assert strikes._create_strikes_profile('user_2') is True
+    assert strikes._create_strikes_profile('user_1') is False
+    assert strikes.check_indexes() == {'missing': [], 'unused': [], 'unexpected': []}
+
+def test_legacy_uuid_index_is_dropped(mongo_client):
+    collection = mongo_client[os.getenv('MONGO_TEST_DB')]['strikes']
+    collection.create_index([('uuid', 1)], unique=True)
+    strikes = Strikes(test_client=mongo_client)
+    assert 'uuid_1' not in strikes.collection.index_information()
+    strikes.collection.drop_index('suspension_ends_1')
+    strikes.collection.create_index([('strikes.report_tk', 1)])
+    assert strikes.check_indexes() == {'missing': ['suspension_ends_1'], 'unused': [], 'unexpected': ['strikes.report_tk_1']}
+
+def test_suspensions_history(strikes, mocker):
+    time = mocker.patch('strikes_nosql.get_actual_time')
+    for day in range(1, 4):
+        time.return_value = f"2023-01-0{day} 00:00:00"
+        for report in range(3):
+            strikes.add_strike('user_1', f'report_{day}_{report}', 'HIGH', 'Test strike')
+    profile = strikes.get('user_1')
+    assert 'suspensions' not in profile
+    assert strikes.check_suspension('user_1') == profile['suspension_ends']
+    assert strikes.check_suspension('user_2') is None
+
+    page, cursor = strikes.get_suspensions('user_1', limit=2)
+    assert [suspension['suspension_at'] for suspension in page] == ["2023-01-03 00:00:00", "2023-01-02 00:00:00"]
+    assert page[0]['suspension_ends'] == profile['suspension_ends']
+    page, cursor = strikes.get_suspensions('user_1', limit=2, cursor=cursor)
+    assert [suspension['suspension_at'] for suspension in page] == ["2023-01-01 00:00:00"]
+    assert cursor is None
+
+def test_suspension_ended(strikes, mocker):
+    mocker.patch('strikes_nosql.get_actual_time', return_value="2023-01-01 00:00:00")
+    strikes.collection.insert_one({'user_id': 'user_1', 'strikes': [], 'strike_total': 0, 'suspension_ends': "2022-12-31 00:00:00"})
+    assert strikes.check_suspension('user_1') is None
+
+def test_migrate_suspensions(strikes, mocker):
+    strikes.collection.insert_one({
+        'user_id': 'user_1',
+        'strikes': [],
+        'suspensions': [
+            {'suspension_at': "2023-01-01 00:00:00", 'suspension_strikes': [{'report_tk': 'report_1', 'strike_value': 1.5}]},
+            {'suspension_at': "2023-06-01 00:00:00", 'suspension_strikes': [{'report_tk': 'report_2', 'strike_value': 1.5}]}
+        ],
+        'suspension_ends': "2023-08-30 00:00:00"
+    })
+    assert strikes.migrate_suspensions() == 1
+    assert strikes.migrate_suspensions() == 0
+    assert 'suspensions' not in strikes.get('user_1')
+    suspensions, _ = strikes.get_suspensions('user_1', limit=10)
+    assert [suspension['suspension_at'] for suspension in suspensions] == ["2023-06-01 00:00:00", "2023-01-01 00:00:00"]
+    assert suspensions[0]['suspension_ends'] == "2023-08-30 00:00:00"
+    assert suspensions[1]['suspension_strikes'][0]['report_tk'] == 'report_1'
@@ -1,4 +1,6 @@
+import asyncio
 import pytest
+from fastapi import Request
 from fastapi.testclient import TestClient
 import os
 import sys
@@ -15,6 +17,7 @@ os.environ['DATABASE_URL'] = 'sqlite:///test.db'
 # Add the necessary paths to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+import support_api
 from support_api import app, reports_manager, help_tks_manager
 
 client = TestClient(app)
@@ -25,6 +28,7 @@ def clear_database():
     session = reports_manager.Session()
     session.query(reports_manager.reports).delete()
     session.query(help_tks_manager.help_tks).delete()
+    session.query(reports_manager.daily_stats.ticket_daily_stats).delete()
     session.commit()
     session.close()
 
@@ -162,4 +166,379 @@ def test_update_help_tk_error():
         "resolved": True
     })
     assert response.status_code == 400
-    assert "Error while updating the report" in response.json()["detail"]
\ No newline at end of file
+    assert "Error while updating the report" in response.json()["detail"]
+
+
+def test_get_last_month_stats():
+    client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    })
+    response = client.get("/stats/last_month")
+    assert response.status_code == 200
+    stats = response.json()["stats"]
+    assert set(stats.keys()) == {"help", "reports"}
+    assert set(stats["help"].keys()) == {"new_this_month", "perc_diff_new", "resolved_this_month", "perc_diff_resolved"}
+
+def test_get_unresolved_tks_pages():
+    for i in range(3):
+        client.put("/help/new/test_user", json={
+            "title": f"Help Title {i}",
+            "description": "Help Description"
+        })
+    client.put("/accounts/test_user", json={
+        "title": "Test Title",
+        "description": "Test Description",
+        "complainant": "test_user"
+    })
+    response = client.get("/tks/unresolved", params={"limit": 3})
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page["tks"]) == 3
+    assert first_page["next_cursor"] is not None
+    response = client.get("/tks/unresolved", params={"limit": 3, "cursor": first_page["next_cursor"]})
+    second_page = response.json()
+    assert len(second_page["tks"]) == 1
+    assert second_page["next_cursor"] is None
+    tks = first_page["tks"] + second_page["tks"]
+    assert len({tk["uuid"] for tk in tks}) == 4
+    assert [tk["updated_at"] for tk in tks] == sorted([tk["updated_at"] for tk in tks], reverse=True)
+
+def test_get_unresolved_tks_by_type():
+    client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    })
+    client.put("/accounts/test_user", json={
+        "title": "Test Title",
+        "description": "Test Description",
+        "complainant": "test_user"
+    })
+    response = client.get("/tks/unresolved", params={"type": "report_tk"})
+    assert response.status_code == 200
+    assert [tk["type"] for tk in response.json()["tks"]] == ["report_tk"]
+
+def test_get_unresolved_tks_invalid_cursor():
+    response = client.get("/tks/unresolved", params={"cursor": "not_a_cursor"})
+    assert response.status_code == 400
+
+def test_get_help_tks_pages():
+    for i in range(3):
+        client.put("/help/new/test_user", json={
+            "title": f"Help Title {i}",
+            "description": "Help Description"
+        })
+    response = client.get("/help/list/test_user", params={"limit": 2, "summary": True})
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page) == 2
+    assert set(first_page[0].keys()) == {"uuid", "title", "resolved", "updated_at"}
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get("/help/list/test_user", params={"limit": 2, "cursor": cursor})
+    assert response.status_code == 200
+    second_page = response.json()
+    assert len(second_page) == 1
+    assert "description" in second_page[0]
+    assert "X-Next-Cursor" not in response.headers
+    assert len({tk["uuid"] for tk in first_page + second_page}) == 3
+
+def test_get_account_reports_summary():
+    client.put("/accounts/test_user", json={
+        "title": "Test Title",
+        "description": "Test Description",
+        "complainant": "test_user"
+    })
+    response = client.get("/accounts/test_user", params={"summary": True})
+    assert response.status_code == 200
+    assert response.json()[0]["title"] == "Test Title"
+    assert "description" not in response.json()[0]
+
+def test_update_support_chat():
+    create_response = client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    })
+    report_id = create_response.json()["report_id"]
+    response = client.put(f"/chats/newmsg/{report_id}", json={
+        "message": "Hello",
+        "tk_type": "HELP",
+        "support_agent": True
+    })
+    assert response.status_code == 200
+    messages = client.get(f"/chats/all/{report_id}").json()["messages"]
+    assert [message["message"] for message in messages] == ["Hello"]
+
+def test_get_chat_messages_pages():
+    report_id = client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    }).json()["report_id"]
+    for text in ("one", "two", "three"):
+        client.put(f"/chats/newmsg/{report_id}", json={"message": text, "tk_type": "HELP", "support_agent": False})
+    newest = client.get(f"/chats/all/{report_id}", params={"limit": 2}).json()["messages"]
+    assert [message["message"] for message in newest] == ["two", "three"]
+    older = client.get(f"/chats/all/{report_id}", params={"limit": 2, "before": newest[0]["seq"]}).json()["messages"]
+    assert [message["message"] for message in older] == ["one"]
+    newer = client.get(f"/chats/all/{report_id}", params={"after": newest[-1]["seq"]}).json()["messages"]
+    assert newer == []
+    assert client.get(f"/chats/all/{report_id}", params={"limit": 0}).status_code == 400
+
+def test_get_chat_messages_conditional():
+    report_id = client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    }).json()["report_id"]
+    client.put(f"/chats/newmsg/{report_id}", json={"message": "Hello", "tk_type": "HELP", "support_agent": False})
+    response = client.get(f"/chats/all/{report_id}")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    last_modified = response.headers["Last-Modified"]
+
+    response = client.get(f"/chats/all/{report_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    # A message sent in the same second has the same Last-Modified
+    assert client.get(f"/chats/all/{report_id}", headers={"If-Modified-Since": last_modified}).status_code == 200
+    # Other pages have their own tag
+    assert client.get(f"/chats/all/{report_id}", params={"limit": 1}, headers={"If-None-Match": etag}).status_code == 200
+
+    client.put(f"/chats/newmsg/{report_id}", json={"message": "Hi", "tk_type": "HELP", "support_agent": False})
+    response = client.get(f"/chats/all/{report_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json()["messages"]) == 2
+    assert response.headers["ETag"] != etag
+
+def test_get_chat_messages_etag_while_message_is_stored():
+    report_id = client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    }).json()["report_id"]
+    client.put(f"/chats/newmsg/{report_id}", json={"message": "Hello", "tk_type": "HELP", "support_agent": False})
+    # A poll between the chat update and the message insert
+    chats_manager = support_api.chats_manager
+    chats_manager.collection.update_one({"uuid": report_id}, {"$inc": {"last_seq": 1}})
+    response = client.get(f"/chats/all/{report_id}")
+    assert [message["seq"] for message in response.json()["messages"]] == [1]
+    etag = response.headers["ETag"]
+    chats_manager.messages.insert_one({"chat_uuid": report_id, "seq": 2, "sender": "USER", "message": "Hi", "sent_at": "2023-01-01 00:00:00"})
+    response = client.get(f"/chats/all/{report_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [message["seq"] for message in response.json()["messages"]] == [1, 2]
+
+def test_stream_chat_messages():
+    help_id = client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    }).json()["report_id"]
+    assert client.get("/chats/stream/0b1e7c52-1b9e-4b8e-9a57-3c1c1b0e2f10").status_code == 404
+
+    async def connected():
+        return {"type": "http.request", "body": b"", "more_body": True}
+    request = Request({"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b""}, connected)
+    async def stream():
+        response = await support_api.stream_chat_messages(help_id, request)
+        # A client that leaves before the body is sent never subscribes
+        subscribed_before_body = support_api.chat_hub.subscribers_count(help_id)
+        events = response.body_iterator
+        next_event = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0.1)
+        subscribed = support_api.chat_hub.subscribers_count(help_id)
+        support_api.chat_hub.publish(help_id, {"seq": 1, "message": "Hello"})
+        event = await asyncio.wait_for(next_event, 1)
+        await events.aclose()
+        return subscribed_before_body, subscribed, event
+    subscribed_before_body, subscribed, event = asyncio.run(stream())
+    assert (subscribed_before_body, subscribed) == (0, 1)
+    assert event.startswith("id: 1\nevent: message\n")
+    assert support_api.chat_hub.subscribers_count(help_id) == 0
+
+def test_get_chats_inbox():
+    help_id = client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    }).json()["report_id"]
+    client.put(f"/chats/newmsg/{help_id}", json={"message": "Hello", "tk_type": "HELP", "support_agent": False})
+    response = client.get("/chats/inbox", params={"resolved": False})
+    assert response.status_code == 200
+    assert help_id in [chat["uuid"] for chat in response.json()["chats"]]
+
+    client.put(f"/help/{help_id}", json={"resolved": True, "comment": "Done"})
+    unresolved = client.get("/chats/inbox", params={"resolved": False}).json()["chats"]
+    assert help_id not in [chat["uuid"] for chat in unresolved]
+    resolved = client.get("/chats/inbox", params={"resolved": True}).json()["chats"]
+    assert resolved[0]["uuid"] == help_id
+    assert resolved[0]["last_message"]["message"] == "Hello"
+    assert client.get("/chats/inbox", params={"cursor": "invalid"}).status_code == 400
+
+def test_chat_resolved_follows_ticket():
+    help_id = client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    }).json()["report_id"]
+    client.put(f"/help/{help_id}", json={"resolved": True, "comment": "Done"})
+    # The first message comes after the ticket was resolved
+    client.put(f"/chats/newmsg/{help_id}", json={"message": "Thanks", "tk_type": "HELP", "support_agent": False})
+    resolved = client.get("/chats/inbox", params={"resolved": True}).json()["chats"]
+    assert help_id in [chat["uuid"] for chat in resolved]
+
+    report_id = client.put("/accounts/test_user", json={
+        "title": "Test Title",
+        "description": "Test Description",
+        "complainant": "test_user"
+    }).json()["report_id"]
+    client.put(f"/chats/newmsg/{report_id}", json={"message": "Hello", "tk_type": "REPORT", "support_agent": False})
+    assert report_id in [chat["uuid"] for chat in client.get("/chats/inbox", params={"resolved": False}).json()["chats"]]
+    assert client.put(f"/report/{report_id}/resolve").status_code == 200
+    assert client.get(f"/report/{report_id}").json()["resolved"] is True
+    resolved = client.get("/chats/inbox", params={"resolved": True}).json()["chats"]
+    assert report_id in [chat["uuid"] for chat in resolved]
+    assert client.put("/report/0b1e7c52-1b9e-4b8e-9a57-3c1c1b0e2f10/resolve").status_code == 404
+
+def test_chat_unread_counters():
+    help_id = client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    }).json()["report_id"]
+    client.put(f"/chats/newmsg/{help_id}", json={"message": "Hello", "tk_type": "HELP", "support_agent": False})
+    client.put(f"/chats/newmsg/{help_id}", json={"message": "Hi", "tk_type": "HELP", "support_agent": True})
+    response = client.post("/chats/unread", json={"uuids": [help_id]})
+    assert response.status_code == 200
+    assert response.json()["unread"] == {help_id: {"user": 1, "support": 1}}
+
+    assert client.put(f"/chats/read/{help_id}", json={"support_agent": False}).status_code == 200
+    assert client.post("/chats/unread", json={"uuids": [help_id]}).json()["unread"][help_id] == {"user": 0, "support": 1}
+    assert client.put("/chats/read/non_existent_uuid", json={"support_agent": True}).status_code == 404
+    assert client.put(f"/chats/read/{help_id}", json={}).status_code == 400
+
+def test_chat_attachments():
+    help_id = client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    }).json()["report_id"]
+    content = bytes(range(256)) * 4
+    response = client.put(
+        f"/chats/attachments/{help_id}",
+        params={"tk_type": "HELP", "support_agent": False, "filename": "screenshot.png", "message": "See the screenshot"},
+        headers={"Content-Type": "image/png"},
+        content=iter([content[:100], content[100:]])
+    )
+    assert response.status_code == 200
+    attachment = response.json()["attachment"]
+    assert attachment["size"] == len(content)
+
+    message = client.get(f"/chats/all/{help_id}").json()["messages"][-1]
+    assert message["message"] == "See the screenshot"
+    assert message["attachment"] == attachment
+
+    response = client.get(f"/chats/attachments/{attachment['id']}")
+    assert response.status_code == 200
+    assert response.content == content
+    assert response.headers["content-type"] == "image/png"
+    response = client.get(f"/chats/attachments/{attachment['id']}", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == content[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(content)}"
+    response = client.get(f"/chats/attachments/{attachment['id']}", headers={"Range": "bytes=-5"})
+    assert response.content == content[-5:]
+    response = client.get(f"/chats/attachments/{attachment['id']}", headers={"Range": f"bytes={len(content)}-"})
+    assert response.status_code == 416
+    assert client.get("/chats/attachments/non_existent_id").status_code == 404
+
+def test_chat_attachment_errors(monkeypatch):
+    help_id = client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    }).json()["report_id"]
+    params = {"tk_type": "HELP", "support_agent": False}
+    response = client.put("/chats/attachments/non_existent_uuid", params=params, content=b"x" * 100)
+    assert response.status_code == 404
+    monkeypatch.setattr(support_api, "MAX_ATTACHMENT_SIZE", 10)
+    # Rejected from its Content-Length, before anything is stored
+    def not_stored(*args):
+        raise AssertionError("The blob was stored")
+    with monkeypatch.context() as patched:
+        patched.setattr(support_api.blob_store, "save", not_stored)
+        assert client.put(f"/chats/attachments/{help_id}", params=params, content=b"x" * 100).status_code == 413
+    # Without Content-Length it is cut off while it is read
+    response = client.put(f"/chats/attachments/{help_id}", params=params, content=iter([b"x" * 8, b"x" * 8]))
+    assert response.status_code == 413
+    assert client.get(f"/chats/all/{help_id}").json()["messages"] == []
+
+def test_get_chats_message_counts():
+    report_id = client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    }).json()["report_id"]
+    client.put(f"/chats/newmsg/{report_id}", json={"message": "Hello", "tk_type": "HELP", "support_agent": False})
+    client.put(f"/chats/newmsg/{report_id}", json={"message": "Hi", "tk_type": "HELP", "support_agent": True})
+    response = client.post("/chats/counts", json={"uuids": [report_id, "non_existent_uuid"]})
+    assert response.status_code == 200
+    assert response.json()["counts"] == {
+        report_id: {"message_count": 2, "sender_counts": {"USER": 1, "SUPPORT_AGENT": 1}}
+    }
+    assert client.post("/chats/counts", json={"uuids": "not a list"}).status_code == 400
+
+def test_chat_message_touches_ticket_once_stored(monkeypatch):
+    help_id = client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    }).json()["report_id"]
+    touched = []
+    monkeypatch.setattr(support_api.help_tks_manager, "set_last_updated", touched.append)
+    with monkeypatch.context() as patched:
+        patched.setattr(support_api.chats_manager, "send_message", lambda *args, **kwargs: None)
+        response = client.put(f"/chats/newmsg/{help_id}", json={"message": "Hello", "tk_type": "HELP", "support_agent": False})
+        assert response.status_code == 400
+    monkeypatch.setattr(support_api, "MAX_ATTACHMENT_SIZE", 10)
+    response = client.put(f"/chats/attachments/{help_id}", params={"tk_type": "HELP", "support_agent": False}, content=b"x" * 100)
+    assert response.status_code == 413
+    assert touched == []
+    response = client.put(f"/chats/newmsg/{help_id}", json={"message": "Hello", "tk_type": "HELP", "support_agent": False})
+    assert response.status_code == 200
+    assert touched == [help_id]
+
+def test_update_support_chat_not_found():
+    response = client.put("/chats/newmsg/non_existent_uuid", json={
+        "message": "Hello",
+        "tk_type": "REPORT",
+        "support_agent": False
+    })
+    assert response.status_code == 404
+
+def test_get_tks_batch():
+    help_id = client.put("/help/new/test_user", json={
+        "title": "Help Title",
+        "description": "Help Description"
+    }).json()["report_id"]
+    report_id = client.put("/accounts/test_user", json={
+        "title": "Test Title",
+        "description": "Test Description",
+        "complainant": "test_user"
+    }).json()["report_id"]
+    response = client.post("/tks/batch", json={
+        "reports": [report_id, "non_existent_uuid"],
+        "help": [help_id]
+    })
+    assert response.status_code == 200
+    assert list(response.json()["reports"].keys()) == [report_id]
+    assert response.json()["reports"][report_id]["title"] == "Test Title"
+    assert response.json()["help"][help_id]["title"] == "Help Title"
+
+def test_get_tks_batch_too_many():
+    response = client.post("/tks/batch", json={"reports": [str(i) for i in range(101)]})
+    assert response.status_code == 400
+
+def test_get_suspensions():
+    support_api.strikes_manager.suspensions.delete_many({})
+    support_api.strikes_manager.suspensions.insert_many([
+        {"user_id": "test_user", "suspension_at": f"2023-0{month}-01 00:00:00", "suspension_ends": f"2023-0{month + 3}-01 00:00:00", "suspension_strikes": []}
+        for month in range(1, 4)
+    ])
+    response = client.get("/strikes/test_user/suspensions", params={"limit": 2})
+    assert response.status_code == 200
+    assert [suspension["suspension_at"] for suspension in response.json()["suspensions"]] == ["2023-03-01 00:00:00", "2023-02-01 00:00:00"]
+    response = client.get("/strikes/test_user/suspensions", params={"limit": 2, "cursor": response.json()["next_cursor"]})
+    assert [suspension["suspension_at"] for suspension in response.json()["suspensions"]] == ["2023-01-01 00:00:00"]
+    assert response.json()["next_cursor"] is None
+    assert client.get("/strikes/other_user/suspensions").json()["suspensions"] == []
+    assert client.get("/strikes/test_user/suspensions", params={"cursor": "invalid"}).status_code == 400
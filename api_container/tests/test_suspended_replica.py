@@ -0,0 +1,131 @@
+import pytest
+import datetime
+import json
+import os
+import sys
+import types
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'export_lib', 'lib')))
+from suspended_replica import SuspendedReplica, SYNC_OVERLAP
+
+# Run with the following command:
+# pytest SupportService/api_container/tests/test_suspended_replica.py
+
+NOW = datetime.datetime(2030, 1, 1, 12, 0, 0)
+
+def later(**delta) -> str:
+    return (NOW + datetime.timedelta(**delta)).strftime('%Y-%m-%d %H:%M:%S')
+
+class FakeStrikes:
+    """
+    Profiles are { <user_id>: { 'suspension_ends': ..., 'updated_at': ... } }.
+    """
+    def __init__(self):
+        self.profiles = {}
+        self.calls = []
+
+    def suspend(self, user_id, suspension_ends, updated_at):
+        self.profiles[user_id] = {'suspension_ends': suspension_ends, 'updated_at': updated_at}
+
+    def get_suspended_changes(self, updated_since=None):
+        self.calls.append(updated_since)
+        if updated_since:
+            profiles = {user_id: profile for user_id, profile in self.profiles.items() if profile['updated_at'] >= updated_since}
+        else:
+            profiles = {user_id: profile for user_id, profile in self.profiles.items() if (profile['suspension_ends'] or '') > later()}
+        return [{'user_id': user_id, 'suspension_ends': profile['suspension_ends']} for user_id, profile in profiles.items()]
+
+@pytest.fixture
+def clock(mocker):
+    clock = types.SimpleNamespace(now=NOW)
+    class FakeDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return clock.now
+    mocker.patch('suspended_replica.datetime', types.SimpleNamespace(datetime=FakeDatetime, timedelta=datetime.timedelta))
+    return clock
+
+@pytest.fixture
+def strikes():
+    strikes = FakeStrikes()
+    strikes.suspend('user_1', later(days=1), later(days=-1))
+    strikes.suspend('user_2', later(days=2), later(days=-1))
+    strikes.suspend('user_3', later(days=-1), later(days=-2))
+    return strikes
+
+def test_first_sync_reads_every_suspended_user(clock, strikes):
+    replica = SuspendedReplica(strikes)
+    assert replica.staleness() is None
+    assert replica.sync() == 2
+    assert strikes.calls == [None]
+    assert replica.users() == {'user_1', 'user_2'}
+    assert replica.suspension_ends('user_1') == later(days=1)
+    assert replica.is_suspended('user_3') is False
+    assert replica.staleness() is not None
+
+def test_sync_since_previous_sync_with_overlap(clock, strikes):
+    replica = SuspendedReplica(strikes)
+    replica.sync()
+    assert replica.synced_since == later(seconds=-SYNC_OVERLAP)
+    clock.now = NOW + datetime.timedelta(seconds=30)
+    # Written while the previous sync was running, it is read again thanks to the overlap
+    strikes.suspend('user_4', later(days=1), later(seconds=-10))
+    assert replica.sync() == 1
+    assert strikes.calls == [None, later(seconds=-SYNC_OVERLAP)]
+    assert replica.users() == {'user_1', 'user_2', 'user_4'}
+
+def test_sync_removes_lifted_suspensions(clock, strikes):
+    replica = SuspendedReplica(strikes)
+    replica.sync()
+    strikes.suspend('user_1', later(seconds=-1), later())
+    strikes.suspend('user_2', None, later())
+    replica.sync()
+    assert replica.users() == set()
+    assert replica.suspended == {}
+
+def test_sync_updates_suspension_ends(clock, strikes):
+    replica = SuspendedReplica(strikes)
+    replica.sync()
+    strikes.suspend('user_1', later(days=5), later())
+    replica.sync()
+    assert replica.suspension_ends('user_1') == later(days=5)
+
+def test_suspension_ends_without_sync(clock, strikes):
+    replica = SuspendedReplica(strikes)
+    replica.sync()
+    clock.now = NOW + datetime.timedelta(days=1)
+    assert replica.is_suspended('user_1') is False
+    assert replica.is_suspended('user_2') is True
+    assert replica.users() == {'user_2'}
+    assert strikes.calls == [None]
+
+def test_snapshot_is_saved_on_sync(clock, strikes, tmp_path):
+    snapshot_path = str(tmp_path / 'suspended.json')
+    replica = SuspendedReplica(strikes, snapshot_path=snapshot_path)
+    replica.sync()
+    with open(snapshot_path) as file:
+        assert json.load(file) == {
+            'synced_since': later(seconds=-SYNC_OVERLAP),
+            'suspended': {'user_1': later(days=1), 'user_2': later(days=2)}
+        }
+    assert not os.path.exists(f"{snapshot_path}.part")
+
+def test_restart_loads_snapshot_and_syncs_the_changes(clock, strikes, tmp_path):
+    snapshot_path = str(tmp_path / 'suspended.json')
+    SuspendedReplica(strikes, snapshot_path=snapshot_path).sync()
+    clock.now = NOW + datetime.timedelta(minutes=10)
+    strikes.suspend('user_1', None, later(minutes=5))
+    strikes.suspend('user_4', later(days=1), later(minutes=5))
+    replica = SuspendedReplica(strikes, snapshot_path=snapshot_path)
+    assert replica._load_snapshot() is True
+    assert strikes.calls == [None, later(seconds=-SYNC_OVERLAP)]
+    assert replica.users() == {'user_2', 'user_4'}
+
+def test_corrupt_snapshot_falls_back_to_full_sync(clock, strikes, tmp_path):
+    snapshot_path = tmp_path / 'suspended.json'
+    snapshot_path.write_text('{"suspended": ')
+    replica = SuspendedReplica(strikes, refresh_interval=3600, snapshot_path=str(snapshot_path))
+    replica.start()
+    replica.stop()
+    assert strikes.calls == [None]
+    assert replica.users() == {'user_1', 'user_2'}
@@ -0,0 +1,108 @@
+import pytest
+import datetime
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'export_lib', 'lib')))
+from suspension_cache import SuspensionCache
+
+# Run with the following command:
+# pytest SupportService/api_container/tests/test_suspension_cache.py
+
+SUSPENSION_ENDS = '2030-01-01 00:00:00'
+ENDS_AT = datetime.datetime.strptime(SUSPENSION_ENDS, '%Y-%m-%d %H:%M:%S').timestamp()
+
+@pytest.fixture
+def clock(mocker):
+    clock = mocker.patch('suspension_cache.time.time')
+    clock.return_value = ENDS_AT - 3600
+    return clock
+
+class Loader:
+    def __init__(self, suspended=None):
+        self.suspended = suspended or {}
+        self.calls = []
+
+    def __call__(self, user_ids):
+        self.calls.append(list(user_ids))
+        return {user_id: self.suspended[user_id] for user_id in user_ids if user_id in self.suspended}
+
+def test_hits_and_misses(clock):
+    cache = SuspensionCache(ttl=60)
+    loader = Loader({'user_1': SUSPENSION_ENDS})
+    assert cache.get_many(['user_1', 'user_2'], loader) == {'user_1': SUSPENSION_ENDS, 'user_2': None}
+    assert cache.get_many(['user_1', 'user_2', 'user_3'], loader) == {'user_1': SUSPENSION_ENDS, 'user_2': None, 'user_3': None}
+    assert loader.calls == [['user_1', 'user_2'], ['user_3']]
+    assert cache.stats() == {'hits': 2, 'misses': 3, 'size': 3}
+
+def test_duplicated_user_ids_are_loaded_once(clock):
+    cache = SuspensionCache(ttl=60)
+    loader = Loader()
+    assert cache.get_many(['user_1', 'user_1'], loader) == {'user_1': None}
+    assert loader.calls == [['user_1']]
+
+def test_entries_expire_after_ttl(clock):
+    cache = SuspensionCache(ttl=60)
+    loader = Loader()
+    cache.get_many(['user_1'], loader)
+    clock.return_value += 59
+    cache.get_many(['user_1'], loader)
+    assert len(loader.calls) == 1
+    clock.return_value += 1
+    cache.get_many(['user_1'], loader)
+    assert len(loader.calls) == 2
+
+def test_suspension_expires_at_suspension_ends(clock):
+    cache = SuspensionCache(ttl=3600)
+    clock.return_value = ENDS_AT - 10
+    loader = Loader({'user_1': SUSPENSION_ENDS})
+    assert cache.get_many(['user_1'], loader) == {'user_1': SUSPENSION_ENDS}
+    clock.return_value = ENDS_AT - 1
+    cache.get_many(['user_1'], loader)
+    assert len(loader.calls) == 1
+    # The suspension ended before the ttl, it is loaded again instead of being served
+    clock.return_value = ENDS_AT
+    loader.suspended = {}
+    assert cache.get_many(['user_1'], loader) == {'user_1': None}
+    assert len(loader.calls) == 2
+
+def test_eviction_keeps_max_size(clock):
+    cache = SuspensionCache(ttl=60, max_size=3)
+    loader = Loader()
+    cache.get_many(['user_1', 'user_2'], loader)
+    cache.get_many(['user_3', 'user_4'], loader)
+    assert set(cache.entries) == {'user_2', 'user_3', 'user_4'}
+    cache.get_many([f'user_{i}' for i in range(5, 10)], loader)
+    assert set(cache.entries) == {'user_7', 'user_8', 'user_9'}
+    assert cache.stats()['size'] == 3
+
+def test_eviction_drops_expired_entries_first(clock):
+    cache = SuspensionCache(ttl=60, max_size=3)
+    loader = Loader()
+    cache.get_many(['user_1'], loader)
+    clock.return_value += 30
+    cache.get_many(['user_2', 'user_3'], loader)
+    clock.return_value += 30
+    cache.get_many(['user_4'], loader)
+    assert set(cache.entries) == {'user_2', 'user_3', 'user_4'}
+
+def test_refreshed_entry_is_not_evicted_first(clock):
+    cache = SuspensionCache(ttl=60, max_size=2)
+    loader = Loader()
+    cache.get_many(['user_1'], loader)
+    clock.return_value += 30
+    cache.get_many(['user_2'], loader)
+    clock.return_value += 30
+    cache.get_many(['user_1'], loader)
+    cache.get_many(['user_3'], loader)
+    assert set(cache.entries) == {'user_1', 'user_3'}
+
+def test_invalidate(clock):
+    cache = SuspensionCache(ttl=60)
+    loader = Loader()
+    cache.get_many(['user_1', 'user_2'], loader)
+    cache.invalidate('user_1')
+    cache.get_many(['user_1', 'user_2'], loader)
+    assert loader.calls[-1] == ['user_1']
+    cache.invalidate()
+    assert cache.stats()['size'] == 0
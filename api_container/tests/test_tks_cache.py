@@ -0,0 +1,108 @@
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+from tks_cache import TksCache, LocalCache, RedisCache
+
+# Run with the following command:
+# pytest SupportService/api_container/tests/test_tks_cache.py
+
+TK_UUID = '0b1e7c52-1b9e-4b8e-9a57-3c1c1b0e2f10'
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value.encode()
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+@pytest.fixture(params=['local', 'redis'])
+def backend(request):
+    if request.param == 'local':
+        return LocalCache()
+    return RedisCache(client=FakeRedis())
+
+def test_read_through(backend):
+    cache = TksCache('reports', backend)
+    loads = []
+    loader = lambda uuid: loads.append(uuid) or {'uuid': uuid, 'title': 'Title'}
+    assert cache.get(TK_UUID, loader) == {'uuid': TK_UUID, 'title': 'Title'}
+    assert cache.get(TK_UUID, loader) == {'uuid': TK_UUID, 'title': 'Title'}
+    assert loads == [TK_UUID]
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+def test_invalidate(backend):
+    cache = TksCache('reports', backend)
+    titles = iter(['Old Title', 'New Title'])
+    loader = lambda uuid: {'uuid': uuid, 'title': next(titles)}
+    assert cache.get(TK_UUID, loader)['title'] == 'Old Title'
+    cache.invalidate(TK_UUID)
+    assert cache.get(TK_UUID, loader)['title'] == 'New Title'
+
+def test_invalidate_during_load(backend):
+    cache = TksCache('reports', backend)
+    loads = []
+    def loader(uuid):
+        loads.append(uuid)
+        if len(loads) == 1:
+            # A write commits and invalidates while the old ticket is being loaded
+            cache.invalidate(uuid)
+            return {'uuid': uuid, 'title': 'Old Title'}
+        return {'uuid': uuid, 'title': 'New Title'}
+    assert cache.get(TK_UUID, loader)['title'] == 'Old Title'
+    assert cache.get(TK_UUID, loader)['title'] == 'New Title'
+    assert cache.get(TK_UUID, loader)['title'] == 'New Title'
+    assert len(loads) == 2
+
+def test_concurrent_stats(backend):
+    cache = TksCache('reports', backend)
+    loader = lambda uuid: {'uuid': uuid}
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda i: cache.get(TK_UUID, loader), range(200)))
+    stats = cache.stats()
+    assert stats['hits'] + stats['misses'] == 200
+
+def test_missing_tickets_are_not_cached(backend):
+    cache = TksCache('reports', backend)
+    assert cache.get(TK_UUID, lambda uuid: None) is None
+    assert cache.get(TK_UUID, lambda uuid: {'uuid': uuid}) == {'uuid': TK_UUID}
+
+def test_local_cache_expiry(mocker):
+    backend = LocalCache(ttl=10)
+    mocker.patch('tks_cache.time.monotonic', return_value=100)
+    backend.set('key', {'value': 1})
+    assert backend.get('key') == {'value': 1}
+    mocker.patch('tks_cache.time.monotonic', return_value=111)
+    assert backend.get('key') is None
+
+def test_local_cache_lru():
+    backend = LocalCache(max_size=2)
+    backend.set('a', {'value': 1})
+    backend.set('b', {'value': 2})
+    backend.get('a')
+    backend.set('c', {'value': 3})
+    assert backend.get('a') == {'value': 1}
+    assert backend.get('b') is None
+    assert backend.get('c') == {'value': 3}
+
+def test_get_many(backend):
+    cache = TksCache('reports', backend)
+    other_uuid = '7c9e6679-7425-40de-944b-e07fc1f90ae7'
+    cache.get(TK_UUID, lambda uuid: {'uuid': uuid})
+    loads = []
+    loader = lambda uuids: loads.append(uuids) or {uuid: {'uuid': uuid} for uuid in uuids if uuid == other_uuid}
+    tks = cache.get_many([TK_UUID, other_uuid, 'non_existent_uuid'], loader)
+    assert tks == {TK_UUID: {'uuid': TK_UUID}, other_uuid: {'uuid': other_uuid}}
+    assert sorted(loads[0]) == sorted([other_uuid, 'non_existent_uuid'])
@@ -0,0 +1,52 @@
+from typing import Optional
+from sqlalchemy import select, literal, union_all, tuple_
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+from lib.utils import serialize_row, encode_keyset_cursor, decode_keyset_cursor
+from reports_sql import Reports
+from helptks_sql import HelpTKs
+
+TK_TYPES = {"help_tk", "report_tk"}
+
+class Tickets:
+    """
+    Tickets class that runs the queries that span both help tickets and reports.
+    It reads the tables of the given HelpTKs and Reports managers.
+    """
+
+    def __init__(self, help_tks: HelpTKs, reports: Reports):
+        self.engine = help_tks.engine
+        self.tables = {"help_tk": help_tks.help_tks, "report_tk": reports.reports}
+
+    def get_unresolved(self, limit: int, cursor: Optional[str] = None, type: Optional[str] = None) -> tuple[list[dict], Optional[str]]:
+        """
+        Returns a page of unresolved tickets, the most recently updated first, and the cursor of the next page.
+        Each kind is read from the head of its partial (updated_at, uuid) index and
+        merged with a single UNION ALL ... ORDER BY ... LIMIT.
+        """
+        after = decode_keyset_cursor(cursor) if cursor else None
+        pages = []
+        for tk_type, table in self.tables.items():
+            if type and type != tk_type:
+                continue
+            query = select(
+                table.c.uuid, table.c.title, table.c.updated_at, literal(tk_type).label('type')
+            ).where(table.c.resolved == False)
+            if after:
+                updated_at, uuid = after
+                query = query.where(tuple_(table.c.updated_at, table.c.uuid) < tuple_(
+                    literal(updated_at, table.c.updated_at.type), literal(uuid, table.c.uuid.type)
+                ))
+            query = query.order_by(table.c.updated_at.desc(), table.c.uuid.desc()).limit(limit + 1)
+            pages.append(select(query.subquery()))
+        tks = union_all(*pages).subquery()
+        query = select(tks).order_by(tks.c.updated_at.desc(), tks.c.uuid.desc()).limit(limit + 1)
+        with self.engine.connect() as connection:
+            rows = connection.execute(query).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_keyset_cursor(rows[-1].updated_at, rows[-1].uuid)
+        return [serialize_row(row) for row in rows], next_cursor
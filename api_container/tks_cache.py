@@ -0,0 +1,194 @@
+from collections import OrderedDict
+from typing import Callable, Optional
+import json
+import logging as logger
+import os
+import sys
+import threading
+import time
+from uuid import uuid4
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lib')))
+from lib.utils import parse_uuid
+
+DEFAULT_TTL = 60 # seconds
+DEFAULT_MAX_SIZE = 10_000
+GENERATION_TTL_FACTOR = 10 # generations outlive many entries, an expired one only costs a miss
+
+class LocalCache:
+    """
+    In-process LRU cache where every entry expires after `ttl` seconds.
+    It is only shared by the threads of one worker.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, ttl: int = DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def get_many(self, keys: list[str]) -> dict:
+        values = {key: self.get(key) for key in keys}
+        return {key: value for key, value in values.items() if value is not None}
+
+    def set(self, key: str, value, ttl: Optional[int] = None):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self.lock:
+            self.entries.pop(key, None)
+
+class RedisCache:
+    """
+    Cache shared by every worker through redis, entries expire after `ttl` seconds.
+    Any client with redis' get/set/delete interface can be given (a fake one in tests).
+    """
+
+    def __init__(self, url: Optional[str] = None, ttl: int = DEFAULT_TTL, client=None):
+        if client is None:
+            import redis # Only needed when the shared cache is configured
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            value = self.client.get(key)
+        except Exception as e:
+            logger.error(f"Error reading '{key}' from redis: {e}")
+            return None
+        return json.loads(value) if value else None
+
+    def get_many(self, keys: list[str]) -> dict:
+        try:
+            values = self.client.mget(keys)
+        except Exception as e:
+            logger.error(f"Error reading {len(keys)} keys from redis: {e}")
+            return {}
+        return {key: json.loads(value) for key, value in zip(keys, values) if value}
+
+    def set(self, key: str, value, ttl: Optional[int] = None):
+        try:
+            self.client.set(key, json.dumps(value), ex=ttl or self.ttl)
+        except Exception as e:
+            logger.error(f"Error writing '{key}' to redis: {e}")
+
+    def delete(self, key: str):
+        try:
+            self.client.delete(key)
+        except Exception as e:
+            logger.error(f"Error deleting '{key}' from redis: {e}")
+
+class TksCache:
+    """
+    Read-through cache of single tickets, keyed by "<namespace>:<uuid>".
+    The managers invalidate the ticket after every mutation, entries that
+    another worker invalidated in a LocalCache live at most `ttl` seconds.
+    Every ticket has a generation ("<key>:generation") that invalidate replaces and that is
+    stored with its entry: a reader that loaded the ticket before a write caches it under
+    the previous generation, so it is never served after the invalidation.
+    """
+
+    def __init__(self, namespace: str, backend=None):
+        self.namespace = namespace
+        self.backend = backend or LocalCache()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, uuid: str) -> Optional[str]:
+        uuid = parse_uuid(uuid)
+        return f"{self.namespace}:{uuid}" if uuid else None
+
+    def _count(self, hits: int = 0, misses: int = 0):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def _new_generation(self, key: str) -> str:
+        generation = uuid4().hex
+        self.backend.set(f"{key}:generation", generation, ttl=self.backend.ttl * GENERATION_TTL_FACTOR)
+        return generation
+
+    def _cached(self, keys: list[str]) -> tuple[dict, dict]:
+        """
+        Returns { <key>: <ticket> } for the entries of the current generation, and the
+        generation of every key. Keys without one get it before their ticket is loaded.
+        """
+        values = self.backend.get_many(keys + [f"{key}:generation" for key in keys])
+        tks, generations = {}, {}
+        for key in keys:
+            entry = values.get(key)
+            generation = values.get(f"{key}:generation") or self._new_generation(key)
+            if entry and entry.get('generation') == generation:
+                tks[key] = entry['tk']
+            generations[key] = generation
+        return tks, generations
+
+    def get(self, uuid: str, loader: Callable[[str], Optional[dict]]) -> Optional[dict]:
+        key = self._key(uuid)
+        if not key:
+            return loader(uuid)
+        cached, generations = self._cached([key])
+        if key in cached:
+            self._count(hits=1)
+            return cached[key]
+        self._count(misses=1)
+        tk = loader(uuid)
+        if tk is not None:
+            self.backend.set(key, {'generation': generations[key], 'tk': tk})
+        return tk
+
+    def get_many(self, uuids: list[str], loader: Callable[[list[str]], dict]) -> dict:
+        """
+        Returns { <uuid>: <ticket> } for the tickets that exist, `loader` is called
+        once with every uuid that was not cached.
+        """
+        keys = {uuid: self._key(uuid) for uuid in set(uuids)}
+        cached, generations = self._cached([key for key in keys.values() if key])
+        tks = {uuid: cached[key] for uuid, key in keys.items() if key in cached}
+        missing = [uuid for uuid in keys if uuid not in tks]
+        self._count(hits=len(tks), misses=len(missing))
+        if missing:
+            loaded = loader(missing)
+            for uuid, tk in loaded.items():
+                if keys[uuid]:
+                    self.backend.set(keys[uuid], {'generation': generations[keys[uuid]], 'tk': tk})
+            tks.update(loaded)
+        return tks
+
+    def invalidate(self, uuid: str):
+        key = self._key(uuid)
+        if key:
+            self._new_generation(key)
+            self.backend.delete(key)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+def get_cache_backend():
+    """
+    Shared redis cache if TKS_CACHE_URL is set, in-process cache otherwise.
+    """
+    ttl = int(os.getenv('TKS_CACHE_TTL', DEFAULT_TTL))
+    url = os.getenv('TKS_CACHE_URL')
+    if url:
+        return RedisCache(url, ttl=ttl)
+    return LocalCache(ttl=ttl)
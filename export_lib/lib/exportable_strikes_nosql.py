@@ -21,6 +21,12 @@ AMMEND_STRIKE = 0.5
 
 SUSPEND_TIME = 90 # days
 
+STRIKES_INDEXES = {
+    'user_id_1': ([('user_id', ASCENDING)], {'unique': True}),
+    'suspension_ends_1': ([('suspension_ends', ASCENDING)], {}),
+    'updated_at_1': ([('updated_at', ASCENDING)], {}) # Delta sync of the suspended users replicas
+}
+
 # TODO: (General) -> Create tests for each method && add the required checks in each method
 
 class Strikes:
@@ -29,8 +35,8 @@ class Strikes:
     Fields:
     - user_id: str (unique) [pk] The id of the user
     - strikes: list(dict) The list of strikes
-    - suspensions: list(dict) The list of suspensions (dates)
-    - suspension_ends: int The timestamp of the last suspension
+    - strike_total: float The sum of the values of the active strikes
+    - suspension_ends: str The date the last suspension ends
     - created_at: int The timestamp of the creation of the strikes
     - updated_at: int The timestamp of the last update of the strikes
 
@@ -43,9 +49,7 @@ class Strikes:
     - strike_at: int The timestamp of the strike
     - updated_at: int The timestamp of the last update of the strike
 
-    Suspensions structure:
-    - suspension_at: str The date of the suspension
-    - suspension strikes: list(strikes) The list of strikes that caused the suspension
+    The suspensions history is stored by the SupportService API in the strikes-suspensions collection.
     """
 
     def __init__(self, test_client=None, test_db=None):
@@ -68,16 +72,41 @@ class Strikes:
         return True
     
     def _create_collection(self):
-        self.collection.create_index([('uuid', ASCENDING)], unique=True)
+        # The SupportService API owns the indexes (and drops the legacy ones), creating them is idempotent
+        for name, (keys, options) in STRIKES_INDEXES.items():
+            try:
+                self.collection.create_index(keys, name=name, **options)
+            except OperationFailure as e:
+                logger.error(f"Error creating index '{name}' on strikes: {e}")
     
     def check_suspension(self, user_id: str) -> Optional[str]:
-        strikes_profile = self.get(user_id)
-        if not strikes_profile or len(strikes_profile['suspensions']) == 0:
-            return None
-        suspension_ends = strikes_profile['suspension_ends']
-        if not suspension_ends:
-            return None
-        return None if get_actual_time() < suspension_ends else suspension_ends
+        """
+        Returns the date the suspension of the user ends, None if the user is not suspended.
+        """
+        return self.check_suspension_many([user_id])[user_id]
+
+    def check_suspension_many(self, user_ids: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Returns { <user_id>: <suspension_ends> | None } for every user, with one query.
+        """
+        actual_time = get_actual_time()
+        suspended = self.collection.find(
+            {'user_id': {'$in': list(set(user_ids))}, 'suspension_ends': {'$gt': actual_time}},
+            {'_id': 0, 'user_id': 1, 'suspension_ends': 1}
+        )
+        suspensions = {user['user_id']: user['suspension_ends'] for user in suspended}
+        return {user_id: suspensions.get(user_id) for user_id in user_ids}
+    
+    def get_suspended_changes(self, updated_since: Optional[str] = None) -> List[Dict]:
+        """
+        Returns the user_id and suspension_ends of the profiles updated since `updated_since`
+        (suspended or not), or of every suspended user without it.
+        """
+        if updated_since:
+            query = {'updated_at': {'$gte': updated_since}}
+        else:
+            query = {'suspension_ends': {'$gt': get_actual_time()}}
+        return list(self.collection.find(query, {'_id': 0, 'user_id': 1, 'suspension_ends': 1}))
     
     def get_all_suspendend(self) -> set[Dict]:
         actual_time = get_actual_time()
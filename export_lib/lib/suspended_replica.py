@@ -0,0 +1,118 @@
+from typing import Optional
+import datetime
+import json
+import logging as logger
+import os
+import threading
+import time
+
+DEFAULT_REFRESH_INTERVAL = 30 # seconds
+SYNC_OVERLAP = 60 # seconds, covers the writes in flight and the clock skew between servers
+
+class SuspendedReplica:
+    """
+    Local copy of { <user_id>: <suspension_ends> } for the suspended users.
+    The first sync reads every suspended user (or loads `snapshot_path`), the next ones
+    only read the profiles updated since the previous sync, in a background thread.
+    A suspension that ends needs no sync, it is checked against suspension_ends.
+    Membership checks are a dict lookup, stale by at most `refresh_interval` seconds
+    plus the time a sync takes.
+    """
+
+    def __init__(self, strikes, refresh_interval: int = DEFAULT_REFRESH_INTERVAL, snapshot_path: Optional[str] = None):
+        self.strikes = strikes
+        self.refresh_interval = refresh_interval
+        self.snapshot_path = snapshot_path
+        self.suspended = {}
+        self.synced_since = None
+        self.last_sync = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if not self._load_snapshot():
+            self.sync()
+        self.thread = threading.Thread(target=self._refresh, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def _refresh(self):
+        while not self.stop_event.wait(self.refresh_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Error syncing the suspended users: {e}")
+
+    def sync(self) -> int:
+        """
+        Applies the changes since the previous sync and returns how many profiles were read.
+        """
+        started_at = datetime.datetime.now()
+        changes = self.strikes.get_suspended_changes(self.synced_since)
+        now = _format(started_at)
+        # A new dict is built and swapped in, readers never see a half applied sync
+        suspended = dict(self.suspended) if self.synced_since else {}
+        for profile in changes:
+            suspension_ends = profile.get('suspension_ends')
+            if suspension_ends and suspension_ends > now:
+                suspended[profile['user_id']] = suspension_ends
+            else:
+                suspended.pop(profile['user_id'], None)
+        self.suspended = {user_id: ends for user_id, ends in suspended.items() if ends > now}
+        self.synced_since = _format(started_at - datetime.timedelta(seconds=SYNC_OVERLAP))
+        self.last_sync = time.monotonic()
+        if self.snapshot_path:
+            self._save_snapshot()
+        return len(changes)
+
+    def suspension_ends(self, user_id: str) -> Optional[str]:
+        suspension_ends = self.suspended.get(user_id)
+        if not suspension_ends or suspension_ends <= _format(datetime.datetime.now()):
+            return None
+        return suspension_ends
+
+    def is_suspended(self, user_id: str) -> bool:
+        return self.suspension_ends(user_id) is not None
+
+    def users(self) -> set[str]:
+        now = _format(datetime.datetime.now())
+        return set(user_id for user_id, ends in self.suspended.items() if ends > now)
+
+    def staleness(self) -> Optional[float]:
+        """
+        Seconds since the last successful sync, None before the first one.
+        """
+        return None if self.last_sync is None else time.monotonic() - self.last_sync
+
+    def _save_snapshot(self):
+        try:
+            with open(f"{self.snapshot_path}.part", "w") as file:
+                json.dump({'synced_since': self.synced_since, 'suspended': self.suspended}, file)
+            os.replace(f"{self.snapshot_path}.part", self.snapshot_path)
+        except OSError as e:
+            logger.error(f"Error saving the suspended users snapshot: {e}")
+
+    def _load_snapshot(self) -> bool:
+        """
+        Starts from the snapshot and syncs the changes made since it was saved.
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path) as file:
+                snapshot = json.load(file)
+            self.suspended = snapshot['suspended']
+            self.synced_since = snapshot['synced_since']
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Error loading the suspended users snapshot: {e}")
+            self.suspended, self.synced_since = {}, None
+            return False
+        self.sync()
+        return True
+
+def _format(date: datetime.datetime) -> str:
+    return date.strftime('%Y-%m-%d %H:%M:%S')
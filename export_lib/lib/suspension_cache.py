@@ -0,0 +1,76 @@
+from typing import Callable, Dict, List, Optional
+import datetime
+import threading
+import time
+
+DEFAULT_TTL = 60 # seconds
+DEFAULT_MAX_SIZE = 100_000
+
+class SuspensionCache:
+    """
+    In-process cache of { <user_id>: <suspension_ends> | None }.
+    Every entry expires after `ttl` seconds, and a suspension never outlives its
+    suspension_ends, so a lifted suspension is not served from the cache.
+    A user suspended after being cached as not suspended is seen at most `ttl` seconds later.
+    """
+
+    def __init__(self, ttl: int = DEFAULT_TTL, max_size: int = DEFAULT_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _expires_at(self, suspension_ends: Optional[str]) -> float:
+        expires_at = time.time() + self.ttl
+        if suspension_ends:
+            ends = datetime.datetime.strptime(suspension_ends, '%Y-%m-%d %H:%M:%S').timestamp()
+            expires_at = min(expires_at, ends)
+        return expires_at
+
+    def get_many(self, user_ids: List[str], loader: Callable[[List[str]], Dict[str, Optional[str]]]) -> Dict[str, Optional[str]]:
+        """
+        Returns { <user_id>: <suspension_ends> | None }, `loader` is called
+        once with every user_id that was not cached.
+        """
+        now = time.time()
+        result, missing = {}, []
+        with self.lock:
+            for user_id in dict.fromkeys(user_ids):
+                entry = self.entries.get(user_id)
+                if entry and entry[0] > now:
+                    result[user_id] = entry[1]
+                else:
+                    missing.append(user_id)
+            self.hits += len(result)
+            self.misses += len(missing)
+        if missing:
+            loaded = loader(missing)
+            with self.lock:
+                for user_id in missing:
+                    suspension_ends = loaded.get(user_id)
+                    # Popped first so a refreshed entry is the newest one again
+                    self.entries.pop(user_id, None)
+                    self.entries[user_id] = (self._expires_at(suspension_ends), suspension_ends)
+                if len(self.entries) > self.max_size:
+                    self._evict(now)
+            result.update({user_id: loaded.get(user_id) for user_id in missing})
+        return result
+
+    def _evict(self, now: float):
+        """
+        Drops the expired entries, then the oldest ones until at most `max_size` are left.
+        """
+        entries = [(user_id, entry) for user_id, entry in self.entries.items() if entry[0] > now]
+        self.entries = dict(entries[max(len(entries) - self.max_size, 0):])
+
+    def invalidate(self, user_id: Optional[str] = None):
+        with self.lock:
+            if user_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
@@ -1,12 +1,54 @@
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from imported_lib.SupportService.lib.exportable_strikes_nosql import Strikes
+from imported_lib.SupportService.lib.suspension_cache import SuspensionCache
+from imported_lib.SupportService.lib.suspended_replica import SuspendedReplica
 
 class SupportLib:
-    def __init__(self, test_client=None):
+    """
+    With `cache_ttl` (seconds) the suspension checks are cached in-process,
+    a suspension is never cached past its end and a new one is seen at most `cache_ttl` seconds later.
+    With `replica_interval` (seconds) the suspended users are kept in memory and synced
+    in the background, the checks never query MongoDB and are stale by about `replica_interval` seconds.
+    `replica_snapshot` is a file to save the replica to, so a restart only syncs the changes since.
+    """
+
+    def __init__(self, test_client=None, cache_ttl: Optional[int] = None, replica_interval: Optional[int] = None, replica_snapshot: Optional[str] = None):
         self.strikes = Strikes(test_client)
+        self.cache = SuspensionCache(ttl=cache_ttl) if cache_ttl else None
+        self.replica = None
+        if replica_interval:
+            self.replica = SuspendedReplica(self.strikes, replica_interval, replica_snapshot)
+            self.replica.start()
 
     def check_suspension(self, user_id: str) -> Optional[str]:
-        return self.strikes.check_suspension(user_id)
+        return self.check_suspension_many([user_id])[user_id]
+
+    def check_suspension_many(self, user_ids: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Returns { <user_id>: <suspension_ends> | None }, with at most one query for all the users.
+        """
+        if not user_ids:
+            return {}
+        if self.replica:
+            return {user_id: self.replica.suspension_ends(user_id) for user_id in user_ids}
+        if not self.cache:
+            return self.strikes.check_suspension_many(user_ids)
+        return self.cache.get_many(user_ids, self.strikes.check_suspension_many)
+
+    def is_suspended(self, user_id: str) -> bool:
+        return self.check_suspension(user_id) is not None
+
+    def cache_stats(self) -> Optional[dict]:
+        return self.cache.stats() if self.cache else None
+
+    def replica_staleness(self) -> Optional[float]:
+        return self.replica.staleness() if self.replica else None
     
     def get_all_users_suspended(self) -> set[Dict]:
-        return self.strikes.get_all_suspendend()
\ No newline at end of file
+        if self.replica:
+            return self.replica.users()
+        return self.strikes.get_all_suspendend()
+
+    def close(self):
+        if self.replica:
+            self.replica.stop()
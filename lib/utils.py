@@ -1,6 +1,10 @@
+import base64
 import datetime
+import email.utils
+import json
 import os
 import time
+import uuid
 from typing import Optional, Union
 from fastapi import HTTPException
 from sqlalchemy import create_engine
@@ -21,11 +25,25 @@ def time_to_string(time_in_seconds: float) -> str:
     return f"{minutes}m {seconds}s {millis}ms"
 
 def get_engine() -> Optional[create_engine]:
+    # The session reads and casts timestamps in the app time zone, so date() and
+    # naive values agree with the local times the app formats
     return create_engine(
         f"postgresql+psycopg2://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}@{os.getenv('POSTGRES_HOST')}:{os.getenv('POSTGRES_PORT')}/{os.getenv('POSTGRES_DB')}",
+        connect_args={"options": f"-c timezone={get_local_timezone()}"},
         echo=True
     )
 
+def get_local_timezone() -> str:
+    """
+    Name of the app time zone: the TZ variable, else the /etc/localtime zone, else UTC
+    """
+    if os.getenv('TZ'):
+        return os.getenv('TZ').lstrip(':')
+    localtime = os.path.realpath('/etc/localtime')
+    if '/zoneinfo/' in localtime:
+        return localtime.split('/zoneinfo/', 1)[1]
+    return 'UTC'
+
 def get_test_engine():
     database_url = os.getenv('DATABASE_URL', 'sqlite:///test.db')  # Default to a SQLite database for testing
     return create_engine(database_url)
@@ -33,6 +51,70 @@ def get_test_engine():
 def get_actual_time() -> str:
     return datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
 
+def parse_time(time: str) -> datetime.datetime:
+    return datetime.datetime.strptime(time, '%Y-%m-%d %H:%M:%S')
+
+def parse_local_time(time: str) -> datetime.datetime:
+    """
+    Parses a local 'YYYY-MM-DD HH:MM:SS' time as a timezone aware datetime, to bind it into timestamptz columns
+    """
+    return parse_time(time).astimezone()
+
+def format_time(time: datetime.datetime) -> str:
+    if time.tzinfo:
+        time = time.astimezone()
+    return time.strftime('%Y-%m-%d %H:%M:%S')
+
+def to_http_date(time: str) -> str:
+    """
+    Formats a local 'YYYY-MM-DD HH:MM:SS' time as an HTTP date (Last-Modified header)
+    """
+    return email.utils.format_datetime(parse_time(time).astimezone(datetime.timezone.utc), usegmt=True)
+
+def parse_uuid(value) -> Optional[uuid.UUID]:
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+def serialize_row(row) -> dict:
+    """
+    Returns the row as a dict, with uuids and datetimes formatted as the strings the API always returned
+    """
+    result = {}
+    for key, value in row._asdict().items():
+        if isinstance(value, uuid.UUID):
+            value = str(value)
+        elif isinstance(value, datetime.datetime):
+            value = format_time(value)
+        result[key] = value
+    return result
+
+def encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def encode_keyset_cursor(time: datetime.datetime, uuid: uuid.UUID) -> str:
+    return encode_cursor(time.isoformat(), str(uuid))
+
+def decode_keyset_cursor(cursor: str) -> tuple[datetime.datetime, uuid.UUID]:
+    try:
+        time, value = decode_cursor(cursor)
+        time = datetime.datetime.fromisoformat(time)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    value = parse_uuid(value)
+    if not value:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return time, value
+
 def get_time_plus_days(days: int) -> str:
     return datetime.datetime.fromtimestamp(time.time() + days * DAY).strftime('%Y-%m-%d %H:%M:%S')
 